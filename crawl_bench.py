@@ -0,0 +1,229 @@
+"""End-to-end crawl benchmark against a synthetic local website.
+
+    python crawl_bench.py --pages 2000 --fanout 8 --workers 8 --json out.json
+    python crawl_bench.py --baseline out.json    # exits 1 on a regression
+"""
+
+import argparse
+import json
+import random
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import crawler
+import graph
+import indexer
+import linkprovider
+import metrics
+
+_WORDS = ('search engine crawler index graph rank link page content text '
+          'query document token fetch parse extract store serve shard '
+          'replica partition stream batch cache latency throughput').split()
+
+
+class SyntheticSite:
+    """ Deterministic website of numbered pages served over local HTTP
+
+    Page i links to fanout pages drawn from a generator seeded with
+    (seed, i), is padded with words to about page_size bytes and answers
+    500 with probability error_rate. Every response is delayed by latency
+    seconds to stand in for the network.
+
+    Attributes:
+        pages: number of pages, /page/0 is the seed
+        fanout: links per page
+        page_size: approximate body size in bytes
+        latency: seconds slept before each response
+        error_rate: fraction of pages that always fail
+        seed: makes the site reproducible
+    """
+
+    def __init__(self,
+                 pages: int = 1000,
+                 fanout: int = 8,
+                 page_size: int = 16 * 1024,
+                 latency: float = 0.0,
+                 error_rate: float = 0.0,
+                 seed: int = 0):
+        self.pages = pages
+        self.fanout = fanout
+        self.page_size = page_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.seed = seed
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are separate writes on a kept-alive
+            # connection, Nagle would hold the body for the delayed ACK
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                status, body = site.render(self.path)
+                if site.latency:
+                    time.sleep(site.latency)
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def render(self, path: str) -> tuple[int, bytes]:
+        prefix = '/page/'
+        if not path.startswith(prefix) or not path[len(prefix):].isdigit():
+            return 404, b'not found'
+        number = int(path[len(prefix):])
+        if number >= self.pages:
+            return 404, b'not found'
+        rng = random.Random(f'{self.seed}:{number}')
+        if rng.random() < self.error_rate:
+            return 500, b'error'
+        links = ''.join(
+            f'<a href="{self.base_url}/page/{rng.randrange(self.pages)}">'
+            f'{rng.choice(_WORDS)}</a>\n' for _ in range(self.fanout))
+        head = (f'<html><head><title>page {number} {rng.choice(_WORDS)}'
+                f'</title></head><body>\n{links}<p>')
+        words = []
+        size = len(head)
+        while size < self.page_size:
+            word = rng.choice(_WORDS)
+            words.append(word)
+            size += len(word) + 1
+        return 200, (head + ' '.join(words) + '</p></body></html>').encode()
+
+
+def run(site: SyntheticSite,
+        workers: int = 1,
+        trace_memory: bool = False) -> dict:
+    """ Crawls site from /page/0 until no link is due, returns the report """
+    g = graph.GraphInMemory(lock_stripes=16 if workers > 1 else 0)
+    index = indexer.IndexerInMemory()
+    registry = metrics.Registry()
+    pipeline = crawler.Crawler(g, index, workers=workers, registry=registry)
+    provider = linkprovider.LinkProvider(
+        g, partitions=1, frontier_size=site.pages,
+        min_age=timedelta(hours=1))
+    g.upsert_link(graph.Link(url=f'{site.base_url}/page/0'))
+
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    fetched = completed = passes = 0
+    while True:
+        links = list(provider.links())
+        if not links:
+            break
+        passes += 1
+        fetched += len(links)
+        completed += pipeline.run(iter(links))
+    elapsed = time.perf_counter() - start
+    traced_peak = tracemalloc.get_traced_memory()[1] if trace_memory else 0
+    if trace_memory:
+        tracemalloc.stop()
+
+    stage_seconds = {}
+    for name, labels, value in registry.histogram(
+            'crawler_stage_seconds', '', ('stage',)).samples():
+        if name == '_sum':
+            stage_seconds[labels[0]] = round(value, 4)
+    return {
+        'pages': site.pages,
+        'fanout': site.fanout,
+        'page_size': site.page_size,
+        'latency': site.latency,
+        'error_rate': site.error_rate,
+        'workers': workers,
+        'passes': passes,
+        'fetched': fetched,
+        'completed': completed,
+        'seconds': round(elapsed, 4),
+        'pages_per_second': round(fetched / elapsed, 2) if elapsed else 0.0,
+        'stage_seconds': stage_seconds,
+        'fetched_bytes': int(registry.counter(
+            'crawler_fetched_bytes_total', '').value()),
+        'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'traced_peak_bytes': traced_peak,
+        'links': len(g.links),
+        'edges': len(g.edges),
+        'documents': len(index.documents),
+        'index_tokens': len(index.index),
+    }
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=1000)
+    parser.add_argument('--fanout', type=int, default=8)
+    parser.add_argument('--page-size', type=int, default=16 * 1024)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='report the Python heap peak, slows the run')
+    parser.add_argument('--json', help='write the report to this file')
+    parser.add_argument('--baseline',
+                        help='report to compare pages_per_second against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed fractional slowdown vs baseline')
+    args = parser.parse_args(argv)
+
+    with SyntheticSite(pages=args.pages, fanout=args.fanout,
+                       page_size=args.page_size, latency=args.latency,
+                       error_rate=args.error_rate, seed=args.seed) as site:
+        report = run(site, workers=args.workers,
+                     trace_memory=args.trace_memory)
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)['pages_per_second']
+        floor = baseline * (1 - args.tolerance)
+        if report['pages_per_second'] < floor:
+            print(f'regression: {report["pages_per_second"]} pages/s < '
+                  f'{floor:.2f} ({baseline} - {args.tolerance:.0%})',
+                  file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
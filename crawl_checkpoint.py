@@ -0,0 +1,180 @@
+"""Crawl checkpoints, so an interrupted pass resumes where it stopped."""
+
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Iterable, Iterator
+import crawler
+import graph
+import linkprovider
+
+_VERSION = 1
+
+
+class CrawlCheckpoint:
+    """ Progress of one crawl pass, saved atomically as a small JSON file
+
+    The file holds the pass start, which is the retrieved_before of every
+    partition scan, the partitions already done and, for the partition in
+    progress, the last link ID up to which every link has been crawled.
+    Links are completed out of order by a multi-worker Crawler, so that
+    watermark only moves past a link once all links yielded before it are
+    crawled too; a resumed partition may crawl the few links after the
+    watermark again, but never skips one.
+
+    The file is rewritten at most every interval seconds while a partition
+    is crawled, whenever a partition is done, and removed by finish().
+
+    Attributes:
+        path: checkpoint file
+        interval: minimum seconds between saves within a partition
+        partitions: partition count of the pass, a checkpoint saved with
+            another count is ignored
+        started_at: start of the pass, restored when resuming
+    """
+
+    def __init__(self, path: str, partitions: int = 16,
+                 interval: float = 10.0):
+        self.path = path
+        self.partitions = partitions
+        self.interval = interval
+        self.started_at: datetime = None
+        self._done: set[uuid.UUID] = set()
+        self._watermarks: dict[uuid.UUID, uuid.UUID] = {}
+        self._in_flight: dict[uuid.UUID, OrderedDict] = {}
+        self._saved_at = 0.0
+        self._lock = threading.Lock()
+        self._load()
+
+    @property
+    def resumed(self) -> bool:
+        return self.started_at is not None
+
+    def begin(self, now: datetime = None) -> datetime:
+        """ Returns the pass start, the restored one when resuming """
+        with self._lock:
+            if self.started_at is None:
+                self.started_at = now or datetime.utcnow()
+                self._save()
+            return self.started_at
+
+    def is_done(self, from_id: uuid.UUID) -> bool:
+        return from_id in self._done
+
+    def watermark(self, from_id: uuid.UUID) -> uuid.UUID:
+        """ Last link ID of the partition crawled with all before it, or
+            None
+        """
+        return self._watermarks.get(from_id)
+
+    def track(self, from_id: uuid.UUID,
+              links: Iterable[graph.Link]) -> Iterator[graph.Link]:
+        """ Yields links, remembering their order for crawled() """
+        in_flight = self._in_flight.setdefault(from_id, OrderedDict())
+        for link in links:
+            with self._lock:
+                in_flight[link.link_id] = False
+            yield link
+
+    def crawled(self, from_id: uuid.UUID, link: graph.Link):
+        """ Marks a tracked link crawled, advancing the watermark over the
+            leading crawled links and saving if interval has passed
+        """
+        with self._lock:
+            in_flight = self._in_flight[from_id]
+            in_flight[link.link_id] = True
+            while in_flight and next(iter(in_flight.values())):
+                self._watermarks[from_id] = in_flight.popitem(last=False)[0]
+            if time.monotonic() - self._saved_at >= self.interval:
+                self._save()
+
+    def complete(self, from_id: uuid.UUID):
+        with self._lock:
+            self._done.add(from_id)
+            self._watermarks.pop(from_id, None)
+            self._in_flight.pop(from_id, None)
+            self._save()
+
+    def finish(self):
+        """ Forgets the pass once every partition is done """
+        with self._lock:
+            self.started_at = None
+            self._done.clear()
+            self._watermarks.clear()
+            self._in_flight.clear()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def _load(self):
+        try:
+            with open(self.path) as file:
+                state = json.load(file)
+        except FileNotFoundError:
+            return
+        if state.get('version') != _VERSION \
+                or state.get('partitions') != self.partitions:
+            return
+        self.started_at = datetime.fromisoformat(state['started_at'])
+        self._done = {uuid.UUID(from_id) for from_id in state['done']}
+        self._watermarks = {uuid.UUID(from_id): uuid.UUID(link_id)
+                            for from_id, link_id
+                            in state['watermarks'].items()}
+
+    def _save(self):
+        """ Writes a temporary file and renames it over the checkpoint, so a
+            crash leaves either the old or the new checkpoint
+        """
+        state = {
+            'version': _VERSION,
+            'partitions': self.partitions,
+            'started_at': self.started_at.isoformat(),
+            'done': sorted(str(from_id) for from_id in self._done),
+            'watermarks': {str(from_id): str(link_id) for from_id, link_id
+                           in self._watermarks.items()},
+        }
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.path)
+        self._saved_at = time.monotonic()
+
+
+def run_pass(pipeline: crawler.Crawler,
+             g: graph.Graph,
+             checkpoint: CrawlCheckpoint,
+             provider: linkprovider.LinkProvider = None) -> int:
+    """ Crawls one pass partition by partition, resuming from checkpoint
+
+    Without a provider every partition is streamed with links_iter in link
+    ID order, and a resumed partition starts right after its watermark.
+    A provider's frontier is ordered by score instead, so a resumed
+    partition is scanned again; the links crawled before the interruption
+    are no longer candidates, as their retrieval is within the provider's
+    min_age or their CrawlStatus is not due.
+
+    Returns how many links made it through all stages.
+    """
+    now = checkpoint.begin()
+    completed = 0
+    for from_id, to_id in graph.partition_ranges(checkpoint.partitions):
+        if checkpoint.is_done(from_id):
+            continue
+        watermark = checkpoint.watermark(from_id)
+        if provider is not None:
+            links = provider.partition(from_id, to_id, now)
+        else:
+            start = from_id if watermark is None \
+                else uuid.UUID(int=watermark.int + 1)
+            links = g.links_iter(start, to_id, retrieved_before=now)
+        completed += pipeline.run(
+            checkpoint.track(from_id, links),
+            on_crawled=lambda link, key=from_id: checkpoint.crawled(key, link))
+        checkpoint.complete(from_id)
+    checkpoint.finish()
+    return completed
@@ -0,0 +1,86 @@
+"""CrawlCheckpointTestCase"""
+
+import os
+import tempfile
+import unittest
+import uuid
+from datetime import datetime
+import crawl_checkpoint
+import crawler
+import graph
+import indexer
+import metrics
+
+
+class RecordingStage(crawler.Processor):
+    """ Records crawled URLs, raising once fail_at links were crawled """
+
+    def __init__(self, fail_at: int = None):
+        self.fail_at = fail_at
+        self.urls = []
+
+    def process(self, payload):
+        if len(self.urls) == self.fail_at:
+            raise RuntimeError('crawler died')
+        self.urls.append(payload.url)
+        return payload
+
+
+class CrawlCheckpointTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'crawl.json')
+
+    def test_watermark_waits_for_earlier_links(self):
+        checkpoint = crawl_checkpoint.CrawlCheckpoint(self.path, interval=0)
+        started_at = checkpoint.begin(datetime(2020, 1, 1))
+        from_id = uuid.UUID(int=0)
+        links = [graph.Link(link_id=uuid.UUID(int=number))
+                 for number in range(1, 4)]
+        tracked = list(checkpoint.track(from_id, links))
+        checkpoint.crawled(from_id, tracked[1])
+        self.assertIsNone(checkpoint.watermark(from_id))
+        checkpoint.crawled(from_id, tracked[0])
+        self.assertEqual(checkpoint.watermark(from_id), links[1].link_id)
+
+        resumed = crawl_checkpoint.CrawlCheckpoint(self.path)
+        self.assertTrue(resumed.resumed)
+        self.assertEqual(resumed.begin(), started_at)
+        self.assertEqual(resumed.watermark(from_id), links[1].link_id)
+        self.assertFalse(crawl_checkpoint.CrawlCheckpoint(
+            self.path, partitions=4).resumed)
+
+    def test_resumes_interrupted_pass(self):
+        g = graph.GraphInMemory()
+        urls = {g.upsert_link(graph.Link(url=f'http://{number}')).url
+                for number in range(20)}
+
+        first = self._pipeline(g, fail_at=7)
+        checkpoint = crawl_checkpoint.CrawlCheckpoint(self.path,
+                                                      partitions=4,
+                                                      interval=0)
+        with self.assertRaises(RuntimeError):
+            crawl_checkpoint.run_pass(first, g, checkpoint)
+        crawled = set(first.stages[0].urls)
+        self.assertEqual(len(crawled), 7)
+
+        second = self._pipeline(g)
+        checkpoint = crawl_checkpoint.CrawlCheckpoint(self.path,
+                                                      partitions=4)
+        self.assertTrue(checkpoint.resumed)
+        self.assertEqual(crawl_checkpoint.run_pass(second, g, checkpoint),
+                         13)
+        self.assertEqual(crawled | set(second.stages[0].urls), urls)
+        self.assertFalse(crawled & set(second.stages[0].urls))
+        self.assertFalse(os.path.exists(self.path))
+
+    def _pipeline(self, g: graph.Graph, fail_at: int = None):
+        pipeline = crawler.Crawler(g, indexer.IndexerInMemory(),
+                                   registry=metrics.Registry())
+        pipeline.stages = [RecordingStage(fail_at)]
+        return pipeline
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,360 @@
+"""Multi-process crawl coordinator."""
+
+import multiprocessing
+import time
+import uuid
+from datetime import datetime, timedelta
+from multiprocessing.connection import Connection, wait
+from typing import Callable, Iterator
+import crawler
+import graph
+import indexer as idx
+import linkprovider
+import metrics
+
+
+class Lease:
+    """ Time-limited claim of a worker on a partition of the link ID space
+
+    Attributes:
+        partition: index into graph.partition_ranges
+        from_id: first link ID of the partition
+        to_id: link ID the partition ends before
+        worker: holder of the lease
+        expires_at: time.monotonic() after which the lease can be reassigned
+    """
+    __slots__ = 'partition', 'from_id', 'to_id', 'worker', 'expires_at'
+
+    def __init__(self,
+                 partition: int,
+                 from_id: uuid.UUID,
+                 to_id: uuid.UUID,
+                 worker: int,
+                 expires_at: float):
+        self.partition = partition
+        self.from_id = from_id
+        self.to_id = to_id
+        self.worker = worker
+        self.expires_at = expires_at
+
+
+class LeaseTable:
+    """ Leases the partitions of one crawl pass, each until completed once
+
+    Attributes:
+        duration: seconds a lease lasts unless renewed
+        reassigned: leases handed to another worker after expiry or death
+    """
+
+    def __init__(self, partitions: int, duration: float):
+        self.duration = duration
+        self.reassigned = 0
+        self._ranges = graph.partition_ranges(partitions)
+        self._leases: dict[int, Lease] = {}
+        self._lost: set[int] = set()
+        self._done: set[int] = set()
+
+    @property
+    def finished(self) -> bool:
+        return len(self._done) == len(self._ranges)
+
+    @property
+    def leased(self) -> int:
+        return len(self._leases)
+
+    @property
+    def done(self) -> int:
+        return len(self._done)
+
+    def acquire(self, worker: int, now: float = None) -> Lease:
+        """ Leases the first partition neither done nor held, None if all
+            are
+        """
+        now = time.monotonic() if now is None else now
+        for partition, (from_id, to_id) in enumerate(self._ranges):
+            if partition in self._done:
+                continue
+            lease = self._leases.get(partition)
+            if lease is not None and lease.expires_at > now:
+                continue
+            if lease is not None or partition in self._lost:
+                self._lost.discard(partition)
+                self.reassigned += 1
+            lease = self._leases[partition] = Lease(
+                partition, from_id, to_id, worker, now + self.duration)
+            return lease
+        return None
+
+    def renew(self, partition: int, worker: int, now: float = None) -> bool:
+        """ Extends the worker's lease, False if it was reassigned """
+        lease = self._leases.get(partition)
+        if lease is None or lease.worker != worker:
+            return False
+        now = time.monotonic() if now is None else now
+        lease.expires_at = now + self.duration
+        return True
+
+    def complete(self, partition: int, worker: int) -> bool:
+        """ Marks the partition done, False if the worker lost the lease """
+        lease = self._leases.get(partition)
+        if lease is None or lease.worker != worker:
+            return False
+        del self._leases[partition]
+        self._done.add(partition)
+        return True
+
+    def release(self, worker: int) -> int:
+        """ Frees the leases of a dead worker, returns how many it held """
+        partitions = [partition for partition, lease in self._leases.items()
+                      if lease.worker == worker]
+        for partition in partitions:
+            del self._leases[partition]
+            self._lost.add(partition)
+        return len(partitions)
+
+
+class CrawlCoordinator:
+    """ Crawls the graph with worker processes leasing link ID partitions
+
+    Every pass splits the link ID space into partitions. Idle workers lease
+    one at a time, crawl the LinkProvider candidates of its range with their
+    own Crawler, and renew the lease as they go. A lease that is not renewed
+    within lease_duration is handed to the next idle worker, and the leases
+    of a worker that dies are handed out at once while a replacement is
+    started, so a hung or crashed worker delays its partition but never
+    stalls the pass.
+
+    Workers build their graph and indexer with graph_factory and
+    indexer_factory, which must be picklable and return backends that are
+    safe to share between processes, for example a functools.partial of
+    graph_sqlite.GraphSQLite with a small batch_size and of
+    indexer_whoosh.IndexerWhoosh. Both are committed after every partition
+    and closed when the worker exits.
+
+    Progress is aggregated from the workers' renewals and completions into
+    coordinator_* metrics and the dict returned by run().
+
+    Attributes:
+        workers: worker processes
+        partitions: partitions per pass
+        lease_duration: seconds a partition stays leased without renewal,
+            must exceed a partition scan
+        max_restarts: replacements started for dead workers per run
+        crawler_workers: links each worker process crawls concurrently
+        min_age: LinkProvider.min_age
+        context: multiprocessing start method
+    """
+
+    def __init__(self,
+                 graph_factory: Callable[[], graph.Graph],
+                 indexer_factory: Callable[[], idx.Indexer],
+                 workers: int = None,
+                 partitions: int = None,
+                 lease_duration: float = 60.0,
+                 max_restarts: int = None,
+                 crawler_workers: int = 1,
+                 min_age: timedelta = timedelta(hours=1),
+                 context: str = 'spawn',
+                 registry: metrics.Registry = metrics.REGISTRY):
+        self.graph_factory = graph_factory
+        self.indexer_factory = indexer_factory
+        self.workers = workers or multiprocessing.cpu_count()
+        self.partitions = partitions or 4 * self.workers
+        self.lease_duration = lease_duration
+        self.max_restarts = self.workers if max_restarts is None \
+            else max_restarts
+        self.crawler_workers = crawler_workers
+        self.min_age = min_age
+        self.context = multiprocessing.get_context(context)
+        self._next_worker = 0
+        self._partitions = registry.gauge(
+            'coordinator_partitions', 'Partitions of the current pass',
+            ('state',))
+        self._links = registry.counter(
+            'coordinator_links_total', 'Links crawled by workers',
+            ('outcome',))
+        self._reassigned = registry.counter(
+            'coordinator_reassigned_total', 'Leases taken from a worker')
+        self._restarts = registry.counter(
+            'coordinator_worker_restarts_total', 'Dead workers replaced')
+
+    def run(self, passes: int = 1) -> dict:
+        """ Crawls up to passes passes, stopping after one that fetched
+            nothing, and returns the aggregated progress
+        """
+        progress = {'passes': 0, 'partitions': 0, 'fetched': 0,
+                    'completed': 0, 'reassigned': 0, 'restarts': 0}
+        workers: dict[Connection, tuple[int, multiprocessing.Process]] = {}
+        parked: list[Connection] = []     # idle workers waiting for a lease
+        try:
+            for _ in range(self.workers):
+                self._spawn(workers)
+            for _ in range(passes):
+                fetched = progress['fetched']
+                self._pass(workers, parked, progress)
+                progress['passes'] += 1
+                if progress['fetched'] == fetched or not workers:
+                    break
+        finally:
+            self._stop(workers)
+        return progress
+
+    def _pass(self, workers: dict, parked: list[Connection], progress: dict):
+        table = LeaseTable(self.partitions, self.lease_duration)
+        now = datetime.utcnow()
+        counts: dict[int, tuple[int, int]] = {}  # fetched, completed so far
+        reassigned = 0
+        while not table.finished and workers:
+            ready = wait(list(workers) + [process.sentinel for _, process
+                                          in workers.values()],
+                         timeout=self.lease_duration / 4)
+            for connection, (worker, process) in list(workers.items()):
+                while connection in ready and connection.poll():
+                    try:
+                        message = connection.recv()
+                    except EOFError:
+                        break
+                    self._handle(table, worker, connection, message, counts,
+                                 progress, parked)
+                if process.sentinel in ready or not process.is_alive():
+                    process.join()
+                    del workers[connection]
+                    connection.close()
+                    if connection in parked:
+                        parked.remove(connection)
+                    table.release(worker)
+                    if progress['restarts'] < self.max_restarts:
+                        progress['restarts'] += 1
+                        self._restarts.inc()
+                        self._spawn(workers)
+            while parked:
+                worker = workers[parked[0]][0]
+                lease = table.acquire(worker)
+                if lease is None:
+                    break
+                parked.pop(0).send((lease, now))
+            self._reassigned.inc(table.reassigned - reassigned)
+            reassigned = table.reassigned
+            self._partitions.set(table.leased, state='leased')
+            self._partitions.set(table.done, state='done')
+            self._partitions.set(self.partitions - table.leased - table.done,
+                                 state='pending')
+        progress['partitions'] += table.done
+        progress['reassigned'] += table.reassigned
+
+    def _handle(self, table: LeaseTable, worker: int, connection: Connection,
+                message: tuple, counts: dict, progress: dict,
+                parked: list[Connection]):
+        kind = message[0]
+        if kind == 'acquire':
+            parked.append(connection)
+        elif kind == 'renew':
+            _, partition, fetched, completed = message
+            renewed = table.renew(partition, worker)
+            if renewed:
+                self._count(counts, progress, partition, fetched, completed)
+            connection.send(renewed)
+        elif kind == 'done':
+            _, partition, fetched, completed = message
+            if table.complete(partition, worker):
+                self._count(counts, progress, partition, fetched, completed)
+
+    def _count(self, counts: dict, progress: dict, partition: int,
+               fetched: int, completed: int):
+        """ Adds what the partition's holder crawled since its last report
+
+        A reassigned partition is crawled again from the start, so only
+        counts beyond the previous holder's are new.
+        """
+        previous_fetched, previous_completed = counts.get(partition, (0, 0))
+        if fetched > previous_fetched:
+            progress['fetched'] += fetched - previous_fetched
+            self._links.inc(fetched - previous_fetched, outcome='fetched')
+        if completed > previous_completed:
+            progress['completed'] += completed - previous_completed
+            self._links.inc(completed - previous_completed,
+                            outcome='completed')
+        counts[partition] = (max(fetched, previous_fetched),
+                             max(completed, previous_completed))
+
+    def _spawn(self, workers: dict):
+        worker = self._next_worker
+        self._next_worker += 1
+        connection, child = self.context.Pipe()
+        process = self.context.Process(
+            target=_work, name=f'crawler-{worker}', daemon=True,
+            args=(child, self.graph_factory, self.indexer_factory,
+                  self.crawler_workers, self.min_age,
+                  self.lease_duration / 3))
+        process.start()
+        child.close()
+        workers[connection] = (worker, process)
+
+    def _stop(self, workers: dict):
+        """ Closing the connections tells idle workers to exit """
+        for connection in workers:
+            connection.close()
+        for _, process in workers.values():
+            process.join(self.lease_duration)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        workers.clear()
+
+
+def _work(connection: Connection,
+          graph_factory: Callable[[], graph.Graph],
+          indexer_factory: Callable[[], idx.Indexer],
+          crawler_workers: int,
+          min_age: timedelta,
+          renew_interval: float):
+    """ Worker process: crawls leased partitions until the coordinator
+        closes the connection
+    """
+    g = graph_factory()
+    index = indexer_factory()
+    pipeline = crawler.Crawler(g, index, workers=crawler_workers,
+                               registry=metrics.Registry())
+    provider = linkprovider.LinkProvider(g, partitions=1, min_age=min_age)
+    try:
+        while True:
+            connection.send(('acquire',))
+            lease, now = connection.recv()
+            counts = [0, 0]
+            links = _renewing(connection, lease, counts, renew_interval,
+                              provider.partition(lease.from_id, lease.to_id,
+                                                 now))
+            counts[1] = pipeline.run(links)
+            _commit(g, index)
+            if counts[0] >= 0:
+                connection.send(('done', lease.partition) + tuple(counts))
+    except (EOFError, OSError):
+        pass    # the coordinator is done with us
+    finally:
+        for backend in (g, index):
+            if hasattr(backend, 'close'):
+                backend.close()
+
+
+def _renewing(connection: Connection, lease: Lease, counts: list[int],
+              interval: float,
+              links: list[graph.Link]) -> Iterator[graph.Link]:
+    """ Yields links, renewing the lease every interval seconds; stops and
+        sets counts[0] to -1 once the lease is lost
+    """
+    renewed_at = time.monotonic()
+    for link in links:
+        if time.monotonic() - renewed_at >= interval:
+            connection.send(('renew', lease.partition, counts[0], 0))
+            if not connection.recv():
+                counts[0] = -1
+                return
+            renewed_at = time.monotonic()
+        counts[0] += 1
+        yield link
+
+
+def _commit(*backends):
+    for backend in backends:
+        if hasattr(backend, 'commit'):
+            backend.commit()
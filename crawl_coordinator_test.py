@@ -0,0 +1,107 @@
+"""CrawlCoordinatorTestCase"""
+
+import functools
+import os
+import tempfile
+import unittest
+import uuid
+from datetime import datetime, timedelta
+import crawl_bench
+import crawl_coordinator
+import graph
+import graph_sqlite
+import indexer_whoosh
+import metrics
+
+MIN_ID = uuid.UUID(int=0)
+MAX_ID = uuid.UUID(int=(1 << 128) - 1)
+
+
+class CrashingGraph(graph_sqlite.GraphSQLite):
+    """ Kills its worker process on the first links_iter of the test """
+
+    def links_iter(self, from_id, to_id, retrieved_before):
+        marker = self.path + '.crashed'
+        if not os.path.exists(marker):
+            open(marker, 'w').close()
+            os._exit(1)
+        return super().links_iter(from_id, to_id, retrieved_before)
+
+
+class LeaseTableTestCase(unittest.TestCase):
+    def test_leases_until_completed(self):
+        table = crawl_coordinator.LeaseTable(partitions=2, duration=10.0)
+        first = table.acquire(worker=0, now=0.0)
+        second = table.acquire(worker=1, now=0.0)
+        self.assertEqual((first.partition, second.partition), (0, 1))
+        self.assertEqual((first.from_id, second.to_id),
+                         (MIN_ID, graph.partition_ranges(2)[1][1]))
+        self.assertIsNone(table.acquire(worker=2, now=5.0))
+
+        self.assertTrue(table.renew(0, worker=0, now=5.0))
+        self.assertFalse(table.renew(0, worker=1, now=5.0))
+        self.assertEqual(table.acquire(worker=2, now=12.0).partition, 1)
+        self.assertEqual(table.reassigned, 1)
+        self.assertTrue(table.complete(0, worker=0))
+        self.assertFalse(table.complete(1, worker=1))
+        self.assertTrue(table.complete(1, worker=2))
+        self.assertTrue(table.finished)
+
+    def test_release_dead_worker(self):
+        table = crawl_coordinator.LeaseTable(partitions=1, duration=10.0)
+        table.acquire(worker=0, now=0.0)
+        self.assertEqual(table.release(worker=0), 1)
+        self.assertEqual(table.acquire(worker=1, now=1.0).worker, 1)
+        self.assertEqual(table.reassigned, 1)
+
+
+class CrawlCoordinatorTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'graph.sqlite')
+        self.index_directory = os.path.join(directory.name, 'index')
+        self.site = crawl_bench.SyntheticSite(pages=20, fanout=3,
+                                              page_size=256)
+        self.site.start()
+        self.addCleanup(self.site.stop)
+        with graph_sqlite.GraphSQLite(self.path) as g:
+            g.upsert_link(graph.Link(url=f'{self.site.base_url}/page/0'))
+
+    def test_crawls_site_with_worker_processes(self):
+        progress = self._run(graph_sqlite.GraphSQLite)
+        self.assertEqual(progress['restarts'], 0)
+        self._assert_crawled(progress)
+
+    def test_reassigns_lease_of_crashed_worker(self):
+        progress = self._run(CrashingGraph)
+        self.assertEqual(progress['restarts'], 1)
+        self.assertEqual(progress['reassigned'], 1)
+        self._assert_crawled(progress)
+
+    def _run(self, graph_type: type) -> dict:
+        coordinator = crawl_coordinator.CrawlCoordinator(
+            functools.partial(graph_type, self.path, batch_size=1),
+            functools.partial(indexer_whoosh.IndexerWhoosh,
+                              self.index_directory),
+            workers=2, partitions=4, lease_duration=5.0,
+            min_age=timedelta(hours=1), registry=metrics.Registry())
+        return coordinator.run(passes=20)
+
+    def _assert_crawled(self, progress: dict):
+        with graph_sqlite.GraphSQLite(self.path) as g:
+            links = list(g.links_iter(MIN_ID, MAX_ID, datetime.max))
+        fetched = [link for link in links
+                   if link.retrieved_at > datetime.min]
+        self.assertEqual(len(fetched), len(links))
+        self.assertEqual(progress['fetched'], len(links))
+        self.assertEqual(progress['partitions'], 4 * progress['passes'])
+        with indexer_whoosh.IndexerWhoosh(self.index_directory) as index:
+            for link in links:
+                self.assertEqual(
+                    index.find_document_by_link_id(link.link_id).url,
+                    link.url)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,45 +1,103 @@
 """ Crawler """
 
 from abc import ABCMeta, abstractmethod
+import codecs
+import threading
+import time
 import uuid
-from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 import re
 from copy import deepcopy
-from typing import Iterator, Callable
+from typing import Iterator, Callable, Optional
+import charset_normalizer
 import requests
+import urllib3
 from urllib.parse import urlparse
 from bs4 import BeautifulSoup
 import graph
 import indexer as idx
+import linkprovider
+import metrics
 
 
 class CrawlerPayload():
-    __slots__ = 'link_id', 'url', 'retrieved_at', \
-        'raw_content', 'nofollow_urls', 'urls', 'title', 'text_content'
+    """ Link state carried through the pipeline
+
+    Stages release the fields they are the last to read, see
+    Processor.consumes, so a payload holds raw_bytes only until its
+    text is extracted. raw_size is the raw content size charged to the
+    crawler's RawBytesBudget, 0 once released.
+
+    deferred is set by LinkFetcher when the link was not fetched but left
+    for the next pass, so it must not be reported as crawled.
+
+    LinkFetcher keeps the body undecoded in raw_bytes with the encoding
+    declared by the response, if any; text() decodes it into raw_content
+    the first time a stage needs it, so pages dropped before extraction
+    are never decoded.
+    """
+    __slots__ = 'link_id', 'url', 'retrieved_at', 'status_code', \
+        'raw_bytes', 'encoding', 'raw_content', 'raw_size', 'nofollow_urls', \
+        'urls', 'title', 'text_content', 'deferred'
 
     def __init__(self,
-                 link_id: str = str(uuid.uuid4()),
+                 link_id: uuid.UUID = None,
                  url: str = '',
                  retrieved_at: datetime = datetime.min,
-                 raw_content: str = '',                  # set by LinkFetcher
-                 nofollow_urls: list[str] = [],          # set by LinkExtractor
-                 urls: list[str] = [],                   # set by LinkExtractor
+                 status_code: int = 0,                   # set by LinkFetcher
+                 raw_bytes: bytes = b'',                 # set by LinkFetcher
+                 encoding: str = None,                   # set by LinkFetcher
+                 raw_content: str = '',                  # set by text()
+                 nofollow_urls: list[str] = None,        # set by LinkExtractor
+                 urls: list[str] = None,                 # set by LinkExtractor
                  title: str = '',                        # set by TextExtractor
                  text_content: str = ''):                # set by TextExtractor
-        self.link_id = link_id
+        self.link_id = uuid.uuid4() if link_id is None else link_id
         self.url = url
         self.retrieved_at = retrieved_at
+        self.status_code = status_code
+        self.raw_bytes = raw_bytes
+        self.encoding = encoding
         self.raw_content = raw_content
-        self.nofollow_urls = nofollow_urls
-        self.urls = urls
+        self.raw_size = 0
+        self.nofollow_urls = [] if nofollow_urls is None else nofollow_urls
+        self.urls = [] if urls is None else urls
         self.title = title
         self.text_content = text_content
+        self.deferred = False
+
+    def text(self) -> str:
+        """ raw_content, decoded from raw_bytes on first use """
+        if not self.raw_content and self.raw_bytes:
+            self.raw_content = decode(self.raw_bytes, self.encoding)
+        return self.raw_content
+
+    def release(self, *fields: str):
+        """ Drops references to consumed fields """
+        for field in fields:
+            setattr(self, field, _EMPTY[field]())
+
+    def mark_as_processed(self):
+        """ Resets every field, for reuse by a PayloadPool """
+        self.release(*_EMPTY)
+        self.link_id = None
+        self.url = ''
+        self.retrieved_at = datetime.min
+        self.status_code = 0
+        self.encoding = None
+        self.raw_size = 0
+        self.deferred = False
 
     def __repr__(self) -> str:
         return f'\n\
             link_id:\t{self.link_id}\n\
             url:\t{self.url}\n\
             retrieved_at:\t{self.retrieved_at}\n\
+            status_code:\t{self.status_code}\n\
+            encoding:\t{self.encoding}\n\
             raw_content:\t{self.raw_content}\n\
             nofollow_urls:\t{self.nofollow_urls}\n\
             urls:\t{self.urls}\n\
@@ -47,14 +105,387 @@ class CrawlerPayload():
             text_content: \t{self.text_content}\n'
 
 
+_EMPTY = {'raw_bytes': bytes, 'raw_content': str, 'nofollow_urls': list,
+          'urls': list, 'title': str, 'text_content': str}
+_RAW_FIELDS = ('raw_bytes', 'raw_content')
+
+# Declared encodings are looked for in the first bytes only, as browsers do
+_SNIFF_SIZE = 4096
+_DETECT_SIZE = 64 * 1024
+_BOMS = ((codecs.BOM_UTF8, 'utf-8-sig'),
+         (codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE, 'utf-32'),
+         (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16'))
+_HEADER_CHARSET = re.compile(r'(?i)charset\s*=\s*["\']?([\w.:-]+)')
+_META_CHARSET = re.compile(
+    rb'(?i)<meta[^>]+?charset\s*=\s*["\']?\s*([\w.:-]+)')
+
+
+def declared_encoding(content_type: str, body: bytes) -> Optional[str]:
+    """ Encoding from a byte order mark, the Content-Type header or a
+        <meta> charset near the start of body, None if none names a codec
+    """
+    for bom, encoding in _BOMS:
+        if body.startswith(bom):
+            return encoding
+    header = _HEADER_CHARSET.search(content_type or '')
+    if header is not None:
+        charset = header.group(1)
+    else:
+        meta = _META_CHARSET.search(body[:_SNIFF_SIZE])
+        if meta is None:
+            return None
+        charset = meta.group(1).decode('ascii')
+    try:
+        encoding = codecs.lookup(charset).name
+    except LookupError:
+        return None
+    # Browsers read pages labelled latin-1 as its superset windows-1252
+    return 'cp1252' if encoding == 'iso8859-1' else encoding
+
+
+def decode(body: bytes, encoding: Optional[str]) -> str:
+    """ Decodes body, detecting its encoding if none was declared
+
+    Undeclared bodies are tried as UTF-8 first, which is both the common
+    case and much cheaper than statistical detection over a sample.
+    """
+    if encoding is None:
+        try:
+            return body.decode('utf-8')
+        except UnicodeDecodeError:
+            best = charset_normalizer.from_bytes(body[:_DETECT_SIZE]).best()
+            encoding = best.encoding if best is not None else 'cp1252'
+    return body.decode(encoding, errors='replace')
+
+
+class PayloadPool:
+    """ Free list of payloads, recycled instead of allocated per link
+
+    Attributes:
+        size: payloads kept for reuse
+    """
+
+    def __init__(self, size: int = 64):
+        self.size = size
+        self._free: list[CrawlerPayload] = []
+        self._lock = threading.Lock()
+
+    def acquire(self, link: graph.Link) -> CrawlerPayload:
+        with self._lock:
+            payload = self._free.pop() if self._free else None
+        if payload is None:
+            payload = CrawlerPayload()
+        payload.link_id = link.link_id
+        payload.url = link.url
+        payload.retrieved_at = link.retrieved_at
+        return payload
+
+    def release(self, payload: CrawlerPayload):
+        payload.mark_as_processed()
+        with self._lock:
+            if len(self._free) < self.size:
+                self._free.append(payload)
+
+
+class RawBytesBudget:
+    """ Caps the raw content held by payloads in flight
+
+    acquire blocks the fetching thread until the content fits next to what
+    is in flight; content larger than the limit is admitted on its own.
+    try_acquire never blocks, for a fetcher that already holds a charge
+    and so must not wait on others.
+
+    Attributes:
+        limit: raw content size allowed in flight
+        in_flight: raw content size currently charged
+    """
+
+    def __init__(self, limit: int = 64 << 20):
+        self.limit = limit
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, size: int):
+        with self._condition:
+            self._condition.wait_for(
+                lambda: not self.in_flight
+                or self.in_flight + size <= self.limit)
+            self.in_flight += size
+
+    def try_acquire(self, size: int) -> bool:
+        """ Charges size only if it fits right away """
+        with self._condition:
+            if self.in_flight + size > self.limit:
+                return False
+            self.in_flight += size
+            return True
+
+    def release(self, size: int):
+        with self._condition:
+            self.in_flight -= size
+            self._condition.notify_all()
+
+
+class AIMDLimit:
+    """ Concurrency limit probed with additive increase, multiplicative
+        decrease
+
+    Every success while the limit is in use grows it by increase / limit,
+    about increase per round trip of a full window, and congestion scales
+    it by decrease at most once per cooldown, so a burst of failures from
+    one window cuts it once.
+
+    Attributes:
+        limit: current limit, fractional, in_flight may reach its floor
+        in_flight: fetches holding a slot
+        waiting: acquires blocked on the limit
+        blocked_until: time.monotonic() before which nothing may start
+    """
+
+    def __init__(self,
+                 initial: float,
+                 min_limit: float = 1.0,
+                 max_limit: float = 64.0,
+                 increase: float = 1.0,
+                 decrease: float = 0.5):
+        self.limit = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.in_flight = 0
+        self.waiting = 0
+        self.blocked_until = 0.0
+        self._decreased_at = float('-inf')
+
+    @property
+    def available(self) -> bool:
+        return self.in_flight < max(int(self.limit), 1)
+
+    def succeeded(self):
+        """ Grows the limit, unless it was not what bounded concurrency """
+        if self.in_flight + 1 >= int(self.limit):
+            self.limit = min(self.limit + self.increase / self.limit,
+                             self.max_limit)
+
+    def congested(self, now: float, cooldown: float) -> bool:
+        if now - self._decreased_at < cooldown:
+            return False
+        self.limit = max(self.limit * self.decrease, self.min_limit)
+        self._decreased_at = now
+        return True
+
+
+class FetchLimiter:
+    """ Adapts global and per-host fetch concurrency to what they sustain
+
+    Fetches take a slot of the global AIMDLimit and of their host's. A
+    host's limit is cut by a 429 or 503, a failed or timed out request or
+    a response slower than latency_target, and a Retry-After keeps new
+    fetches off the host until it passed. The global limit is only cut by
+    failed requests and slow responses, which point at our own network;
+    rate limiting by one host says nothing about the others.
+
+    acquire() gives up after waiting max_wait on the host's limit, so links
+    of a throttled host are left for the next pass instead of holding every
+    worker; waiting for a global slot never gives up. Hosts back at
+    their initial limit with no fetch in flight or waiting are forgotten,
+    keeping the table to the hosts being throttled or probed.
+
+    Limits are exposed as fetch_concurrency_limit{scope="global"}, the
+    sum of host limits in use as scope="hosts", and fetch_hosts_throttled
+    counts hosts below host_initial or waiting for Retry-After.
+
+    Attributes:
+        latency_target: seconds a fetch may take before counting as
+            congestion
+        max_wait: seconds acquire() waits for a host slot
+        max_retry_after: longest Retry-After honoured, in seconds
+    """
+
+    def __init__(self,
+                 initial: float = 8.0,
+                 max_limit: float = 64.0,
+                 host_initial: float = 2.0,
+                 host_max: float = 8.0,
+                 latency_target: float = 5.0,
+                 max_wait: float = 30.0,
+                 max_retry_after: float = 3600.0,
+                 registry: metrics.Registry = metrics.REGISTRY):
+        self.host_initial = host_initial
+        self.host_max = host_max
+        self.latency_target = latency_target
+        self.max_wait = max_wait
+        self.max_retry_after = max_retry_after
+        self.limit = AIMDLimit(min(initial, max_limit), max_limit=max_limit)
+        self._hosts: dict[str, AIMDLimit] = {}
+        self._condition = threading.Condition()
+        self._limits = registry.gauge(
+            'fetch_concurrency_limit', 'Adaptive fetch concurrency limit',
+            ('scope',))
+        self._throttled = registry.gauge(
+            'fetch_hosts_throttled', 'Hosts held below their initial limit')
+        self._congestion = registry.counter(
+            'fetch_congestion_total', 'Concurrency limit decreases',
+            ('scope',))
+        self._publish()
+
+    def host_limit(self, host: str) -> AIMDLimit:
+        """ The host's limit, a fresh one if it is not being tracked """
+        with self._condition:
+            return self._hosts.get(host) or self._new_host_limit()
+
+    def acquire(self, host: str) -> bool:
+        """ Takes a global and a host slot, False after max_wait waiting
+            on the host
+        """
+        deadline = time.monotonic() + self.max_wait
+        with self._condition:
+            limit = self._hosts.get(host)
+            if limit is None:
+                limit = self._hosts[host] = self._new_host_limit()
+            limit.waiting += 1
+            try:
+                acquired = self._wait(limit, deadline)
+            finally:
+                limit.waiting -= 1
+            if not acquired:
+                self._forget(host, limit)
+                return False
+            limit.in_flight += 1
+            self.limit.in_flight += 1
+            return True
+
+    def release(self,
+                host: str,
+                latency: float,
+                status_code: int,
+                retry_after: Optional[float] = None):
+        """ Frees the slots of a fetch and adapts the limits to its outcome,
+            status_code 0 meaning no response
+        """
+        with self._condition:
+            self.limit.in_flight -= 1
+            limit = self._hosts.get(host)
+            if limit is None:
+                self._condition.notify_all()
+                return
+            limit.in_flight -= 1
+            now = time.monotonic()
+            if retry_after is not None:
+                limit.blocked_until = max(
+                    limit.blocked_until,
+                    now + min(retry_after, self.max_retry_after))
+            slow = latency > self.latency_target
+            if slow or status_code in (0, 429, 503):
+                if limit.congested(now, cooldown=latency):
+                    self._congestion.inc(scope='host')
+                if (slow or status_code == 0) \
+                        and self.limit.congested(now, cooldown=latency):
+                    self._congestion.inc(scope='global')
+            else:
+                limit.succeeded()
+                self.limit.succeeded()
+            self._forget(host, limit)
+            self._publish()
+            self._condition.notify_all()
+
+    def _wait(self, limit: AIMDLimit, deadline: float) -> bool:
+        """ Waits for a slot of limit and a global one, False once deadline
+            passed or would pass under Retry-After
+
+        Time spent waiting only for a global slot pushes deadline back, the
+        host is not throttled then and the link must not be dropped.
+        """
+        while True:
+            now = time.monotonic()
+            host_ready = limit.blocked_until <= now and limit.available
+            if host_ready and self.limit.available:
+                return True
+            if host_ready:
+                self._condition.wait()
+                deadline += time.monotonic() - now
+                continue
+            if now >= deadline or limit.blocked_until > deadline:
+                return False
+            wake = deadline
+            if limit.blocked_until > now:
+                wake = min(wake, limit.blocked_until)
+            self._condition.wait(wake - now)
+
+    def _new_host_limit(self) -> AIMDLimit:
+        return AIMDLimit(self.host_initial, max_limit=self.host_max)
+
+    def _forget(self, host: str, limit: AIMDLimit):
+        if not limit.in_flight and not limit.waiting \
+                and limit.limit == self.host_initial \
+                and limit.blocked_until <= time.monotonic():
+            self._hosts.pop(host, None)
+
+    def _publish(self):
+        self._limits.set(self.limit.limit, scope='global')
+        self._limits.set(sum(limit.limit for limit in self._hosts.values()),
+                         scope='hosts')
+        now = time.monotonic()
+        self._throttled.set(sum(
+            1 for limit in self._hosts.values()
+            if limit.limit < self.host_initial or limit.blocked_until > now))
+
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """ Seconds to wait from a Retry-After header, delay or HTTP date """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
 class Processor(metaclass=ABCMeta):
-    """ Process payloads as partof pipeline stage """
+    """ Process payloads as partof pipeline stage
+
+    consumes names the payload fields no later stage reads, the crawler
+    releases them once the stage is done.
+    """
+    consumes: tuple[str, ...] = ()
+
     @ abstractmethod
     def process(self, payload: CrawlerPayload) -> CrawlerPayload:
         """ Process payload and send to next stage or raise """
 
 
 class LinkFetcher(Processor):
+    """ Fetches the raw body, asking for every compression urllib3 can
+        decode, over one keep-alive session per thread
+
+    With a FetchLimiter every request waits for a slot of its host, and
+    links whose host stays throttled are dropped, to be fetched next pass.
+
+    With a RawBytesBudget the body is streamed and charged before it is
+    read: its Content-Length, or one chunk, is reserved up front, and every
+    decoded chunk beyond the reservation is charged as it arrives. Bodies
+    over the limit are read once nothing else is in flight.
+    """
+    accept_encoding = urllib3.util.make_headers(
+        accept_encoding=True)['accept-encoding']
+    chunk_size = 64 * 1024
+
+    def __init__(self,
+                 budget: RawBytesBudget = None,
+                 limiter: FetchLimiter = None,
+                 timeout: float = 30.0):
+        self.budget = budget
+        self.limiter = limiter
+        self.timeout = timeout
+        self._local = threading.local()
+
     def process(self, payload: CrawlerPayload) -> CrawlerPayload:
         # decide on error object passing, but keep simple
         # either no handling at all here or try and returning the except
@@ -64,10 +495,72 @@ class LinkFetcher(Processor):
         if regex_nonhtml.search(crawler_payload.url):
             return
 
-        result = requests.get(url=crawler_payload.url)
-        crawler_payload.raw_content = result.text
+        host = urlparse(crawler_payload.url).netloc
+        if self.limiter is not None and not self.limiter.acquire(host):
+            crawler_payload.deferred = True
+            return
+        start = time.monotonic()
+        status_code, retry_after = 0, None
+        try:
+            with self._session().get(
+                    url=crawler_payload.url,
+                    headers={'Accept-Encoding': self.accept_encoding},
+                    timeout=self.timeout,
+                    stream=self.budget is not None) as result:
+                status_code = result.status_code
+                if status_code in (429, 503):
+                    retry_after = retry_after_seconds(
+                        result.headers.get('Retry-After'))
+                raw_bytes = self._read(result, crawler_payload)
+        except requests.RequestException:
+            crawler_payload.status_code = 0     # no response, see CrawlStatus
+            return crawler_payload
+        finally:
+            if self.limiter is not None:
+                self.limiter.release(host, time.monotonic() - start,
+                                     status_code, retry_after)
+        crawler_payload.status_code = status_code
+        crawler_payload.raw_bytes = raw_bytes
+        crawler_payload.encoding = declared_encoding(
+            result.headers.get('Content-Type'), raw_bytes)
         return crawler_payload
 
+    def _read(self, result: requests.Response,
+              payload: CrawlerPayload) -> bytes:
+        """ Reads the body charging the budget, waiting until it fits
+
+        A body growing past its reservation is charged the excess if that
+        fits; otherwise the charge is released before waiting for the whole
+        size, so a waiting fetcher never holds budget others wait for.
+        """
+        if self.budget is None:
+            return result.content
+        length = result.headers.get('Content-Length', '')
+        reserved = int(length) if length.isdigit() else self.chunk_size
+        self.budget.acquire(reserved)
+        chunks, size = [], 0
+        try:
+            for chunk in result.iter_content(self.chunk_size):
+                size += len(chunk)
+                if size > reserved:
+                    if not self.budget.try_acquire(size - reserved):
+                        self.budget.release(reserved)
+                        reserved = 0
+                        self.budget.acquire(size)
+                    reserved = size
+                chunks.append(chunk)
+        except BaseException:
+            self.budget.release(reserved)
+            raise
+        payload.raw_size = reserved
+        return b''.join(chunks)
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
 
 regex_nonhtml = re.compile('(?i)\.(?:jpg|jpeg|png|gif|ico|css|js)$')
 regex_basehref = re.compile('(?i)<base.*?href\s*?=\s*?"(.*?)\s*?"')
@@ -78,7 +571,7 @@ regex_title = re.compile('(?i)<title.*?>(.*?)</title>')
 
 class LinkExtractor(Processor):
     def process(self, payload: CrawlerPayload) -> CrawlerPayload:
-        allhrefs = regex_allhrefs.findall(payload.raw_content)
+        allhrefs = regex_allhrefs.findall(payload.text())
         payload.urls = [url for url in allhrefs if self._is_absolute(url)]
         return payload
 
@@ -88,9 +581,11 @@ class LinkExtractor(Processor):
 
 
 class ContentExtractor(Processor):
+    consumes = _RAW_FIELDS
+
     def process(self, payload: CrawlerPayload) -> CrawlerPayload:
         parser: BeautifulSoup = BeautifulSoup(
-            markup=payload.raw_content, features='html.parser')
+            markup=payload.text(), features='html.parser')
         # Extract title
         title = parser.find_all('title')
         if title:
@@ -110,6 +605,8 @@ class ContentExtractor(Processor):
 
 
 class GraphUpdater(Processor):
+    consumes = ('nofollow_urls', 'urls')
+
     def __init__(self, graph: graph.Graph):
         self.graph = graph
 
@@ -154,7 +651,48 @@ class GraphUpdater(Processor):
         return edges
 
 
+class CrawlStatusUpdater(Processor):
+    """ Records the fetch outcome in the graph's CrawlStatus
+
+    Failed fetches and pages whose content has not changed since the last
+    fetch end the pipeline here; the latter only get retrieved_at bumped,
+    as their links and text are already stored.
+    """
+
+    def __init__(self,
+                 graph: graph.Graph,
+                 policy: linkprovider.RecrawlPolicy = None):
+        self.graph = graph
+        self.policy = policy or linkprovider.RecrawlPolicy()
+
+    def process(self, payload: CrawlerPayload) -> CrawlerPayload:
+        try:
+            previous = self.graph.find_crawl_status(payload.link_id)
+        except KeyError:
+            previous = None
+        now = datetime.utcnow()
+        status = self.policy.record(
+            previous, payload.link_id, payload.status_code,
+            linkprovider.content_hash(payload.raw_bytes
+                                      or payload.raw_content), now)
+        try:
+            self.graph.upsert_crawl_status(status)
+        except KeyError:
+            pass    # payload for a link not in the graph, nothing to track
+        if status.failures:
+            return
+        if previous is not None and previous.fetches \
+                and status.changes == previous.changes:
+            self.graph.upsert_link(graph.Link(link_id=payload.link_id,
+                                              url=payload.url,
+                                              retrieved_at=now))
+            return
+        return payload
+
+
 class TextIndexer(Processor):
+    consumes = ('title', 'text_content')
+
     def __init__(self, indexer: idx.Indexer):
         self.indexer = indexer
 
@@ -171,27 +709,152 @@ class TextIndexer(Processor):
 
 
 class Crawler():
-    def __init__(self, graph: graph.Graph, indexer: idx.Indexer):
+    """ Runs links through the fetch, extract, store and index stages
+
+    Payloads come from a PayloadPool and go back to it once crawled, fields
+    are released as soon as their last stage is done, and fetched content
+    is charged to a RawBytesBudget until ContentExtractor has consumed it,
+    so with workers > 1 the raw content in flight stays near
+    raw_bytes_limit however large the pages are. workers > 1 needs a
+    thread-safe graph and indexer, for example GraphInMemory with
+    lock_stripes or GraphSQLite.
+
+    With workers > 1 fetches also go through a FetchLimiter, by default
+    one starting at min(8, workers) concurrent fetches and allowed up to
+    workers, so the worker count is a ceiling rather than a setting to
+    tune per crawl.
+
+    Every stage is timed in crawler_stage_seconds and counted in
+    crawler_stage_payloads_total by outcome: passed, dropped (the stage
+    returned None) or error (it raised). Wrap graph and indexer in
+    metrics.InstrumentedGraph / InstrumentedIndexer to time their calls.
+
+    Attributes:
+        stages: Processors in pipeline order
+        workers: links crawled concurrently
+        pool: PayloadPool
+        budget: RawBytesBudget shared by the fetchers
+        limiter: FetchLimiter of the fetcher, None if workers == 1 and none
+            was given
+        profiler: optional metrics.StageProfiler sampling stage calls
+    """
+
+    def __init__(self,
+                 graph: graph.Graph,
+                 indexer: idx.Indexer,
+                 policy: linkprovider.RecrawlPolicy = None,
+                 workers: int = 1,
+                 raw_bytes_limit: int = 64 << 20,
+                 registry: metrics.Registry = metrics.REGISTRY,
+                 profiler: metrics.StageProfiler = None,
+                 limiter: FetchLimiter = None):
+        self.workers = workers
+        self.profiler = profiler
+        if limiter is None and workers > 1:
+            limiter = FetchLimiter(initial=min(8, workers),
+                                   max_limit=workers, registry=registry)
+        self.limiter = limiter
+        self._stage_seconds = registry.histogram(
+            'crawler_stage_seconds', 'Stage processing latency', ('stage',))
+        self._stage_payloads = registry.counter(
+            'crawler_stage_payloads_total', 'Payloads leaving a stage',
+            ('stage', 'outcome'))
+        self._stage_in_flight = registry.gauge(
+            'crawler_stage_in_flight', 'Payloads inside a stage', ('stage',))
+        self._in_flight = registry.gauge(
+            'crawler_in_flight', 'Payloads inside the pipeline')
+        self._fetched_bytes = registry.counter(
+            'crawler_fetched_bytes_total', 'Raw content fetched')
+        self._raw_bytes_in_flight = registry.gauge(
+            'crawler_raw_bytes_in_flight', 'Raw content held by payloads')
+        self.pool = PayloadPool(size=2 * workers)
+        self.budget = RawBytesBudget(limit=raw_bytes_limit)
         self.stages = [
-            LinkFetcher(),
+            LinkFetcher(budget=self.budget, limiter=limiter),
+            CrawlStatusUpdater(graph=graph, policy=policy),
             LinkExtractor(),
             ContentExtractor(),
             GraphUpdater(graph=graph),
             TextIndexer(indexer=indexer)
         ]
 
-    def run(self, links_iter: Iterator[graph.Link]):
-        outputs = []
-        for link in links_iter:
-            payload_in = CrawlerPayload(link_id=link.link_id,
-                                        url=link.url,
-                                        retrieved_at=link.retrieved_at)
-            payload_out = self.crawl(payload_in)
-            outputs.append(payload_out)
-        return outputs
+    def run(self,
+            links_iter: Iterator[graph.Link],
+            on_crawled: Callable[[graph.Link], None] = None) -> int:
+        """ Crawls every link, returns how many made it through all stages
+
+        Payloads are recycled rather than returned. on_crawled is called
+        with every link once its payload left the pipeline, from the worker
+        thread that crawled it, so not necessarily in links_iter order;
+        links the fetcher deferred to the next pass are not reported.
+        """
+        if self.workers == 1:
+            return sum(self._crawl_link(link, on_crawled)
+                       for link in links_iter)
+        completed = 0
+        with ThreadPoolExecutor(max_workers=self.workers,
+                                thread_name_prefix='crawler') as executor:
+            pending = set()
+            for link in links_iter:
+                if len(pending) >= 2 * self.workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    completed += sum(future.result() for future in done)
+                pending.add(executor.submit(self._crawl_link, link,
+                                            on_crawled))
+            completed += sum(future.result() for future in pending)
+        return completed
 
     def crawl(self, payload: CrawlerPayload) -> CrawlerPayload:
         inout = payload
-        for stage in self.stages:
-            inout = stage.process(inout)
+        self._in_flight.inc()
+        try:
+            for stage in self.stages:
+                inout = self._process(stage, inout)
+                if inout is None:
+                    break
+                if isinstance(stage, LinkFetcher):
+                    self._fetched_bytes.inc(inout.raw_size)
+                    self._raw_bytes_in_flight.set(self.budget.in_flight)
+                self._release(inout, stage.consumes)
+        finally:
+            if payload.raw_size:
+                self._release(payload, _RAW_FIELDS)
+            self._raw_bytes_in_flight.set(self.budget.in_flight)
+            self._in_flight.dec()
         return inout
+
+    def _process(self, stage: Processor,
+                 payload: CrawlerPayload) -> CrawlerPayload:
+        name = type(stage).__name__
+        sample = self.profiler.sample(name) if self.profiler \
+            else nullcontext()
+        self._stage_in_flight.inc(stage=name)
+        try:
+            with self._stage_seconds.time(stage=name), sample:
+                payload = stage.process(payload)
+        except Exception:
+            self._stage_payloads.inc(stage=name, outcome='error')
+            raise
+        finally:
+            self._stage_in_flight.dec(stage=name)
+        self._stage_payloads.inc(
+            stage=name, outcome='dropped' if payload is None else 'passed')
+        return payload
+
+    def _crawl_link(self, link: graph.Link,
+                    on_crawled: Callable[[graph.Link], None] = None) -> bool:
+        payload = self.pool.acquire(link)
+        try:
+            crawled = self.crawl(payload) is not None
+            deferred = payload.deferred
+        finally:
+            self.pool.release(payload)
+        if on_crawled is not None and not deferred:
+            on_crawled(link)
+        return crawled
+
+    def _release(self, payload: CrawlerPayload, fields: tuple[str, ...]):
+        if payload.raw_size and 'raw_bytes' in fields:
+            self.budget.release(payload.raw_size)
+            payload.raw_size = 0
+        payload.release(*fields)
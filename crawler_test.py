@@ -1,10 +1,14 @@
 """CrawlerTestCase"""
 
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import unittest
 import indexer
 import uuid
 from datetime import datetime
 import crawler
+import metrics
 import graph
 
 
@@ -27,6 +31,62 @@ class LinkFetcherTestCase(unittest.TestCase):
         self.assertIsNone(payload_out)
 
 
+class LinkFetcherBudgetTestCase(unittest.TestCase):
+    def setUp(self):
+        bodies = {'/small': b'<p>' * 100, '/large': b'<p>' * 1000}
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path, _, query = self.path.partition('?')
+                body = bodies[path]
+                self.send_response(200)
+                if query != 'unsized':
+                    self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.site = 'http://127.0.0.1:%d' % server.server_address[1]
+        self.budget = crawler.RawBytesBudget(limit=1000)
+        self.sut = crawler.LinkFetcher(budget=self.budget)
+        self.sut.chunk_size = 128
+
+    def test_reserves_before_reading(self):
+        for query in ('', '?unsized'):
+            payload = self.sut.process(
+                crawler.CrawlerPayload(url=f'{self.site}/small{query}'))
+            self.assertEqual((payload.status_code, payload.raw_bytes),
+                             (200, b'<p>' * 100))
+            self.assertEqual(self.budget.in_flight, payload.raw_size)
+            self.assertGreaterEqual(payload.raw_size, 300)
+            self.budget.release(payload.raw_size)
+
+    def test_admits_bodies_over_budget_alone(self):
+        for query in ('', '?unsized'):
+            payload = self.sut.process(
+                crawler.CrawlerPayload(url=f'{self.site}/large{query}'))
+            self.assertEqual((payload.status_code, payload.raw_bytes),
+                             (200, b'<p>' * 1000))
+            self.assertEqual(self.budget.in_flight, payload.raw_size)
+            self.assertGreaterEqual(payload.raw_size, 3000)
+            self.budget.release(payload.raw_size)
+
+    def test_waits_for_budget_held_by_others(self):
+        self.budget.acquire(800)
+        threading.Timer(0.1, self.budget.release, (800,)).start()
+        payload = self.sut.process(
+            crawler.CrawlerPayload(url=f'{self.site}/small?unsized'))
+        self.assertEqual((payload.status_code, payload.raw_bytes),
+                         (200, b'<p>' * 100))
+        self.assertEqual(self.budget.in_flight, payload.raw_size)
+
+
 class GraphUpdaterTestCase(unittest.TestCase):
     """GraphUpdaterTestCase """
 
@@ -43,6 +103,260 @@ class GraphUpdaterTestCase(unittest.TestCase):
         payload = self.sut.process(payload=payload)
 
 
+class CrawlStatusUpdaterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.graph = graph.GraphInMemory()
+        self.sut = crawler.CrawlStatusUpdater(graph=self.graph)
+        self.link = self.graph.upsert_link(graph.Link(url='http://a.com'))
+
+    def test_records_outcomes_and_stops_unchanged(self):
+        payload = self._payload(200, '<p>foo</p>')
+        self.assertIs(self.sut.process(payload), payload)
+        status = self.graph.find_crawl_status(self.link.link_id)
+        self.assertEqual((status.status_code, status.fetches), (200, 1))
+
+        self.assertIsNone(self.sut.process(self._payload(200, '<p>foo</p>')))
+        self.assertGreater(
+            self.graph.find_link(self.link.link_id).retrieved_at,
+            datetime.min)
+
+        self.assertIsNotNone(self.sut.process(self._payload(200, '<p>bar')))
+        status = self.graph.find_crawl_status(self.link.link_id)
+        self.assertEqual((status.fetches, status.changes), (3, 1))
+
+    def test_stops_failed_fetches(self):
+        self.assertIsNone(self.sut.process(self._payload(404, '')))
+        status = self.graph.find_crawl_status(self.link.link_id)
+        self.assertEqual((status.status_code, status.failures), (404, 1))
+
+    def _payload(self, status_code: int, raw_content: str):
+        return crawler.CrawlerPayload(link_id=self.link.link_id,
+                                      url=self.link.url,
+                                      status_code=status_code,
+                                      raw_content=raw_content)
+
+
+class CrawlerPayloadTestCase(unittest.TestCase):
+    def test_defaults_are_not_shared(self):
+        first, second = crawler.CrawlerPayload(), crawler.CrawlerPayload()
+        first.urls.append('http://a.com')
+        self.assertEqual(second.urls, [])
+        self.assertNotEqual(first.link_id, second.link_id)
+
+    def test_release_and_pool(self):
+        pool = crawler.PayloadPool(size=1)
+        link = graph.Link(link_id=uuid.uuid4(), url='http://a.com')
+        payload = pool.acquire(link)
+        payload.raw_content, payload.urls = '<html>', ['http://b.com']
+        payload.release('raw_content')
+        self.assertEqual((payload.raw_content, payload.urls),
+                         ('', ['http://b.com']))
+        pool.release(payload)
+        self.assertEqual(payload.urls, [])
+        recycled = pool.acquire(graph.Link(url='http://c.com'))
+        self.assertIs(recycled, payload)
+        self.assertEqual(recycled.url, 'http://c.com')
+
+    def test_budget_blocks_until_released(self):
+        budget = crawler.RawBytesBudget(limit=10)
+        budget.acquire(8)
+        acquired = threading.Event()
+        waiter = threading.Thread(
+            target=lambda: (budget.acquire(5), acquired.set()))
+        waiter.start()
+        self.assertFalse(acquired.wait(0.05))
+        budget.release(8)
+        self.assertTrue(acquired.wait(1))
+        waiter.join()
+        self.assertEqual(budget.in_flight, 5)
+        budget.release(5)
+        budget.acquire(100)     # oversized content is admitted alone
+        self.assertEqual(budget.in_flight, 100)
+
+
+class EncodingTestCase(unittest.TestCase):
+    def test_declared_encoding(self):
+        declared = crawler.declared_encoding
+        self.assertEqual(declared('text/html; charset="UTF-8"', b''),
+                         'utf-8')
+        self.assertEqual(declared('text/html; charset=ISO-8859-1', b''),
+                         'cp1252')
+        self.assertEqual(declared('text/html; charset=utf-8',
+                                  '\ufeffhi'.encode('utf-16')), 'utf-16')
+        self.assertEqual(declared('text/html', b'<head><meta charset='
+                                  b'"windows-1251"></head>'), 'cp1251')
+        self.assertEqual(declared(None, b'<meta http-equiv="Content-Type" '
+                                  b'content="text/html; charset=koi8-r">'),
+                         'koi8-r')
+        self.assertIsNone(declared('text/html; charset=bogus', b''))
+        self.assertIsNone(declared(None, b' ' * 5000 + b'<meta charset=x>'))
+
+    def test_text_decodes_lazily(self):
+        payload = crawler.CrawlerPayload(
+            raw_bytes='caf\xe9'.encode('cp1252'), encoding='cp1252')
+        self.assertEqual(payload.raw_content, '')
+        self.assertEqual(payload.text(), 'caf\xe9')
+        self.assertEqual(payload.raw_content, 'caf\xe9')
+
+        body = ('Привет, мир! Это страница на русском языке. ' * 20)
+        self.assertEqual(crawler.decode(body.encode('utf-8'), None), body)
+        self.assertEqual(crawler.decode(body.encode('cp1251'), None), body)
+
+
+class FetchLimiterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+        self.sut = crawler.FetchLimiter(initial=4, host_initial=1,
+                                        latency_target=1.0, max_wait=0.05,
+                                        registry=self.registry)
+
+    def test_aimd_limit(self):
+        limit = crawler.AIMDLimit(2.0, max_limit=4.0)
+        limit.in_flight = 1
+        limit.succeeded()
+        self.assertEqual(limit.limit, 2.5)
+        self.assertTrue(limit.congested(now=0.0, cooldown=1.0))
+        self.assertFalse(limit.congested(now=0.5, cooldown=1.0))
+        self.assertEqual(limit.limit, 1.25)
+        limit.congested(now=2.0, cooldown=1.0)
+        self.assertEqual(limit.limit, 1.0)
+
+    def test_host_limits_and_retry_after(self):
+        self.assertTrue(self.sut.acquire('a.com'))
+        self.assertFalse(self.sut.acquire('a.com'))
+        self.assertTrue(self.sut.acquire('b.com'))
+        self.sut.release('a.com', 0.1, 429, retry_after=60)
+        self.assertFalse(self.sut.acquire('a.com'))
+        self.assertEqual(self.sut.limit.limit, 4)
+        self.assertEqual(self.registry.gauge(
+            'fetch_hosts_throttled', '').value(), 1)
+
+        self.sut.release('b.com', 2.0, 200)
+        self.assertEqual(self.sut.limit.limit, 2)
+        self.assertEqual(self.registry.gauge(
+            'fetch_concurrency_limit', '', ('scope',)).value(
+                scope='global'), 2)
+        self.assertEqual(self.sut.host_limit('b.com').limit, 1)
+
+    def test_waiters_wake_on_release(self):
+        self.assertTrue(self.sut.acquire('a.com'))
+        self.sut.max_wait = 5.0
+        acquired = []
+        waiter = threading.Thread(
+            target=lambda: acquired.append(self.sut.acquire('a.com')))
+        waiter.start()
+        self.sut.release('a.com', 0.1, 200)
+        waiter.join()
+        self.assertEqual(acquired, [True])
+
+    def test_waited_host_is_not_forgotten(self):
+        sut = crawler.FetchLimiter(initial=1, host_initial=2, max_wait=5.0,
+                                   registry=self.registry)
+        self.assertTrue(sut.acquire('a.com'))
+        acquired = []
+        waiter = threading.Thread(
+            target=lambda: acquired.append(sut.acquire('a.com')))
+        waiter.start()
+        while not sut.host_limit('a.com').waiting:
+            time.sleep(0.001)
+        sut.release('a.com', 0.1, 200)
+        waiter.join()
+        self.assertEqual(acquired, [True])
+        self.assertEqual(sut.host_limit('a.com').in_flight, 1)
+        sut.release('a.com', 0.1, 200)
+        self.assertEqual(sut.limit.in_flight, 0)
+
+    def test_global_wait_does_not_give_up(self):
+        sut = crawler.FetchLimiter(initial=1, host_initial=2, max_wait=0.05,
+                                   registry=self.registry)
+        self.assertTrue(sut.acquire('a.com'))
+        acquired = []
+        waiter = threading.Thread(
+            target=lambda: acquired.append(sut.acquire('b.com')))
+        waiter.start()
+        time.sleep(0.2)
+        self.assertEqual(acquired, [])
+        sut.release('a.com', 0.1, 200)
+        waiter.join()
+        self.assertEqual(acquired, [True])
+
+    def test_retry_after_seconds(self):
+        self.assertEqual(crawler.retry_after_seconds(' 120 '), 120.0)
+        self.assertEqual(crawler.retry_after_seconds(
+            'Wed, 21 Oct 2015 07:28:00 GMT'), 0.0)
+        self.assertIsNone(crawler.retry_after_seconds('soon'))
+        self.assertIsNone(crawler.retry_after_seconds(None))
+
+
+class StubFetcher(crawler.LinkFetcher):
+    def process(self, payload):
+        content = f'<title>{payload.url}</title><a href="http://x.com">x</a>'
+        self.budget.acquire(len(content))
+        payload.raw_size, payload.raw_content = len(content), content
+        payload.status_code = 200
+        return payload
+
+
+class CrawlerPipelineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.graph = graph.GraphInMemory(lock_stripes=8)
+        self.indexer = indexer.IndexerInMemory()
+        self.registry = metrics.Registry()
+        self.sut = crawler.Crawler(graph=self.graph, indexer=self.indexer,
+                                   workers=4, raw_bytes_limit=200,
+                                   registry=self.registry)
+        self.sut.stages[0] = StubFetcher(budget=self.sut.budget)
+
+    def test_run_releases_payloads_and_budget(self):
+        links = self.graph.upsert_links(
+            [graph.Link(url=f'http://{i}.com') for i in range(20)])
+        self.assertEqual(self.sut.run(iter(links)), 20)
+        self.assertEqual(self.sut.budget.in_flight, 0)
+        self.assertEqual(len(self.indexer.documents), 20)
+        self.assertLessEqual(len(self.sut.pool._free), 8)
+
+    def test_deferred_links_are_not_reported_crawled(self):
+        fetcher = crawler.LinkFetcher(limiter=crawler.FetchLimiter(
+            host_initial=1, max_wait=0.0, registry=self.registry))
+        self.sut.stages[0] = fetcher
+        fetcher.limiter.acquire('a.com')
+        link = self.graph.upsert_link(graph.Link(url='http://a.com/page'))
+        crawled = []
+        self.assertEqual(self.sut.run(iter([link]), crawled.append), 0)
+        self.assertEqual(crawled, [])
+
+    def test_stage_metrics(self):
+        link = self.graph.upsert_link(graph.Link(url='http://a.com'))
+        for _ in range(2):
+            self.sut.crawl(crawler.CrawlerPayload(link_id=link.link_id,
+                                                  url=link.url))
+        payloads = self.registry.counter(
+            'crawler_stage_payloads_total', '', ('stage', 'outcome'))
+        self.assertEqual(payloads.value(stage='StubFetcher',
+                                        outcome='passed'), 2)
+        self.assertEqual(payloads.value(stage='CrawlStatusUpdater',
+                                        outcome='dropped'), 1)
+        self.assertEqual(payloads.value(stage='TextIndexer',
+                                        outcome='passed'), 1)
+        exposition = self.registry.exposition()
+        self.assertIn('crawler_stage_seconds_count{stage="LinkExtractor"} 1',
+                      exposition)
+        self.assertIn('crawler_in_flight 0.0', exposition)
+
+    def test_crawl_releases_consumed_fields(self):
+        link = self.graph.upsert_link(graph.Link(url='http://a.com'))
+        payload = self.sut.crawl(crawler.CrawlerPayload(
+            link_id=link.link_id, url=link.url))
+        self.assertEqual((payload.raw_content, payload.urls,
+                          payload.text_content, payload.raw_size),
+                         ('', [], '', 0))
+
+        # Dropped by CrawlStatusUpdater as unchanged, budget still released
+        self.assertIsNone(self.sut.crawl(crawler.CrawlerPayload(
+            link_id=link.link_id, url=link.url)))
+        self.assertEqual(self.sut.budget.in_flight, 0)
+
+
 class CrawlerTestCase(unittest.TestCase):
     def setUp(self):
         self.graph = graph.GraphInMemory()
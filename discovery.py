@@ -0,0 +1,242 @@
+"""URL discovery from sitemaps and feeds."""
+
+import gzip
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import BinaryIO, Iterable, Iterator, Optional
+from urllib.parse import urljoin, urlparse
+from xml.etree.ElementTree import ParseError, iterparse
+import requests
+import graph
+import linkprovider
+import metrics
+
+PAGE, SITEMAP = 0, 1
+
+# Record elements of sitemaps, sitemap indexes, RSS and Atom, by local name
+_RECORDS = {'url': PAGE, 'item': PAGE, 'entry': PAGE, 'sitemap': SITEMAP}
+_DATES = {'lastmod', 'pubDate', 'updated', 'published'}
+_MAX_BYTES = 50 * 1024 * 1024       # sitemaps protocol limit, uncompressed
+
+
+class Entry:
+    """ URL found in a sitemap or feed
+
+    Attributes:
+        kind: PAGE, or SITEMAP for an entry of a sitemap index
+        url: absolute URL
+        modified_at: naive UTC lastmod hint, None if absent or unparsable
+    """
+    __slots__ = 'kind', 'url', 'modified_at'
+
+    def __init__(self,
+                 kind: int = PAGE,
+                 url: str = '',
+                 modified_at: Optional[datetime] = None):
+        self.kind = kind
+        self.url = url
+        self.modified_at = modified_at
+
+    def __eq__(self, other):
+        return all(getattr(self, name) == getattr(other, name)
+                   for name in self.__slots__)
+
+    def __repr__(self) -> str:
+        return f'Entry({self.kind}, {self.url!r}, {self.modified_at})'
+
+
+def entries(source: BinaryIO, base_url: str = '') -> Iterator[Entry]:
+    """ Streams the entries of a sitemap, sitemap index, RSS or Atom feed
+
+    Elements are parsed incrementally and dropped once their record is
+    yielded, so memory stays flat however many URLs the document holds.
+    Relative URLs are resolved against base_url.
+    """
+    root = record = url = modified_at = None
+    for event, element in iterparse(source, events=('start', 'end')):
+        name = element.tag.rpartition('}')[2]
+        if event == 'start':
+            if root is None:
+                root = element
+            elif name in _RECORDS and record is None:
+                record, url, modified_at = name, None, None
+            continue
+        if record is None:
+            continue
+        if name == record:
+            if url:
+                yield Entry(_RECORDS[name], urljoin(base_url, url),
+                            modified_at)
+            record = None
+            element.clear()
+            root.clear()
+        elif name in _DATES:
+            modified_at = modified_at \
+                or _parse_date((element.text or '').strip())
+        elif url:
+            continue    # the first URL wins over image:loc, xhtml:link...
+        elif name == 'loc' or (name == 'link' and record == 'item'):
+            url = (element.text or '').strip()
+        elif name == 'link' and element.get('rel', 'alternate') \
+                == 'alternate':
+            url = (element.get('href') or '').strip()
+
+
+class SitemapDiscoverer:
+    """ Finds a host's URLs in its sitemaps and feeds, without crawling
+
+    discover() reads the Sitemap lines of the host's robots.txt, or
+    /sitemap.xml if there are none, follows sitemap indexes breadth first
+    and streams every document, plain or gzipped, with entries(). Pages of
+    a sitemap on another host are ignored, as the sitemaps protocol
+    requires; feed items may link anywhere.
+
+    Discovered links are upserted with upsert_links in batches of
+    batch_size. A page's lastmod is passed to RecrawlPolicy.hint, so links
+    already fetched become due when they changed since and are deferred
+    when they did not.
+
+    Attributes:
+        graph: graph to upsert discovered links into
+        policy: RecrawlPolicy applying the lastmod hints
+        batch_size: links per upsert_links call
+        max_documents: sitemaps and feeds fetched per discover() call
+        timeout: seconds per HTTP request
+    """
+
+    def __init__(self,
+                 g: graph.Graph,
+                 policy: linkprovider.RecrawlPolicy = None,
+                 batch_size: int = 1000,
+                 max_documents: int = 1000,
+                 timeout: float = 30.0,
+                 registry: metrics.Registry = metrics.REGISTRY):
+        self.graph = g
+        self.policy = policy or linkprovider.RecrawlPolicy()
+        self.batch_size = batch_size
+        self.max_documents = max_documents
+        self.timeout = timeout
+        self._urls = registry.counter(
+            'discovery_urls_total', 'URLs found in sitemaps and feeds',
+            ('kind',))
+        self._documents = registry.counter(
+            'discovery_documents_total', 'Sitemaps and feeds fetched',
+            ('outcome',))
+        self._local = threading.local()
+
+    def discover(self, site: str, feeds: Iterable[str] = ()) -> int:
+        """ Upserts the URLs of site's sitemaps and of feeds, returns how
+            many were found
+        """
+        queue = deque((url, True) for url in self._sitemaps(site))
+        queue.extend((url, False) for url in feeds)
+        seen = set()
+        batch: list[Entry] = []
+        found = 0
+        while queue and len(seen) < self.max_documents:
+            url, is_sitemap = queue.popleft()
+            if url in seen:
+                continue
+            seen.add(url)
+            host = urlparse(url).netloc
+            for entry in self._fetch(url):
+                if entry.kind == SITEMAP:
+                    queue.append((entry.url, True))
+                    continue
+                if is_sitemap and urlparse(entry.url).netloc != host:
+                    continue
+                found += 1
+                self._urls.inc(kind='sitemap' if is_sitemap else 'feed')
+                batch.append(entry)
+                if len(batch) >= self.batch_size:
+                    self._upsert(batch)
+                    batch = []
+        if batch:
+            self._upsert(batch)
+        return found
+
+    def _sitemaps(self, site: str) -> list[str]:
+        """ Sitemap URLs listed in robots.txt, else the default location """
+        try:
+            response = self._session().get(urljoin(site, '/robots.txt'),
+                                           timeout=self.timeout)
+        except requests.RequestException:
+            response = None
+        sitemaps = []
+        if response is not None and response.status_code == 200:
+            for line in response.text.splitlines():
+                field, _, value = line.partition(':')
+                if field.strip().lower() == 'sitemap' and value.strip():
+                    sitemaps.append(urljoin(site, value.strip()))
+        return sitemaps or [urljoin(site, '/sitemap.xml')]
+
+    def _fetch(self, url: str) -> Iterator[Entry]:
+        try:
+            with self._session().get(url, stream=True,
+                                     timeout=self.timeout) as response:
+                if response.status_code != 200:
+                    self._documents.inc(outcome='error')
+                    return
+                response.raw.decode_content = True
+                source = response.raw
+                content_type = response.headers.get('Content-Type', '')
+                if url.endswith('.gz') or 'gzip' in content_type:
+                    source = gzip.GzipFile(fileobj=source)
+                yield from entries(_Limited(source, _MAX_BYTES),
+                                   base_url=url)
+        except (requests.RequestException, ParseError, OSError, EOFError):
+            self._documents.inc(outcome='error')
+            return
+        self._documents.inc(outcome='parsed')
+
+    def _upsert(self, batch: list[Entry]):
+        links = self.graph.upsert_links(
+            [graph.Link(url=entry.url) for entry in batch])
+        now = datetime.utcnow()
+        for link, entry in zip(links, batch):
+            if entry.modified_at is None:
+                continue
+            try:
+                previous = self.graph.find_crawl_status(link.link_id)
+            except KeyError:
+                continue
+            status = self.policy.hint(previous, entry.modified_at, now)
+            if status is not None:
+                self.graph.upsert_crawl_status(status)
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+
+class _Limited:
+    """ Reader raising OSError once more than limit bytes were read """
+
+    def __init__(self, source: BinaryIO, limit: int):
+        self.source = source
+        self.limit = limit
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.source.read(size)
+        self.limit -= len(data)
+        if self.limit < 0:
+            raise OSError('document exceeds the size limit')
+        return data
+
+
+def _parse_date(text: str) -> Optional[datetime]:
+    """ W3C datetime of sitemaps and Atom, or RFC 822 date of RSS """
+    try:
+        parsed = datetime.fromisoformat(text)
+    except ValueError:
+        try:
+            parsed = parsedate_to_datetime(text)
+        except (TypeError, ValueError):
+            return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
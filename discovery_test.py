@@ -0,0 +1,133 @@
+"""SitemapDiscovererTestCase"""
+
+import gzip
+import io
+import threading
+import unittest
+import uuid
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import discovery
+import graph
+import linkprovider
+import metrics
+
+MIN_ID = uuid.UUID(int=0)
+MAX_ID = uuid.UUID(int=(1 << 128) - 1)
+_SITEMAP = '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" ' \
+    'xmlns:image="http://www.google.com/schemas/sitemap-image/1.1">' \
+    '{}</urlset>'
+
+
+class EntriesTestCase(unittest.TestCase):
+    def test_sitemap_and_index(self):
+        sitemap = _SITEMAP.format(
+            '<url><loc> http://a.com/1 </loc>'
+            '<image:image><image:loc>http://a.com/1.png</image:loc>'
+            '</image:image><lastmod>2024-05-01T10:00:00+02:00</lastmod>'
+            '</url><url><loc>/2</loc><lastmod>bogus</lastmod></url>')
+        self.assertEqual(self._entries(sitemap, 'http://a.com/sitemap.xml'), [
+            discovery.Entry(discovery.PAGE, 'http://a.com/1',
+                            datetime(2024, 5, 1, 8)),
+            discovery.Entry(discovery.PAGE, 'http://a.com/2')])
+        index = '<sitemapindex><sitemap><loc>http://a.com/s.xml.gz</loc>' \
+            '</sitemap></sitemapindex>'
+        self.assertEqual(self._entries(index), [
+            discovery.Entry(discovery.SITEMAP, 'http://a.com/s.xml.gz')])
+
+    def test_feeds(self):
+        rss = '<rss><channel><link>http://a.com</link><item>' \
+            '<link>http://a.com/post</link>' \
+            '<pubDate>Wed, 01 May 2024 08:00:00 GMT</pubDate>' \
+            '</item></channel></rss>'
+        atom = '<feed xmlns="http://www.w3.org/2005/Atom"><entry>' \
+            '<link rel="edit" href="http://a.com/edit"/>' \
+            '<link href="http://a.com/entry"/>' \
+            '<updated>2024-05-01T08:00:00Z</updated></entry></feed>'
+        self.assertEqual(self._entries(rss) + self._entries(atom), [
+            discovery.Entry(discovery.PAGE, 'http://a.com/post',
+                            datetime(2024, 5, 1, 8)),
+            discovery.Entry(discovery.PAGE, 'http://a.com/entry',
+                            datetime(2024, 5, 1, 8))])
+
+    def _entries(self, document: str, base_url: str = ''):
+        return list(discovery.entries(io.BytesIO(document.encode()),
+                                      base_url))
+
+
+class SitemapDiscovererTestCase(unittest.TestCase):
+    def setUp(self):
+        documents = self.documents = {}
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = documents.get(self.path)
+                self.send_response(404 if body is None else 200)
+                self.end_headers()
+                self.wfile.write(body or b'')
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.site = 'http://127.0.0.1:%d' % server.server_address[1]
+        self.graph = graph.GraphInMemory()
+        self.sut = discovery.SitemapDiscoverer(
+            self.graph, batch_size=2, registry=metrics.Registry())
+
+    def test_discovers_sitemaps_and_feeds(self):
+        site = self.site
+        self.documents.update({
+            '/robots.txt': f'User-agent: *\nSitemap: {site}/index.xml\n'
+                           .encode(),
+            '/index.xml': (f'<sitemapindex><sitemap><loc>{site}/a.xml</loc>'
+                           f'</sitemap><sitemap><loc>{site}/b.xml.gz</loc>'
+                           f'</sitemap><sitemap><loc>{site}/gone.xml</loc>'
+                           f'</sitemap></sitemapindex>').encode(),
+            '/a.xml': _SITEMAP.format(
+                f'<url><loc>{site}/1</loc></url>'
+                f'<url><loc>http://elsewhere.com/</loc></url>').encode(),
+            '/b.xml.gz': gzip.compress(_SITEMAP.format(
+                f'<url><loc>{site}/2</loc></url>'
+                f'<url><loc>{site}/3</loc></url>').encode()),
+            '/feed': (f'<rss><channel><item><link>http://other.com/post'
+                      f'</link></item></channel></rss>').encode(),
+        })
+        self.assertEqual(self.sut.discover(site, feeds=[f'{site}/feed']), 4)
+        self.assertEqual(
+            sorted(link.url for link in self.graph.links_iter(
+                MIN_ID, MAX_ID, datetime.max)),
+            sorted([f'{site}/1', f'{site}/2', f'{site}/3',
+                    'http://other.com/post']))
+
+    def test_lastmod_hints_reschedule_fetched_links(self):
+        now = datetime.utcnow()
+        checked_at = now - timedelta(days=2)
+        policy = linkprovider.RecrawlPolicy()
+        statuses = {}
+        for path in ('/changed', '/unchanged'):
+            link = self.graph.upsert_link(graph.Link(url=self.site + path))
+            statuses[path] = self.graph.upsert_crawl_status(policy.record(
+                None, link.link_id, 200, 1, checked_at))
+        self.documents['/sitemap.xml'] = _SITEMAP.format(
+            f'<url><loc>{self.site}/changed</loc>'
+            f'<lastmod>{now.date()}</lastmod></url>'
+            f'<url><loc>{self.site}/unchanged</loc>'
+            f'<lastmod>{(checked_at - timedelta(days=1)).date()}</lastmod>'
+            f'</url><url><loc>{self.site}/new</loc>'
+            f'<lastmod>{now.date()}</lastmod></url>').encode()
+        self.assertEqual(self.sut.discover(self.site), 3)
+
+        changed = self.graph.find_crawl_status(statuses['/changed'].link_id)
+        self.assertLessEqual(changed.next_due_at, datetime.utcnow())
+        unchanged = self.graph.find_crawl_status(
+            statuses['/unchanged'].link_id)
+        self.assertGreater(unchanged.next_due_at,
+                           statuses['/unchanged'].next_due_at)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,259 @@
+"""FrontEnd."""
+
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Awaitable, Callable, Optional
+from urllib.parse import parse_qs, urlparse
+import graph
+import indexer as idx
+
+_REASONS = {200: 'OK', 201: 'Created', 400: 'Bad Request',
+            404: 'Not Found', 405: 'Method Not Allowed',
+            413: 'Payload Too Large',
+            431: 'Request Header Fields Too Large',
+            500: 'Internal Server Error'}
+_MAX_HEADER = 16 * 1024
+_MAX_BODY = 64 * 1024
+
+
+class ResponseCache:
+    """ TTL cache with LRU eviction holding futures of response bodies
+
+    Caching the future rather than its result coalesces identical requests
+    in flight: the first computes, the rest await the same future. Futures
+    that fail are dropped so the next request retries.
+
+    Attributes:
+        ttl: seconds an entry is served after it was created
+        size: entries kept, least recently used evicted first
+    """
+
+    def __init__(self, ttl: float = 5.0, size: int = 1024):
+        self.ttl = ttl
+        self.size = size
+        self._entries: OrderedDict[str, tuple[float, asyncio.Future]] = \
+            OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self,
+                  key: str,
+                  compute: Callable[[], Awaitable[bytes]]) -> bytes:
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            self._entries.move_to_end(key)
+            future = entry[1]
+        else:
+            future = asyncio.ensure_future(compute())
+            future.add_done_callback(
+                lambda done: self._discard_failed(key, done))
+            self._entries[key] = (now + self.ttl, future)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return await asyncio.shield(future)
+
+    def _discard_failed(self, key: str, future: asyncio.Future):
+        if future.cancelled() or future.exception() is not None:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is future:
+                del self._entries[key]
+
+
+class FrontEnd:
+    """ Asyncio HTTP/1.1 gateway over the indexer and link graph
+
+    Routes:
+        GET /search?q=terms&offset=N[&phrase=1]: one page of results as
+            JSON, ranked by the indexer, with next_offset when more follow
+        POST /submit, body url=...: upserts the link into the graph
+
+    The event loop only parses requests and writes responses. Index
+    lookups, which are blocking, run on executor threads, and the page is
+    built from the documents search_documents returns.
+    Search responses are cached per query and offset for cache_ttl seconds
+    and identical concurrent searches share one backend call, so a burst
+    of popular queries costs one lookup each.
+
+    Attributes:
+        graph: link graph for submissions
+        indexer: serves searches
+        page_size: results per page
+        cache: ResponseCache of encoded search responses
+        executor: threads running backend calls
+    """
+
+    def __init__(self,
+                 g: graph.Graph,
+                 indexer: idx.Indexer,
+                 page_size: int = 10,
+                 cache_ttl: float = 5.0,
+                 cache_size: int = 4096,
+                 max_workers: int = 32):
+        self.graph = g
+        self.indexer = indexer
+        self.page_size = page_size
+        self.cache = ResponseCache(ttl=cache_ttl, size=cache_size)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='frontend')
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8080) \
+            -> tuple[str, int]:
+        """ Starts listening, returns the bound address """
+        self._server = await asyncio.start_server(
+            self._serve_connection, host, port,
+            limit=_MAX_HEADER, backlog=1024)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self, host: str = '127.0.0.1', port: int = 8080):
+        await self.start(host, port)
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self.executor.shutdown(wait=False)
+
+    async def search(self, expression: str, offset: int = 0,
+                     phrase: bool = False) -> bytes:
+        """ Returns the JSON encoded result page, cached """
+        key = f'{int(phrase)}:{offset}:{expression}'
+        return await self.cache.get(
+            key, lambda: self._search(expression, offset, phrase))
+
+    async def submit(self, url: str) -> graph.Link:
+        parsed = urlparse(url)
+        if parsed.scheme not in ('http', 'https') or not parsed.netloc:
+            raise ValueError(f'not an absolute http(s) url: {url!r}')
+        return await self._run(self.graph.upsert_link, graph.Link(url=url))
+
+    async def _search(self, expression: str, offset: int,
+                      phrase: bool) -> bytes:
+        query = idx.Query(
+            query_type=idx.QueryType.PHRASE if phrase else idx.QueryType.MATCH,
+            expression=expression,
+            offset=offset)
+        documents = await self._run(self._page, query)
+        more = len(documents) > self.page_size
+        return json.dumps({
+            'query': expression,
+            'offset': offset,
+            'next_offset': offset + self.page_size if more else None,
+            'results': [{'link_id': str(document.link_id),
+                         'url': document.url,
+                         'title': document.title,
+                         'pagerank': document.pagerank}
+                        for document in documents[:self.page_size]],
+        }).encode()
+
+    def _page(self, query: idx.Query) -> list[idx.Document]:
+        """ One more than a page, to tell whether another page follows """
+        return list(islice(self.indexer.search_documents(query),
+                           self.page_size + 1))
+
+    def _run(self, function, *args) -> asyncio.Future:
+        return asyncio.get_running_loop().run_in_executor(
+            self.executor, function, *args)
+
+    async def _serve_connection(self, reader: asyncio.StreamReader,
+                                writer: asyncio.StreamWriter):
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except asyncio.IncompleteReadError:
+                    return
+                except asyncio.LimitOverrunError:
+                    await self._respond(
+                        writer, 431, _error('request head too large'), False)
+                    return
+                try:
+                    method, target, headers = _parse_head(head)
+                    length = int(headers.get('content-length', 0) or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self._respond(
+                        writer, 400, _error('malformed request'), False)
+                    return
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                if length > _MAX_BODY:
+                    await self._respond(writer, 413, b'{}', False)
+                    return
+                body = await reader.readexactly(length) if length else b''
+                status, payload = await self._route(method, target, body)
+                await self._respond(writer, status, payload, keep_alive)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, target: str,
+                     body: bytes) -> tuple[int, bytes]:
+        url = urlparse(target)
+        if url.path == '/search':
+            if method != 'GET':
+                return 405, _error('use GET')
+            parameters = parse_qs(url.query)
+            try:
+                offset = int(parameters.get('offset', ['0'])[0])
+            except ValueError:
+                return 400, _error('offset must be an integer')
+            expression = parameters.get('q', [''])[0]
+            if offset < 0 or not expression.strip():
+                return 400, _error('q is required, offset >= 0')
+            phrase = parameters.get('phrase', ['0'])[0] == '1'
+            try:
+                return 200, await self.search(expression, offset, phrase)
+            except Exception:
+                return 500, _error('search failed')
+        if url.path == '/submit':
+            if method != 'POST':
+                return 405, _error('use POST')
+            submitted = parse_qs(body.decode(errors='replace')).get('url')
+            try:
+                link = await self.submit(submitted[0] if submitted else '')
+            except ValueError as error:
+                return 400, _error(str(error))
+            except Exception:
+                return 500, _error('submit failed')
+            return 201, json.dumps({'link_id': str(link.link_id),
+                                    'url': link.url}).encode()
+        return 404, _error('not found')
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int,
+                       payload: bytes, keep_alive: bool):
+        writer.write(
+            f'HTTP/1.1 {status} {_REASONS[status]}\r\n'
+            f'Content-Type: application/json\r\n'
+            f'Content-Length: {len(payload)}\r\n'
+            f'Connection: {"keep-alive" if keep_alive else "close"}\r\n'
+            f'\r\n'.encode() + payload)
+        await writer.drain()
+
+
+def _parse_head(head: bytes) -> tuple[str, str, dict[str, str]]:
+    """ Request line and headers, raises ValueError when malformed """
+    lines = head.decode('latin-1').split('\r\n')
+    method, target, _ = lines[0].split(' ', 2)
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+    return method, target, headers
+
+
+def _error(message: str) -> bytes:
+    return json.dumps({'error': message}).encode()
+
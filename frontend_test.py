@@ -0,0 +1,124 @@
+"""FrontEndTestCase"""
+
+import asyncio
+import json
+import unittest
+import uuid
+import frontend
+import graph
+import indexer
+
+
+class CountingIndexer(indexer.IndexerInMemory):
+    def __init__(self):
+        super().__init__()
+        self.searches = 0
+
+    def search_documents(self, query: indexer.Query):
+        self.searches += 1
+        return super().search_documents(query)
+
+    def find_document_by_link_id(self, link_id: uuid.UUID):
+        raise AssertionError('search results are already documents')
+
+
+class FrontEndTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.graph = graph.GraphInMemory()
+        self.indexer = CountingIndexer()
+        for rank in range(5):
+            self.indexer.upsert_document_index(indexer.Document(
+                link_id=uuid.uuid4(), url=f'http://{rank}.com',
+                title='examples'))
+        self.indexer.update_pagerank_scores(
+            (link_id, rank / 10)
+            for rank, link_id in enumerate(self.indexer.documents))
+        self.sut = frontend.FrontEnd(self.graph, self.indexer, page_size=2)
+        self.host, self.port = await self.sut.start(port=0)
+
+    async def asyncTearDown(self):
+        await self.sut.close()
+
+    async def test_search_pages(self):
+        status, page = await self._request('GET /search?q=examples')
+        self.assertEqual(status, 200)
+        self.assertEqual([result['url'] for result in page['results']],
+                         ['http://4.com', 'http://3.com'])
+        self.assertEqual(page['next_offset'], 2)
+
+        _, page = await self._request('GET /search?q=examples&offset=4')
+        self.assertEqual([result['url'] for result in page['results']],
+                         ['http://0.com'])
+        self.assertIsNone(page['next_offset'])
+
+    async def test_concurrent_searches_share_cache(self):
+        responses = await asyncio.gather(*(
+            self._request('GET /search?q=examples') for _ in range(50)))
+        self.assertEqual({status for status, _ in responses}, {200})
+        self.assertEqual(self.indexer.searches, 1)
+
+    async def test_submit(self):
+        status, body = await self._request('POST /submit',
+                                           b'url=https%3A%2F%2Fexample.com')
+        self.assertEqual(status, 201)
+        link = self.graph.find_link(uuid.UUID(body['link_id']))
+        self.assertEqual(link.url, 'https://example.com')
+
+        status, _ = await self._request('POST /submit', b'url=nope')
+        self.assertEqual(status, 400)
+
+        def locked(link: graph.Link):
+            raise RuntimeError('database is locked')
+        self.graph.upsert_link = locked
+        status, body = await self._request('POST /submit',
+                                           b'url=https%3A%2F%2Fexample.org')
+        self.assertEqual((status, body), (500, {'error': 'submit failed'}))
+
+    async def test_bad_requests(self):
+        for request, expected in (('GET /search', 400),
+                                  ('GET /search?q=a&offset=x', 400),
+                                  ('POST /search?q=a', 405),
+                                  ('GET /nowhere', 404)):
+            status, _ = await self._request(request)
+            self.assertEqual(status, expected, request)
+
+        for head, expected in ((b'GET\r\n\r\n', 400),
+                               (b'POST /submit HTTP/1.1\r\n'
+                                b'Content-Length: x\r\n\r\n', 400),
+                               (b'POST /submit HTTP/1.1\r\n'
+                                b'Content-Length: -1\r\n\r\n', 400),
+                               (b'GET / HTTP/1.1\r\nX: ' + b'a' * 20000
+                                + b'\r\n\r\n', 431)):
+            reader, writer = await asyncio.open_connection(self.host,
+                                                           self.port)
+            writer.write(head)
+            status, _ = await _read_response(reader)
+            writer.close()
+            self.assertEqual(status, expected, head[:30])
+
+    async def test_keep_alive(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        for _ in range(3):
+            writer.write(b'GET /search?q=examples HTTP/1.1\r\n\r\n')
+            status, _ = await _read_response(reader)
+            self.assertEqual(status, 200)
+        writer.close()
+
+    async def _request(self, request: str, body: bytes = b''):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        writer.write(f'{request} HTTP/1.1\r\nConnection: close\r\n'
+                     f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+        response = await _read_response(reader)
+        writer.close()
+        return response
+
+
+async def _read_response(reader: asyncio.StreamReader):
+    head = (await reader.readuntil(b'\r\n\r\n')).decode()
+    status = int(head.split(' ', 2)[1])
+    length = int(head.lower().split('content-length: ')[1].split('\r\n')[0])
+    return status, json.loads(await reader.readexactly(length))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,14 +1,42 @@
 """Graph."""
 
+import threading
 import uuid
 from abc import ABCMeta, abstractmethod
-from typing import Iterator
-from datetime import datetime
-from copy import deepcopy
-from collections import defaultdict
+from array import array
+from bisect import bisect_left, insort
+from collections.abc import Mapping
+from contextlib import nullcontext
+from typing import Iterator, Optional
+from datetime import datetime, timedelta
+import graph_csr
 
 EdgeList = list[uuid.UUID]
 
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def to_timestamp(dt: datetime) -> int:
+    """ Returns naive dt as integer microseconds since datetime.min """
+    return (dt - datetime.min) // _MICROSECOND
+
+
+def from_timestamp(timestamp: int) -> datetime:
+    """ Inverse of to_timestamp """
+    return datetime.min + timedelta(microseconds=timestamp)
+
+
+def partition_ranges(partitions: int) -> list[tuple[uuid.UUID, uuid.UUID]]:
+    """ Splits the UUID space into equal [from_id, to_id) ranges
+
+    The last range ends at the all-ones UUID, which links_iter excludes;
+    uuid4 never generates it.
+    """
+    bounds = [(index << 128) // partitions for index in range(partitions)]
+    bounds.append((1 << 128) - 1)
+    return [(uuid.UUID(int=lower), uuid.UUID(int=upper))
+            for lower, upper in zip(bounds, bounds[1:])]
+
 
 class Link:
     """ Encapsulates all information about a link discovered by crawler """
@@ -62,12 +90,55 @@ class Edge:
             updated_at:\t{self.updated_at}\n'
 
 
+class CrawlStatus:
+    """ Outcome history of crawling a link, drives recrawl scheduling
+
+    status_code is 0 when the fetch got no response. content_hash
+    fingerprints the last fetched body, changes counts fetches whose body
+    differed from the one before, out of fetches successful ones.
+    """
+    __slots__ = 'link_id', 'status_code', 'failures', 'fetches', 'changes', \
+        'content_hash', 'interval', 'checked_at', 'next_due_at'
+
+    def __init__(self,
+                 link_id: uuid.UUID = uuid.UUID(int=0),
+                 status_code: int = 0,
+                 failures: int = 0,
+                 fetches: int = 0,
+                 changes: int = 0,
+                 content_hash: int = 0,
+                 interval: timedelta = timedelta(0),
+                 checked_at: datetime = datetime.min,
+                 next_due_at: datetime = datetime.min):
+        self.link_id = link_id
+        self.status_code = status_code
+        self.failures = failures
+        self.fetches = fetches
+        self.changes = changes
+        self.content_hash = content_hash
+        self.interval = interval
+        self.checked_at = checked_at
+        self.next_due_at = next_due_at
+
+    def __eq__(self, other):
+        return all(getattr(self, name) == getattr(other, name)
+                   for name in self.__slots__)
+
+    def __repr__(self) -> str:
+        return ''.join(f'\n            {name}:\t{getattr(self, name)}'
+                       for name in self.__slots__) + '\n'
+
+
 class Graph(metaclass=ABCMeta):
     """ Graph implemented by objects that can mutate or query a link graph """
     @ abstractmethod
     def upsert_link(self, link: Link) -> Link:
         """ Creates a new link or updates existing """
 
+    def upsert_links(self, links: list[Link]) -> list[Link]:
+        """ Upserts links in bulk, backends override to batch the writes """
+        return [self.upsert_link(link) for link in links]
+
     @ abstractmethod
     def find_link(self, link_id: uuid.UUID) -> Link:
         """ Looks up a link by its id """
@@ -103,114 +174,667 @@ class Graph(metaclass=ABCMeta):
         specified source link
         """
 
+    @ abstractmethod
+    def find_crawl_status(self, link_id: uuid.UUID) -> CrawlStatus:
+        """ Looks up the crawl status of a link, KeyError if never recorded """
+
+    @ abstractmethod
+    def upsert_crawl_status(self, status: CrawlStatus) -> CrawlStatus:
+        """ Stores the crawl status of a stored link, KeyError otherwise
+
+        A status whose checked_at is older than the stored one is ignored, so
+        replays and racing crawlers never roll a link's history back.
+        """
+
+    def crawl_statuses_iter(self,
+                            from_id: uuid.UUID,
+                            to_id: uuid.UUID) -> Iterator[CrawlStatus]:
+        """ Returns iterator for crawl statuses of links between from, to
+
+        Statuses come in link_id order, like links_iter, so a scan can merge
+        both. Backends override to read the range in bulk, this default looks
+        each link up.
+        """
+        for link in self.links_iter(from_id, to_id, datetime.max):
+            try:
+                yield self.find_crawl_status(link.link_id)
+            except KeyError:
+                continue
+
+
+_NO_LOCK = nullcontext()
+
+
+class _LockStripes:
+    """ Fixed pool of locks picked by key, no-op contexts when count is 0 """
+
+    def __init__(self, count: int):
+        self._locks = [threading.Lock() for _ in range(count)]
+
+    def __call__(self, key: int):
+        if not self._locks:
+            return _NO_LOCK
+        return self._locks[key % len(self._locks)]
+
+
+class _SortedKeys:
+    """ Sorted int keys kept as bounded chunks, a flat two-level B-tree
+
+    Inserts bisect the chunk maxima, insort into one chunk and split it once
+    it outgrows twice the chunk size, so an insert moves at most one chunk.
+    Range scans are O(log n + k) and copy one chunk slice at a time.
+    """
+    chunk_size = 1024
+
+    def __init__(self, lock=_NO_LOCK):
+        self._chunks: list[list[int]] = []
+        self._maxes: list[int] = []
+        self._len = 0
+        self._lock = lock
+
+    def __len__(self) -> int:
+        return self._len
+
+    def add(self, key: int):
+        with self._lock:
+            self._add(key)
+
+    def keys(self) -> list[int]:
+        with self._lock:
+            return [key for chunk in self._chunks for key in chunk]
+
+    def _add(self, key: int):
+        self._len += 1
+        if not self._chunks:
+            self._chunks.append([key])
+            self._maxes.append(key)
+            return
+        position = bisect_left(self._maxes, key)
+        if position == len(self._maxes):
+            position -= 1
+            self._chunks[position].append(key)
+            self._maxes[position] = key
+        else:
+            insort(self._chunks[position], key)
+        chunk = self._chunks[position]
+        if len(chunk) > 2 * self.chunk_size:
+            self._chunks[position:position + 1] = \
+                [chunk[:self.chunk_size], chunk[self.chunk_size:]]
+            self._maxes.insert(position, chunk[self.chunk_size - 1])
+
+    def irange(self, lower: int, upper: int) -> Iterator[int]:
+        """ Yields keys lower <= key < upper in order
+
+        Resumes by key after each chunk, so keys inserted concurrently ahead
+        of the cursor are seen and keys inserted behind it are skipped;
+        callers wanting a snapshot filter out keys added after they started.
+        """
+        start = lower
+        while start < upper:
+            with self._lock:
+                position = bisect_left(self._maxes, start)
+                if position == len(self._maxes):
+                    return
+                chunk = self._chunks[position]
+                end = bisect_left(chunk, upper)
+                batch = chunk[bisect_left(chunk, start):end]
+                last_chunk = end < len(chunk) or not batch
+            yield from batch
+            if last_chunk:
+                return
+            start = batch[-1] + 1
+
+
+# Dense ids are stored as signed 32-bit ints, which caps a single graph at
+# 2**31 - 1 links and edges; timestamps are to_timestamp() microseconds
+_ID_TYPE = 'i'
+_TIMESTAMP_TYPE = 'q'
+_NONE = -1
+_UUID_SIZE = 16
+# Crawl statuses are rows of int64 fields in one array, status_code _NONE
+# marks a link without one: status_code, failures, fetches, changes,
+# content_hash, interval microseconds, checked_at, next_due_at
+_STATUS_FIELDS = 8
+_NO_STATUS = array('q', [_NONE] + [0] * (_STATUS_FIELDS - 1))
+_CHECKED_AT = 6
+
+
+class _EdgeIndex:
+    """ Open-addressing hash set of edge numbers, keyed by (src, dst)
+
+    Slots are one array of edge numbers probed linearly from a Fibonacci
+    hash of the packed pair; keys are compared through the graph's edge
+    endpoint arrays, so an edge costs 4 bytes per slot. The table doubles
+    once live and deleted slots exceed two thirds of it, keeping an edge at
+    6 to 12 bytes, and rehashing drops the deleted markers.
+    """
+    _DELETED = -2
+    _MULTIPLIER = 0x9E3779B97F4A7C15
+    _MASK = (1 << 64) - 1
+
+    def __init__(self, src: array, dst: array, lock=_NO_LOCK):
+        self._src = src
+        self._dst = dst
+        self._lock = lock
+        self._bits = 3
+        self._slots = array(_ID_TYPE, [_NONE]) * (1 << self._bits)
+        self._used = 0          # live and deleted slots
+
+    def get(self, src: int, dst: int) -> int:
+        """ Edge number of src -> dst, _NONE if missing """
+        with self._lock:
+            slot = self._find(src, dst)
+            return _NONE if slot == _NONE else self._slots[slot]
+
+    def add(self, number: int):
+        """ Inserts an edge number whose endpoints are not indexed yet """
+        with self._lock:
+            if 3 * (self._used + 1) > 2 * len(self._slots):
+                self._resize()
+            slot = self._hash(self._src[number], self._dst[number])
+            mask = len(self._slots) - 1
+            while self._slots[slot] >= 0:
+                slot = (slot + 1) & mask
+            if self._slots[slot] == _NONE:
+                self._used += 1
+            self._slots[slot] = number
+
+    def remove(self, src: int, dst: int):
+        with self._lock:
+            slot = self._find(src, dst)
+            if slot != _NONE:
+                self._slots[slot] = self._DELETED
+
+    def _hash(self, src: int, dst: int) -> int:
+        return ((src << 32 | dst) * self._MULTIPLIER & self._MASK) \
+            >> (64 - self._bits)
+
+    def _find(self, src: int, dst: int) -> int:
+        """ Slot holding src -> dst, _NONE if missing """
+        slots, mask = self._slots, len(self._slots) - 1
+        slot = self._hash(src, dst)
+        while True:
+            number = slots[slot]
+            if number == _NONE:
+                return _NONE
+            if number >= 0 and self._src[number] == src \
+                    and self._dst[number] == dst:
+                return slot
+            slot = (slot + 1) & mask
+
+    def _resize(self):
+        """ Rehashes the live edges into a table a third full """
+        live = [number for number in self._slots if number >= 0]
+        self._bits = 3
+        while 3 * (len(live) + 1) > 1 << self._bits:
+            self._bits += 1
+        self._slots = array(_ID_TYPE, [_NONE]) * (1 << self._bits)
+        mask = len(self._slots) - 1
+        for number in live:
+            slot = self._hash(self._src[number], self._dst[number])
+            while self._slots[slot] != _NONE:
+                slot = (slot + 1) & mask
+            self._slots[slot] = number
+        self._used = len(live)
+
 
 class GraphInMemory(Graph):
-    """ Implements graph interface (TODO: synchronize)
+    """ Implements graph interface, thread-safe when lock_stripes > 0
+
+    Link UUIDs and URLs are interned to dense integer link numbers, edges to
+    dense edge numbers. Per-item state lives in typed arrays indexed by those
+    numbers and each link's outgoing edges form a singly linked list threaded
+    through _edge_next, so an edge costs ~36 bytes of arrays plus 6 to 12
+    bytes of _edge_index slots instead of a handful of Python objects. Edge
+    numbers freed by remove_stale_edges are reused. Crawl statuses are a row
+    of int64 fields per link in _link_status.
+    Link UUIDs are also kept in a _SortedKeys index, so links_iter and
+    edges_iter serve a UUID range lazily in O(log n + k), and _edge_index
+    finds the edge number of a (src, dst) pair for O(1) upserts.
+
+    With lock_stripes > 0, upsert_link serializes on a stripe picked by URL
+    hash and upsert_edge / remove_stale_edges on a stripe picked by source
+    link number, so writers touching different URLs and sources proceed in
+    parallel. Allocating link and edge numbers and updating the sorted key
+    index take short dedicated locks. Readers never block writers: every
+    Link is read atomically and edges_iter reads each source's edge list
+    under its stripe, so it sees that list as of one instant.
 
     Attributes:
-        links: dict[UUID, Link] for inserted link models, link_id as key
-        edges: dict[UUID, Edge] for inserted edge models, edge_id as key
-        link_url_index: dict[str, Link] ensure link.url unique, refer self.links
-        link_edge_map: dict[UUID, EdgeList] efficient get all edges for link_id
+        links: read-only Mapping[UUID, Link] view, materialized on access
+        edges: read-only Mapping[UUID, Edge] view, materialized on access
+        link_edge_map: read-only Mapping[UUID, EdgeList] view of adjacency
     """
 
-    def __init__(self,
-                 links: dict[uuid.UUID, Link] = {},
-                 edges: dict[uuid.UUID, Edge] = {},
-                 link_url_index: dict[str, Link] = {},
-                 link_edge_map: dict[uuid.UUID, EdgeList] = defaultdict(list)):
-        self.links = links
-        self.edges = edges
-        self.link_url_index = link_url_index
-        self.link_edge_map = link_edge_map
+    def __init__(self, lock_stripes: int = 0):
+        # Locks, all no-op contexts when lock_stripes is 0
+        self._url_locks = _LockStripes(lock_stripes)
+        self._src_locks = _LockStripes(lock_stripes)
+        self._link_alloc = threading.Lock() if lock_stripes else _NO_LOCK
+        self._edge_alloc = threading.Lock() if lock_stripes else _NO_LOCK
+        # Links, indexed by link number
+        self._link_uuids = bytearray()
+        self._link_urls: list[str] = []
+        self._link_retrieved = array(_TIMESTAMP_TYPE)
+        self._link_first_edge = array(_ID_TYPE)
+        self._link_status = array('q')
+        self._link_index: dict[int, int] = {}    # UUID.int -> link number
+        self._link_keys = _SortedKeys(           # UUID.int, ordered
+            threading.Lock() if lock_stripes else _NO_LOCK)
+        self._url_index: dict[str, int] = {}     # url -> link number
+        # Edges, indexed by edge number
+        self._edge_uuids = bytearray()
+        self._edge_src = array(_ID_TYPE)
+        self._edge_dst = array(_ID_TYPE)
+        self._edge_updated = array(_TIMESTAMP_TYPE)
+        self._edge_next = array(_ID_TYPE)
+        self._edge_free = array(_ID_TYPE)
+        self._edge_index = _EdgeIndex(           # (src, dst) -> edge
+            self._edge_src, self._edge_dst,
+            threading.Lock() if lock_stripes else _NO_LOCK)
+
+    @property
+    def links(self) -> Mapping[uuid.UUID, Link]:
+        return _LinksView(self)
+
+    @property
+    def edges(self) -> Mapping[uuid.UUID, Edge]:
+        return _EdgesView(self)
+
+    @property
+    def link_edge_map(self) -> Mapping[uuid.UUID, EdgeList]:
+        return _LinkEdgeView(self)
 
     def find_link(self, link_id: uuid.UUID) -> Link:
-        """ Returns deepcopy of link else raises NotFound """
-        link = self.links.get(link_id, False)
-        if not link:
-            raise KeyError('find_link(link_id={link_id})')
-        return deepcopy(link)
+        """ Returns copy of link else raises KeyError """
+        number = self._link_index.get(_uuid_key(link_id))
+        if number is None:
+            raise KeyError(f'find_link(link_id={link_id})')
+        return self._link(number)
 
     def upsert_link(self, link: Link) -> Link:
         """
         If link with same URL already exists, execute update
         else assign new id and insert link
         """
-        if link.url in self.link_url_index:
-            link_stored = self.link_url_index[link.url]
-            link_stored.retrieved_at = max(
-                link_stored.retrieved_at,
-                link.retrieved_at)
-            return deepcopy(link_stored)
-
-        link_copy = deepcopy(link)
-        link_copy.link_id = uuid.uuid4()
-        while self.links.get(link_copy.link_id, False):
-            link_copy.link_id = uuid.uuid4()
-        self.link_url_index[link_copy.url] = link_copy
-        self.links[link_copy.link_id] = link_copy
-        return link_copy
+        retrieved_at = to_timestamp(link.retrieved_at)
+        with self._url_locks(hash(link.url)):
+            number = self._url_index.get(link.url)
+            if number is not None:
+                if retrieved_at > self._link_retrieved[number]:
+                    self._link_retrieved[number] = retrieved_at
+                return self._link(number)
+
+            with self._link_alloc:
+                link_id = uuid.uuid4()
+                while link_id.int in self._link_index:
+                    link_id = uuid.uuid4()
+                number = self._insert_link(link_id, link.url, retrieved_at)
+        return self._link(number)
 
     def links_iter(self,
                    from_id: uuid.UUID,
                    to_id: uuid.UUID,
                    retrieved_before: datetime) -> Iterator[Link]:
-        return (link for link in deepcopy(self.links).values()
-                if from_id <= link.link_id < to_id
-                and link.retrieved_at < retrieved_before)
+        """ Streams the range as of the call: link numbers grow with
+            insertion, so links inserted once it started are skipped
+        """
+        return self._links_iter(from_id.int, to_id.int,
+                                to_timestamp(retrieved_before),
+                                len(self._link_urls))
+
+    def _links_iter(self, lower: int, upper: int, before: int,
+                    inserted: int) -> Iterator[Link]:
+        for key in self._link_keys.irange(lower, upper):
+            number = self._link_index[key]
+            if number < inserted and self._link_retrieved[number] < before:
+                yield self._link(number)
+
+    def dump_links_iter(self) -> Iterator[tuple[Link,
+                                                Optional[CrawlStatus]]]:
+        """ Streams every link with its crawl status, None if it has none
+
+        Unbounded, unlike links_iter, so dumps keep links retrieved at
+        datetime.max and the all-ones UUID; links are as of the call.
+        """
+        inserted = len(self._link_urls)
+        for key in self._link_keys.irange(0, 1 << 128):
+            number = self._link_index[key]
+            if number < inserted:
+                yield self._link(number), self._crawl_status(number)
 
     def upsert_edge(self, edge: Edge) -> Edge:
         """ Updates or inserts new edge into mem store
-            - Traverse edges that originate from src and check ifexists edge
-            with same destination
-            - If so, update updated_at and copy vals back to param edge
-            - This syncs provided edge's id and updated_at with mem store
+            - Look up an existing src -> dst edge in the edge index
+            - If so, update updated_at and return a copy of the stored edge
+            - Edge UUIDs are uuid4 and not checked for collisions, doing so
+            would need a per-edge index
         """
-        if edge.src not in self.links or \
-                edge.dst not in self.links:
+        src = self._link_index.get(_uuid_key(edge.src))
+        dst = self._link_index.get(_uuid_key(edge.dst))
+        if src is None or dst is None:
             raise KeyError('Edge src or dst not in stored links')
 
-        for edge_id in self.link_edge_map.get(edge.src, []):
-            edge_stored = self.edges[edge_id]
-            if edge_stored.src == edge.src and \
-                    edge_stored.dst == edge.dst:
-                edge_stored.updated_at = datetime.utcnow()
-                return deepcopy(edge_stored)
-
-        # Insert new edge and ensure unique uuid
-        edge_copy = deepcopy(edge)
-        edge_copy.edge_id = uuid.uuid4()
-        while self.edges.get(edge_copy.edge_id, False):
-            edge_copy.edge_id = uuid.uuid4()
-        edge_copy.updated_at = datetime.utcnow()
-        self.edges[edge_copy.edge_id] = edge_copy
-        self.link_edge_map[edge_copy.src] += [edge_copy.edge_id]
-        return edge_copy
+        updated_at = to_timestamp(datetime.utcnow())
+        with self._src_locks(src):
+            number = self._edge_index.get(src, dst)
+            if number != _NONE:
+                self._edge_updated[number] = updated_at
+            else:
+                number = self._insert_edge(uuid.uuid4(), src, dst, updated_at)
+            return self._edge(number)
 
     def edges_iter(self,
                    from_id: uuid.UUID,
                    to_id: uuid.UUID,
                    updated_before: datetime) -> Iterator[Edge]:
-        result = []
-        for link_id in self.links:
-            if link_id < from_id or link_id >= to_id:
-                continue
-            for edge_id in self.link_edge_map[link_id]:
-                edge = self.edges.get(edge_id, False)
-                if edge and edge.updated_at < updated_before:
-                    result.append(edge)
-        return iter(result)
+        return self._edges_iter(from_id.int, to_id.int,
+                                to_timestamp(updated_before))
+
+    def dump_edges_iter(self) -> Iterator[Edge]:
+        """ Streams every edge, unbounded like dump_links_iter """
+        return self._edges_iter(0, 1 << 128, None)
+
+    def _edges_iter(self, lower: int, upper: int,
+                    before: Optional[int]) -> Iterator[Edge]:
+        for key in self._link_keys.irange(lower, upper):
+            src = self._link_index[key]
+            with self._src_locks(src):
+                edges = [self._edge(number) for number in self._out_edges(src)
+                         if before is None
+                         or self._edge_updated[number] < before]
+            yield from edges
 
     def remove_stale_edges(self,
                            from_id: uuid.UUID,
                            deletion_treshold: datetime):
-        new_edgelist: EdgeList = []
-        for edge_id in self.link_edge_map[from_id]:
-            edge_stored = self.edges[edge_id]
-            # if stored edge is earlier updated than given time
-            if edge_stored.updated_at < deletion_treshold:
-                del self.edges[edge_id]
-                continue
-            # otherwise append to new list
-            new_edgelist.append(edge_id)
-        self.link_edge_map[from_id] = new_edgelist
+        src = self._link_index.get(_uuid_key(from_id))
+        if src is None:
+            return
+        treshold = to_timestamp(deletion_treshold)
+        with self._src_locks(src):
+            previous, number = _NONE, self._link_first_edge[src]
+            while number != _NONE:
+                following = self._edge_next[number]
+                # if stored edge is earlier updated than given time unlink it
+                if self._edge_updated[number] < treshold:
+                    if previous == _NONE:
+                        self._link_first_edge[src] = following
+                    else:
+                        self._edge_next[previous] = following
+                    self._free_edge(number)
+                else:
+                    previous = number
+                number = following
+
+    def find_crawl_status(self, link_id: uuid.UUID) -> CrawlStatus:
+        number = self._link_index.get(_uuid_key(link_id))
+        status = None if number is None else self._crawl_status(number)
+        if status is None:
+            raise KeyError(f'find_crawl_status(link_id={link_id})')
+        return status
+
+    def crawl_statuses_iter(self,
+                            from_id: uuid.UUID,
+                            to_id: uuid.UUID) -> Iterator[CrawlStatus]:
+        for key in self._link_keys.irange(from_id.int, to_id.int):
+            status = self._crawl_status(self._link_index[key])
+            if status is not None:
+                yield status
+
+    def upsert_crawl_status(self, status: CrawlStatus) -> CrawlStatus:
+        number = self._link_index.get(_uuid_key(status.link_id))
+        if number is None:
+            raise KeyError('Crawl status link not in stored links')
+        row = array('q', (status.status_code,
+                          status.failures,
+                          status.fetches,
+                          status.changes,
+                          status.content_hash,
+                          status.interval // _MICROSECOND,
+                          to_timestamp(status.checked_at),
+                          to_timestamp(status.next_due_at)))
+        offset = number * _STATUS_FIELDS
+        with self._src_locks(number):
+            stored = self._link_status[offset:offset + _STATUS_FIELDS]
+            if stored[0] == _NONE \
+                    or stored[_CHECKED_AT] <= row[_CHECKED_AT]:
+                self._link_status[offset:offset + _STATUS_FIELDS] = row
+        return self.find_crawl_status(status.link_id)
+
+    def restore_link(self, link: Link) -> Link:
+        """ Inserts link keeping its link_id, for recovery and replication
+
+        Idempotent: a stored link with the same URL keeps its id and takes
+        the later retrieved_at.
+        """
+        retrieved_at = to_timestamp(link.retrieved_at)
+        with self._url_locks(hash(link.url)):
+            number = self._url_index.get(link.url)
+            if number is None:
+                with self._link_alloc:
+                    number = self._insert_link(
+                        link.link_id, link.url, retrieved_at)
+            elif retrieved_at > self._link_retrieved[number]:
+                self._link_retrieved[number] = retrieved_at
+            return self._link(number)
+
+    def restore_edge(self, edge: Edge) -> Edge:
+        """ Inserts edge keeping its edge_id and updated_at, see restore_link
+
+        Raises KeyError if src or dst is not a stored link.
+        """
+        src = self._link_index.get(_uuid_key(edge.src))
+        dst = self._link_index.get(_uuid_key(edge.dst))
+        if src is None or dst is None:
+            raise KeyError('Edge src or dst not in stored links')
+        updated_at = to_timestamp(edge.updated_at)
+        with self._src_locks(src):
+            number = self._edge_index.get(src, dst)
+            if number == _NONE:
+                number = self._insert_edge(edge.edge_id, src, dst, updated_at)
+            elif updated_at > self._edge_updated[number]:
+                self._edge_updated[number] = updated_at
+            return self._edge(number)
+
+    def export_csr(self, path: str):
+        """ Writes a point-in-time graph_csr snapshot of all links and edges
+
+        Holding both allocation locks freezes the set of links and live edges
+        while the key order and edge endpoint arrays are copied; the CSR is
+        then built from the copies without blocking writers.
+        """
+        with self._link_alloc, self._edge_alloc:
+            keys = self._link_keys.keys()
+            edge_src = array(_ID_TYPE, self._edge_src)
+            edge_dst = array(_ID_TYPE, self._edge_dst)
+
+        rank = array(_ID_TYPE, [0]) * len(keys)
+        for row, key in enumerate(keys):
+            rank[self._link_index[key]] = row
+        offsets = array('q', [0]) * (len(keys) + 1)
+        for src in edge_src:
+            if src != _NONE:
+                offsets[rank[src] + 1] += 1
+        for row in range(len(keys)):
+            offsets[row + 1] += offsets[row]
+        targets = array('i', [0]) * offsets[-1]
+        cursors = array('q', offsets)
+        for src, dst in zip(edge_src, edge_dst):
+            if src != _NONE:
+                row = rank[src]
+                targets[cursors[row]] = rank[dst]
+                cursors[row] += 1
+        link_ids = b''.join(key.to_bytes(_UUID_SIZE, 'big') for key in keys)
+        graph_csr.write_csr(path, link_ids, offsets, targets)
+
+    def _insert_link(self,
+                     link_id: uuid.UUID,
+                     url: str,
+                     retrieved_at: int) -> int:
+        number, key = len(self._link_urls), link_id.int
+        self._link_uuids += link_id.bytes
+        self._link_urls.append(url)
+        self._link_retrieved.append(retrieved_at)
+        self._link_first_edge.append(_NONE)
+        self._link_status += _NO_STATUS
+        self._link_index[key] = number
+        self._link_keys.add(key)
+        self._url_index[url] = number
+        return number
+
+    def _insert_edge(self,
+                     edge_id: uuid.UUID,
+                     src: int,
+                     dst: int,
+                     updated_at: int) -> int:
+        """ Stores edge in a free slot or appends one, prepends to src list
+
+        Callers hold the src stripe, which guards the src edge list.
+        """
+        with self._edge_alloc:
+            if self._edge_free:
+                number = self._edge_free.pop()
+                offset = number * _UUID_SIZE
+                self._edge_uuids[offset:offset + _UUID_SIZE] = edge_id.bytes
+                self._edge_src[number] = src
+                self._edge_dst[number] = dst
+                self._edge_updated[number] = updated_at
+            else:
+                number = len(self._edge_src)
+                self._edge_uuids += edge_id.bytes
+                self._edge_src.append(src)
+                self._edge_dst.append(dst)
+                self._edge_updated.append(updated_at)
+                self._edge_next.append(_NONE)
+        self._edge_next[number] = self._link_first_edge[src]
+        self._link_first_edge[src] = number
+        self._edge_index.add(number)
+        return number
+
+    def _free_edge(self, number: int):
+        """ Zeroes the slot's UUID so lookups by edge_id skip it """
+        self._edge_index.remove(self._edge_src[number],
+                                self._edge_dst[number])
+        offset = number * _UUID_SIZE
+        with self._edge_alloc:
+            self._edge_uuids[offset:offset + _UUID_SIZE] = bytes(_UUID_SIZE)
+            self._edge_src[number] = _NONE
+            self._edge_next[number] = _NONE
+            self._edge_free.append(number)
+
+    def _out_edges(self, src: int) -> list[int]:
+        numbers = []
+        number = self._link_first_edge[src]
+        while number != _NONE:
+            numbers.append(number)
+            number = self._edge_next[number]
+        return numbers
+
+    def _find_edge_number(self, edge_id: uuid.UUID) -> int:
+        """ Scans the edge UUID table for edge_id, _NONE if missing """
+        needle = edge_id.bytes
+        position = self._edge_uuids.find(needle)
+        while position != -1 and position % _UUID_SIZE:
+            position = self._edge_uuids.find(needle, position + 1)
+        return _NONE if position == -1 else position // _UUID_SIZE
+
+    def _crawl_status(self, number: int) -> CrawlStatus:
+        """ The link's crawl status, None if it has none """
+        offset = number * _STATUS_FIELDS
+        row = self._link_status[offset:offset + _STATUS_FIELDS]
+        if row[0] == _NONE:
+            return None
+        return CrawlStatus(link_id=self._link_id(number),
+                           status_code=row[0],
+                           failures=row[1],
+                           fetches=row[2],
+                           changes=row[3],
+                           content_hash=row[4],
+                           interval=timedelta(microseconds=row[5]),
+                           checked_at=from_timestamp(row[6]),
+                           next_due_at=from_timestamp(row[7]))
+
+    def _link_id(self, number: int) -> uuid.UUID:
+        offset = number * _UUID_SIZE
+        return uuid.UUID(bytes=bytes(
+            self._link_uuids[offset:offset + _UUID_SIZE]))
+
+    def _link(self, number: int) -> Link:
+        return Link(link_id=self._link_id(number),
+                    url=self._link_urls[number],
+                    retrieved_at=from_timestamp(self._link_retrieved[number]))
+
+    def _edge(self, number: int) -> Edge:
+        offset = number * _UUID_SIZE
+        return Edge(edge_id=uuid.UUID(bytes=bytes(
+                        self._edge_uuids[offset:offset + _UUID_SIZE])),
+                    src=self._link_id(self._edge_src[number]),
+                    dst=self._link_id(self._edge_dst[number]),
+                    updated_at=from_timestamp(self._edge_updated[number]))
+
+
+def _uuid_key(link_id: uuid.UUID):
+    """ Interning key for link_id, None for non-UUID ids so lookups miss """
+    return link_id.int if isinstance(link_id, uuid.UUID) else None
+
+
+class _LinksView(Mapping):
+    """ Read-only link_id -> Link view over GraphInMemory """
+
+    def __init__(self, graph: GraphInMemory):
+        self._graph = graph
+
+    def __getitem__(self, link_id: uuid.UUID) -> Link:
+        return self._graph.find_link(link_id)
+
+    def __iter__(self) -> Iterator[uuid.UUID]:
+        return (uuid.UUID(int=key) for key in list(self._graph._link_index))
+
+    def __len__(self) -> int:
+        return len(self._graph._link_index)
+
+
+class _EdgesView(Mapping):
+    """ Read-only edge_id -> Edge view over GraphInMemory, lookups scan """
+
+    def __init__(self, graph: GraphInMemory):
+        self._graph = graph
+
+    def __getitem__(self, edge_id: uuid.UUID) -> Edge:
+        if not isinstance(edge_id, uuid.UUID) or edge_id.int == 0:
+            raise KeyError(edge_id)
+        number = self._graph._find_edge_number(edge_id)
+        if number == _NONE:
+            raise KeyError(edge_id)
+        return self._graph._edge(number)
+
+    def __iter__(self) -> Iterator[uuid.UUID]:
+        graph = self._graph
+        for src in range(len(graph._link_urls)):
+            for number in graph._out_edges(src):
+                yield graph._edge(number).edge_id
+
+    def __len__(self) -> int:
+        return len(self._graph._edge_src) - len(self._graph._edge_free)
+
+
+class _LinkEdgeView(Mapping):
+    """ Read-only link_id -> EdgeList view of outgoing edges """
+
+    def __init__(self, graph: GraphInMemory):
+        self._graph = graph
+
+    def __getitem__(self, link_id: uuid.UUID) -> EdgeList:
+        graph = self._graph
+        src = graph._link_index.get(_uuid_key(link_id))
+        if src is None:
+            raise KeyError(link_id)
+        return [graph._edge(number).edge_id
+                for number in graph._out_edges(src)]
+
+    def __iter__(self) -> Iterator[uuid.UUID]:
+        return iter(self._graph.links)
+
+    def __len__(self) -> int:
+        return len(self._graph._link_index)
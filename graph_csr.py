@@ -0,0 +1,119 @@
+"""Compressed sparse row graph snapshots."""
+
+import mmap
+import os
+import struct
+import uuid
+from array import array
+
+# magic, version, link count, edge count; sections follow in native byte
+# order: offsets int64[links + 1], targets int32[edges] padded to 8 bytes,
+# link ids as 16-byte big-endian UUIDs in ascending order
+_HEADER = struct.Struct('=8sQqq')
+_MAGIC = b'GRAPHCSR'
+_VERSION = 1
+_UUID_SIZE = 16
+
+
+def write_csr(path: str, link_ids: bytes, offsets: array, targets: array):
+    """ Writes a snapshot atomically, rows are ranks in link_ids order
+
+    Args:
+        link_ids: concatenated 16-byte UUIDs, ascending
+        offsets: array('q'), row r's targets are
+            targets[offsets[r]:offsets[r + 1]]
+        targets: array('i') of destination rows
+    """
+    link_count = len(link_ids) // _UUID_SIZE
+    if offsets.typecode != 'q' or targets.typecode != 'i' \
+            or len(offsets) != link_count + 1:
+        raise ValueError('expected array(q) offsets per link + 1, '
+                         'array(i) targets')
+    temporary = f'{path}.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(_HEADER.pack(_MAGIC, _VERSION, link_count, len(targets)))
+        offsets.tofile(file)
+        targets.tofile(file)
+        file.write(bytes(-len(targets) * targets.itemsize % 8))
+        file.write(link_ids)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+
+class CSRSnapshot:
+    """ Read-only, memory-mapped view of a snapshot written by write_csr
+
+    Sections are exposed as memoryviews over the mapping, so opening a
+    snapshot costs no parsing or copying, and numpy.frombuffer can wrap them
+    directly. Rows are link ranks in ascending UUID order, so a UUID range
+    partition of the graph is a contiguous range of rows.
+
+    Attributes:
+        path: snapshot file
+        link_count: number of rows
+        edge_count: number of targets
+        offsets: memoryview int64[link_count + 1]
+        targets: memoryview int32[edge_count]
+        link_ids: memoryview of link_count 16-byte UUIDs
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        magic, version, self.link_count, self.edge_count = \
+            _HEADER.unpack_from(view)
+        if magic != _MAGIC or version != _VERSION:
+            view.release()
+            self._mmap.close()
+            raise ValueError(f'{path} is not a v{_VERSION} CSR snapshot')
+        start = _HEADER.size
+        end = start + 8 * (self.link_count + 1)
+        self.offsets = view[start:end].cast('q')
+        start, end = end, end + 4 * self.edge_count
+        self.targets = view[start:end].cast('i')
+        start = end + (-end % 8)
+        self.link_ids = view[start:start + _UUID_SIZE * self.link_count]
+        self._view = view
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for view in (self.offsets, self.targets, self.link_ids, self._view):
+            view.release()
+        self._mmap.close()
+
+    def link_id(self, row: int) -> uuid.UUID:
+        offset = row * _UUID_SIZE
+        return uuid.UUID(bytes=bytes(
+            self.link_ids[offset:offset + _UUID_SIZE]))
+
+    def row(self, link_id: uuid.UUID) -> int:
+        """ Binary searches the sorted id table, raises KeyError if missing """
+        row = self.lower_bound(link_id)
+        if row == self.link_count or self.link_id(row) != link_id:
+            raise KeyError(f'row(link_id={link_id})')
+        return row
+
+    def lower_bound(self, link_id: uuid.UUID) -> int:
+        """ First row whose link_id is not less than link_id """
+        needle = link_id.bytes
+        lower, upper = 0, self.link_count
+        while lower < upper:
+            middle = (lower + upper) // 2
+            offset = middle * _UUID_SIZE
+            if bytes(self.link_ids[offset:offset + _UUID_SIZE]) < needle:
+                lower = middle + 1
+            else:
+                upper = middle
+        return lower
+
+    def out_rows(self, row: int) -> memoryview:
+        """ Destination rows of row's outgoing edges """
+        return self.targets[self.offsets[row]:self.offsets[row + 1]]
@@ -0,0 +1,64 @@
+"""CSRSnapshotTestCase"""
+
+import os
+import tempfile
+import unittest
+import uuid
+from datetime import datetime
+import graph
+import graph_csr
+
+
+class CSRSnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'graph.csr')
+        self.g = graph.GraphInMemory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_export_csr(self):
+        links = [self.g.upsert_link(graph.Link(url=str(i)))
+                 for i in range(20)]
+        for i, src in enumerate(links):
+            for dst in links[i + 1:i + 4]:
+                self.g.upsert_edge(
+                    graph.Edge(src=src.link_id, dst=dst.link_id))
+        self.g.remove_stale_edges(
+            from_id=links[0].link_id, deletion_treshold=datetime.max)
+        self.g.export_csr(self.path)
+
+        with graph_csr.CSRSnapshot(self.path) as snapshot:
+            self.assertEqual(snapshot.link_count, 20)
+            self.assertEqual(snapshot.edge_count, 3 * 17 + 2 + 1 - 3)
+            link_ids = [snapshot.link_id(row) for row in range(20)]
+            self.assertEqual(link_ids, sorted(self.g.links))
+
+            expected = {(edge.src, edge.dst) for edge in self.g.edges_iter(
+                uuid.UUID(int=0),
+                uuid.UUID('{FFFFFFFF-FFFF-FFFF-FFFF-FFFFFFFFFFFF}'),
+                datetime.max)}
+            exported = {(link_ids[row], link_ids[target])
+                        for row in range(20)
+                        for target in snapshot.out_rows(row)}
+            self.assertEqual(exported, expected)
+
+            for row, link_id in enumerate(link_ids):
+                self.assertEqual(snapshot.row(link_id), row)
+            self.assertRaises(KeyError, snapshot.row, uuid.uuid4())
+
+    def test_export_empty_graph(self):
+        self.g.export_csr(self.path)
+        with graph_csr.CSRSnapshot(self.path) as snapshot:
+            self.assertEqual(snapshot.link_count, 0)
+            self.assertEqual(list(snapshot.offsets), [0])
+
+    def test_rejects_foreign_files(self):
+        with open(self.path, 'wb') as file:
+            file.write(bytes(64))
+        self.assertRaises(ValueError, graph_csr.CSRSnapshot, self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,341 @@
+"""CQRS read replicas of a Graph fed by an in-process change log."""
+
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Iterator, Optional
+import graph
+
+# Change kinds, a change is a (kind, value) tuple; values are results as
+# stored by the write model, so replaying them is idempotent
+LINK, EDGE, REMOVE, STATUS = 1, 2, 3, 4
+
+_MIN_ID = uuid.UUID(int=0)
+_MAX_ID = uuid.UUID(int=(1 << 128) - 1)
+
+
+class ChangeLogTruncated(Exception):
+    """ Raised when a reader's offset fell out of the bounded log """
+
+
+class ReadOnlyReplicaError(Exception):
+    """ Raised when writing to a GraphReplica, write to the publisher """
+
+
+class ChangeLog:
+    """ Bounded, in-process, append-only log of graph changes
+
+    Appending never blocks on readers: once capacity changes are held the
+    oldest are overwritten, and readers that had not consumed them get
+    ChangeLogTruncated and must resynchronize. Changes are a ring buffer
+    list, the change at offset o in slot o % capacity, so a read copies
+    its batch out in O(limit) wherever it starts.
+
+    Attributes:
+        capacity: changes retained
+    """
+
+    def __init__(self, capacity: int = 1 << 20):
+        self.capacity = capacity
+        self._changes: list[tuple] = []
+        self._head = 0      # offset of the next change
+        self._condition = threading.Condition()
+
+    @property
+    def head(self) -> int:
+        """ Offset the next change will get """
+        with self._condition:
+            return self._head
+
+    def append(self, kind: int, value) -> int:
+        with self._condition:
+            if len(self._changes) < self.capacity:
+                self._changes.append((kind, value))
+            else:
+                self._changes[self._head % self.capacity] = (kind, value)
+            self._head += 1
+            self._condition.notify_all()
+            return self._head - 1
+
+    def extend(self, kind: int, values: list):
+        for value in values:
+            self.append(kind, value)
+
+    def read(self,
+             offset: int,
+             limit: int = 1024,
+             timeout: Optional[float] = None) -> list[tuple]:
+        """ Returns up to limit changes from offset, waiting for at least one
+
+        Returns an empty list on timeout, raises ChangeLogTruncated when
+        offset was already dropped.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._head > offset, timeout)
+            first = self._head - len(self._changes)
+            if offset < first:
+                raise ChangeLogTruncated(
+                    f'offset {offset} < first retained {first}')
+            start = offset % self.capacity
+            end = start + min(limit, self._head - offset)
+            if end <= self.capacity:
+                return self._changes[start:end]
+            return self._changes[start:] \
+                + self._changes[:end - self.capacity]
+
+
+class GraphPublisher(graph.Graph):
+    """ Write model: forwards to a Graph, publishes results to a ChangeLog
+
+    Reads go straight to the wrapped graph and are strongly consistent;
+    scans meant to stay off the write path should use a GraphReplica.
+
+    Attributes:
+        graph: the write model
+        log: ChangeLog the results are appended to
+    """
+
+    def __init__(self, g: graph.Graph, log: ChangeLog):
+        self.graph = g
+        self.log = log
+
+    def upsert_link(self, link: graph.Link) -> graph.Link:
+        link_stored = self.graph.upsert_link(link)
+        self.log.append(LINK, link_stored)
+        return link_stored
+
+    def upsert_links(self, links: list[graph.Link]) -> list[graph.Link]:
+        links_stored = self.graph.upsert_links(links)
+        self.log.extend(LINK, links_stored)
+        return links_stored
+
+    def find_link(self, link_id: uuid.UUID) -> graph.Link:
+        return self.graph.find_link(link_id)
+
+    def links_iter(self,
+                   from_id: uuid.UUID,
+                   to_id: uuid.UUID,
+                   retrieved_before: datetime) -> Iterator[graph.Link]:
+        return self.graph.links_iter(from_id, to_id, retrieved_before)
+
+    def upsert_edge(self, edge: graph.Edge) -> graph.Edge:
+        edge_stored = self.graph.upsert_edge(edge)
+        self.log.append(EDGE, edge_stored)
+        return edge_stored
+
+    def edges_iter(self,
+                   from_id: uuid.UUID,
+                   to_id: uuid.UUID,
+                   updated_before: datetime) -> Iterator[graph.Edge]:
+        return self.graph.edges_iter(from_id, to_id, updated_before)
+
+    def remove_stale_edges(self,
+                           from_id: uuid.UUID,
+                           deletion_treshold: datetime):
+        self.graph.remove_stale_edges(from_id, deletion_treshold)
+        self.log.append(REMOVE, (from_id, deletion_treshold))
+
+    def find_crawl_status(self, link_id: uuid.UUID) -> graph.CrawlStatus:
+        return self.graph.find_crawl_status(link_id)
+
+    def crawl_statuses_iter(self,
+                            from_id: uuid.UUID,
+                            to_id: uuid.UUID) -> Iterator[graph.CrawlStatus]:
+        return self.graph.crawl_statuses_iter(from_id, to_id)
+
+    def upsert_crawl_status(self,
+                            status: graph.CrawlStatus) -> graph.CrawlStatus:
+        status_stored = self.graph.upsert_crawl_status(status)
+        self.log.append(STATUS, status_stored)
+        return status_stored
+
+
+class GraphReplica(graph.Graph):
+    """ Read model: an eventually consistent copy of a published graph
+
+    A background thread reads the ChangeLog in batches and applies them to
+    a private GraphInMemory with restore_link / restore_edge, which is
+    the only writer to it. Scans, find_link and export_csr served here
+    therefore never contend with the write model's locks, and PageRank
+    can export its CSR snapshot from a replica. On start, and whenever it
+    falls out of the log, the replica subscribes at the log head and
+    copies the source graph with a full scan; changes made meanwhile are
+    in the log and replay idempotently.
+
+    Concurrent writers may publish an edge or crawl status before the link
+    it refers to, or an edge upsert after a removal that superseded it.
+    Changes to a missing link are deferred until the link arrives, edges older
+    than their source's latest removal threshold are skipped, so the
+    replica converges to the write model. Racing writers publish within a
+    batch of each other, so a removal threshold is forgotten once
+    batch_size more changes were applied.
+
+    Attributes:
+        source: the published graph, scanned to resynchronize
+        log: ChangeLog to consume
+        offset: log offset of the next change to apply
+        batch_size: changes applied per read of the log
+    """
+
+    def __init__(self,
+                 source: graph.Graph,
+                 log: ChangeLog,
+                 batch_size: int = 1024,
+                 lock_stripes: int = 16):
+        self.source = source
+        self.log = log
+        self.batch_size = batch_size
+        self.offset = 0
+        self._lock_stripes = lock_stripes
+        self._graph = graph.GraphInMemory(lock_stripes=lock_stripes)
+        self._deferred: dict[uuid.UUID, list[tuple]] = {}
+        # from_id -> (removal threshold, offset of its batch), by offset
+        self._removed: OrderedDict[uuid.UUID, tuple] = OrderedDict()
+        self._applied = threading.Condition()
+        self._closed = threading.Event()
+        self._resynchronize()
+        self._consumer = threading.Thread(target=self._consume, daemon=True)
+        self._consumer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._closed.set()
+        self._consumer.join()
+
+    def wait_for(self, offset: int, timeout: Optional[float] = None) -> bool:
+        """ Waits until changes before offset are applied, for example
+            log.head after a write, to read one's own writes
+        """
+        with self._applied:
+            return self._applied.wait_for(
+                lambda: self.offset >= offset, timeout)
+
+    def export_csr(self, path: str):
+        self._graph.export_csr(path)
+
+    def find_link(self, link_id: uuid.UUID) -> graph.Link:
+        return self._graph.find_link(link_id)
+
+    def links_iter(self,
+                   from_id: uuid.UUID,
+                   to_id: uuid.UUID,
+                   retrieved_before: datetime) -> Iterator[graph.Link]:
+        return self._graph.links_iter(from_id, to_id, retrieved_before)
+
+    def edges_iter(self,
+                   from_id: uuid.UUID,
+                   to_id: uuid.UUID,
+                   updated_before: datetime) -> Iterator[graph.Edge]:
+        return self._graph.edges_iter(from_id, to_id, updated_before)
+
+    def find_crawl_status(self, link_id: uuid.UUID) -> graph.CrawlStatus:
+        return self._graph.find_crawl_status(link_id)
+
+    def crawl_statuses_iter(self,
+                            from_id: uuid.UUID,
+                            to_id: uuid.UUID) -> Iterator[graph.CrawlStatus]:
+        return self._graph.crawl_statuses_iter(from_id, to_id)
+
+    def upsert_link(self, link: graph.Link) -> graph.Link:
+        raise ReadOnlyReplicaError('write to the publisher')
+
+    def upsert_edge(self, edge: graph.Edge) -> graph.Edge:
+        raise ReadOnlyReplicaError('write to the publisher')
+
+    def remove_stale_edges(self,
+                           from_id: uuid.UUID,
+                           deletion_treshold: datetime):
+        raise ReadOnlyReplicaError('write to the publisher')
+
+    def upsert_crawl_status(self,
+                            status: graph.CrawlStatus) -> graph.CrawlStatus:
+        raise ReadOnlyReplicaError('write to the publisher')
+
+    def _consume(self):
+        while not self._closed.is_set():
+            try:
+                changes = self.log.read(self.offset, self.batch_size, 0.1)
+            except ChangeLogTruncated:
+                self._resynchronize()
+                continue
+            for kind, value in changes:
+                self._apply(kind, value)
+            with self._applied:
+                self.offset += len(changes)
+                self._prune_removed()
+                self._applied.notify_all()
+
+    def _resynchronize(self):
+        """ Subscribes at the head, then copies the source into a new graph
+
+        Readers keep using the old graph until the copy is complete.
+        """
+        offset = self.log.head
+        copy = graph.GraphInMemory(lock_stripes=self._lock_stripes)
+        for link in self.source.links_iter(_MIN_ID, _MAX_ID, datetime.max):
+            copy.restore_link(link)
+        for status in self.source.crawl_statuses_iter(_MIN_ID, _MAX_ID):
+            try:
+                copy.upsert_crawl_status(status)
+            except KeyError:
+                pass    # link added after the scan, both are in the log
+        for edge in self.source.edges_iter(_MIN_ID, _MAX_ID, datetime.max):
+            copy.restore_edge(edge)
+        self._deferred.clear()
+        self._removed.clear()
+        with self._applied:
+            self._graph = copy
+            self.offset = offset
+            self._applied.notify_all()
+
+    def _apply(self, kind: int, value):
+        if kind == LINK:
+            self._graph.restore_link(value)
+            for change in self._deferred.pop(value.link_id, ()):
+                self._apply(*change)
+        elif kind == EDGE:
+            self._restore_edge(value)
+        elif kind == REMOVE:
+            from_id, deletion_treshold = value
+            if deletion_treshold > self._removal(from_id):
+                self._removed[from_id] = deletion_treshold, self.offset
+                self._removed.move_to_end(from_id)
+            self._graph.remove_stale_edges(from_id, deletion_treshold)
+        elif kind == STATUS:
+            try:
+                self._graph.upsert_crawl_status(value)
+            except KeyError:
+                self._defer(value.link_id, kind, value)
+
+    def _restore_edge(self, edge: graph.Edge):
+        if edge.updated_at < self._removal(edge.src):
+            return
+        try:
+            self._graph.restore_edge(edge)
+        except KeyError:
+            for link_id in (edge.src, edge.dst):
+                try:
+                    self._graph.find_link(link_id)
+                except KeyError:
+                    self._defer(link_id, EDGE, edge)
+                    break
+
+    def _removal(self, from_id: uuid.UUID) -> datetime:
+        removed = self._removed.get(from_id)
+        return datetime.min if removed is None else removed[0]
+
+    def _prune_removed(self):
+        while self._removed:
+            _, offset = next(iter(self._removed.values()))
+            if offset >= self.offset - self.batch_size:
+                return
+            self._removed.popitem(last=False)
+
+    def _defer(self, link_id: uuid.UUID, kind: int, value):
+        self._deferred.setdefault(link_id, []).append((kind, value))
@@ -0,0 +1,146 @@
+"""GraphReplicaTestCase"""
+
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+import uuid
+from datetime import datetime
+import graph
+import graph_csr
+import graph_replica
+
+MIN_ID = uuid.UUID(int=0)
+MAX_ID = uuid.UUID('{FFFFFFFF-FFFF-FFFF-FFFF-FFFFFFFFFFFF}')
+
+
+class ChangeLogTestCase(unittest.TestCase):
+    def test_read_and_truncation(self):
+        log = graph_replica.ChangeLog(capacity=3)
+        for number in range(5):
+            self.assertEqual(log.append(graph_replica.LINK, number), number)
+        self.assertEqual(log.head, 5)
+        self.assertEqual(log.read(3), [(graph_replica.LINK, 3),
+                                       (graph_replica.LINK, 4)])
+        self.assertEqual(log.read(5, timeout=0.01), [])
+        self.assertRaises(graph_replica.ChangeLogTruncated, log.read, 1)
+        self.assertEqual(log.read(2, limit=2), [(graph_replica.LINK, 2),
+                                                (graph_replica.LINK, 3)])
+        self.assertEqual(log.read(4, limit=1), [(graph_replica.LINK, 4)])
+
+
+class GraphReplicaTestCase(unittest.TestCase):
+    def setUp(self):
+        self.log = graph_replica.ChangeLog()
+        self.source = graph.GraphInMemory(lock_stripes=4)
+        self.g = graph_replica.GraphPublisher(self.source, self.log)
+
+    def test_replica_bootstraps_and_follows(self):
+        links = self._populate(0, 10)
+        replica = graph_replica.GraphReplica(self.source, self.log)
+        self.addCleanup(replica.close)
+        self._populate(10, 20)
+        self.g.remove_stale_edges(links[0].link_id, datetime.max)
+        self.g.upsert_crawl_status(graph.CrawlStatus(
+            link_id=links[1].link_id, status_code=200,
+            checked_at=datetime.utcnow()))
+        self.assertTrue(replica.wait_for(self.log.head, timeout=5))
+        self._assert_replicates(replica)
+        self.assertEqual(replica.find_crawl_status(links[1].link_id),
+                         self.source.find_crawl_status(links[1].link_id))
+        self.assertRaises(graph_replica.ReadOnlyReplicaError,
+                          replica.upsert_link,
+                          graph.Link(url='read only'))
+
+    def test_replica_resynchronizes_after_truncation(self):
+        self.log = graph_replica.ChangeLog(capacity=4)
+        self.g.log = self.log
+        replica = graph_replica.GraphReplica(self.source, self.log)
+        self.addCleanup(replica.close)
+        replica._closed.set()
+        replica._consumer.join()
+        links = self._populate(0, 10)
+        status = self.g.upsert_crawl_status(graph.CrawlStatus(
+            link_id=links[1].link_id, status_code=200,
+            checked_at=datetime.utcnow()))
+        # Statuses are copied in bulk, not looked up link by link
+        self.source.find_crawl_status = mock.Mock(side_effect=AssertionError)
+        replica._closed.clear()
+        replica._consumer = threading.Thread(target=replica._consume)
+        replica._consumer.start()
+        self.assertTrue(replica.wait_for(self.log.head, timeout=5))
+        self._assert_replicates(replica)
+        self.assertEqual(replica.find_crawl_status(links[1].link_id), status)
+
+    def test_reordered_changes_converge(self):
+        replica = graph_replica.GraphReplica(self.source, self.log)
+        self.addCleanup(replica.close)
+        src = graph.Link(link_id=uuid.uuid4(), url='src')
+        dst = graph.Link(link_id=uuid.uuid4(), url='dst')
+        edge = graph.Edge(edge_id=uuid.uuid4(), src=src.link_id,
+                          dst=dst.link_id, updated_at=datetime.utcnow())
+        status = graph.CrawlStatus(link_id=dst.link_id, status_code=200)
+        self.log.append(graph_replica.EDGE, edge)
+        self.log.append(graph_replica.STATUS, status)
+        self.log.append(graph_replica.LINK, src)
+        self.log.append(graph_replica.LINK, dst)
+        self.assertTrue(replica.wait_for(self.log.head, timeout=5))
+        self.assertEqual(list(replica.edges_iter(MIN_ID, MAX_ID,
+                                                 datetime.max)), [edge])
+        self.assertEqual(replica.find_crawl_status(dst.link_id), status)
+
+        self.log.append(graph_replica.REMOVE, (src.link_id, datetime.max))
+        self.log.append(graph_replica.EDGE, edge)
+        self.assertTrue(replica.wait_for(self.log.head, timeout=5))
+        self.assertEqual(list(replica.edges_iter(MIN_ID, MAX_ID,
+                                                 datetime.max)), [])
+
+        replica.batch_size = 2
+        for number in range(6):
+            self.log.append(graph_replica.LINK,
+                            graph.Link(link_id=uuid.uuid4(), url=str(number)))
+            self.assertTrue(replica.wait_for(self.log.head, timeout=5))
+        self.assertEqual(replica._removed, {})
+
+    def test_concurrent_writers(self):
+        replica = graph_replica.GraphReplica(self.source, self.log)
+        self.addCleanup(replica.close)
+        threads = [threading.Thread(target=self._populate,
+                                    args=(index * 50, index * 50 + 50))
+                   for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(replica.wait_for(self.log.head, timeout=5))
+        self._assert_replicates(replica)
+
+    def test_export_csr(self):
+        self._populate(0, 10)
+        replica = graph_replica.GraphReplica(self.source, self.log)
+        self.addCleanup(replica.close)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'graph.csr')
+            replica.export_csr(path)
+            with graph_csr.CSRSnapshot(path) as snapshot:
+                self.assertEqual((snapshot.link_count, snapshot.edge_count),
+                                 (10, 9))
+
+    def _populate(self, start: int, stop: int) -> list[graph.Link]:
+        links = [self.g.upsert_link(graph.Link(url=str(number)))
+                 for number in range(start, stop)]
+        for src, dst in zip(links, links[1:]):
+            self.g.upsert_edge(graph.Edge(src=src.link_id, dst=dst.link_id))
+        return links
+
+    def _assert_replicates(self, replica: graph_replica.GraphReplica):
+        for name in ('links_iter', 'edges_iter'):
+            self.assertEqual(
+                list(getattr(replica, name)(MIN_ID, MAX_ID, datetime.max)),
+                list(getattr(self.source, name)(MIN_ID, MAX_ID,
+                                                datetime.max)))
+
+
+if __name__ == '__main__':
+    unittest.main()
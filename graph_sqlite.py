@@ -0,0 +1,338 @@
+"""Graph on sqlite3."""
+
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Iterator
+import graph
+
+_MICROSECOND = timedelta(microseconds=1)
+_LINK_ID_ATTEMPTS = 8
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS links (
+    link_id BLOB PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE,
+    retrieved_at INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS edges (
+    src BLOB NOT NULL REFERENCES links(link_id),
+    dst BLOB NOT NULL REFERENCES links(link_id),
+    edge_id BLOB NOT NULL UNIQUE,
+    updated_at INTEGER NOT NULL,
+    PRIMARY KEY (src, dst)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS crawl_status (
+    link_id BLOB PRIMARY KEY REFERENCES links(link_id),
+    status_code INTEGER NOT NULL,
+    failures INTEGER NOT NULL,
+    fetches INTEGER NOT NULL,
+    changes INTEGER NOT NULL,
+    content_hash INTEGER NOT NULL,
+    interval INTEGER NOT NULL,
+    checked_at INTEGER NOT NULL,
+    next_due_at INTEGER NOT NULL
+) WITHOUT ROWID;
+'''
+
+# Statements are module constants so the connection's statement cache keeps
+# each one prepared for the lifetime of the connection
+_UPSERT_LINK = '''
+INSERT INTO links (link_id, url, retrieved_at) VALUES (?, ?, ?)
+ON CONFLICT (url) DO UPDATE
+SET retrieved_at = max(retrieved_at, excluded.retrieved_at)
+RETURNING link_id, url, retrieved_at'''
+_FIND_LINK = '''
+SELECT link_id, url, retrieved_at FROM links WHERE link_id = ?'''
+_LINKS_RANGE = '''
+SELECT link_id, url, retrieved_at FROM links
+WHERE link_id >= ? AND link_id < ? AND retrieved_at < ?
+ORDER BY link_id'''
+_UPSERT_EDGE = '''
+INSERT INTO edges (src, dst, edge_id, updated_at) VALUES (?, ?, ?, ?)
+ON CONFLICT (src, dst) DO UPDATE SET updated_at = excluded.updated_at
+RETURNING edge_id, src, dst, updated_at'''
+_EDGES_RANGE = '''
+SELECT edge_id, src, dst, updated_at FROM edges
+WHERE src >= ? AND src < ? AND updated_at < ?
+ORDER BY src, dst'''
+_REMOVE_STALE_EDGES = '''
+DELETE FROM edges WHERE src = ? AND updated_at < ?'''
+_CRAWL_STATUS_COLUMNS = '''link_id, status_code, failures, fetches, changes,
+content_hash, interval, checked_at, next_due_at'''
+_UPSERT_CRAWL_STATUS = f'''
+INSERT INTO crawl_status ({_CRAWL_STATUS_COLUMNS})
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (link_id) DO UPDATE
+SET status_code = excluded.status_code, failures = excluded.failures,
+    fetches = excluded.fetches, changes = excluded.changes,
+    content_hash = excluded.content_hash, interval = excluded.interval,
+    checked_at = excluded.checked_at, next_due_at = excluded.next_due_at
+WHERE excluded.checked_at >= crawl_status.checked_at'''
+_FIND_CRAWL_STATUS = f'''
+SELECT {_CRAWL_STATUS_COLUMNS} FROM crawl_status WHERE link_id = ?'''
+_CRAWL_STATUS_RANGE = f'''
+SELECT {_CRAWL_STATUS_COLUMNS} FROM crawl_status
+WHERE link_id >= ? AND link_id < ?
+ORDER BY link_id'''
+
+
+class GraphSQLite(graph.Graph):
+    """ Implements graph interface on a sqlite3 database file
+
+    Writes go through one connection and are grouped into transactions of
+    up to batch_size statements, committed when the batch fills, when an
+    iterator is opened, or on commit() / close(). The database runs in WAL
+    mode, so every iterator streams from its own connection and reads a
+    consistent snapshot without blocking the writer.
+
+    Attributes:
+        path: database file, created if missing
+        batch_size: writes per implicit transaction
+    """
+
+    def __init__(self, path: str, batch_size: int = 1000):
+        self.path = path
+        self.batch_size = batch_size
+        self._pending = 0
+        self._lock = threading.RLock()
+        self._connection = self._connect()
+        self._connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self.commit()
+            self._connection.close()
+
+    def commit(self):
+        """ Commits the pending write transaction, if any """
+        with self._lock:
+            if self._connection.in_transaction:
+                self._connection.execute('COMMIT')
+            self._pending = 0
+
+    @contextmanager
+    def batch(self):
+        """ Groups all writes in the with block into one transaction """
+        with self._lock:
+            if self._pending < 0:   # nested, the outer batch commits
+                yield self
+                return
+            self.commit()
+            self._begin()
+            self._pending = -1
+            try:
+                yield self
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                self._pending = 0
+                raise
+            self.commit()
+
+    def find_link(self, link_id: uuid.UUID) -> graph.Link:
+        """ Returns link else raises KeyError """
+        with self._lock:
+            row = self._connection.execute(
+                _FIND_LINK, (_uuid_bytes(link_id),)).fetchone()
+        if row is None:
+            raise KeyError(f'find_link(link_id={link_id})')
+        return _link(row)
+
+    def upsert_link(self, link: graph.Link) -> graph.Link:
+        """
+        If link with same URL already exists, execute update
+        else assign new id and insert link
+        """
+        with self._lock:
+            self._begin()
+            row = self._upsert_link(link)
+            self._written(1)
+        return _link(row)
+
+    def upsert_links(self, links: list[graph.Link]) -> list[graph.Link]:
+        """ Upserts links in one transaction """
+        with self.batch():
+            rows = [self._upsert_link(link) for link in links]
+        return [_link(row) for row in rows]
+
+    def links_iter(self,
+                   from_id: uuid.UUID,
+                   to_id: uuid.UUID,
+                   retrieved_before: datetime) -> Iterator[graph.Link]:
+        self._flush()
+        return (_link(row) for row in self._stream(
+            _LINKS_RANGE,
+            (from_id.bytes, to_id.bytes,
+             graph.to_timestamp(retrieved_before))))
+
+    def upsert_edge(self, edge: graph.Edge) -> graph.Edge:
+        """ Updates updated_at of the existing src -> dst edge or inserts it,
+            raises KeyError if src or dst is not a stored link
+        """
+        parameters = (_uuid_bytes(edge.src), _uuid_bytes(edge.dst),
+                      uuid.uuid4().bytes,
+                      graph.to_timestamp(datetime.utcnow()))
+        with self._lock:
+            self._begin()
+            try:
+                row = self._connection.execute(
+                    _UPSERT_EDGE, parameters).fetchone()
+            except sqlite3.IntegrityError as error:
+                raise KeyError('Edge src or dst not in stored links') \
+                    from error
+            self._written(1)
+        return _edge(row)
+
+    def edges_iter(self,
+                   from_id: uuid.UUID,
+                   to_id: uuid.UUID,
+                   updated_before: datetime) -> Iterator[graph.Edge]:
+        self._flush()
+        return (_edge(row) for row in self._stream(
+            _EDGES_RANGE,
+            (from_id.bytes, to_id.bytes,
+             graph.to_timestamp(updated_before))))
+
+    def remove_stale_edges(self,
+                           from_id: uuid.UUID,
+                           deletion_treshold: datetime):
+        with self._lock:
+            self._begin()
+            self._connection.execute(
+                _REMOVE_STALE_EDGES,
+                (_uuid_bytes(from_id), graph.to_timestamp(deletion_treshold)))
+            self._written(1)
+
+    def find_crawl_status(self, link_id: uuid.UUID) -> graph.CrawlStatus:
+        """ Returns the link's crawl status else raises KeyError """
+        with self._lock:
+            row = self._connection.execute(
+                _FIND_CRAWL_STATUS, (_uuid_bytes(link_id),)).fetchone()
+        if row is None:
+            raise KeyError(f'find_crawl_status(link_id={link_id})')
+        return _crawl_status(row)
+
+    def crawl_statuses_iter(self,
+                            from_id: uuid.UUID,
+                            to_id: uuid.UUID) -> Iterator[graph.CrawlStatus]:
+        self._flush()
+        return (_crawl_status(row) for row in self._stream(
+            _CRAWL_STATUS_RANGE, (from_id.bytes, to_id.bytes)))
+
+    def upsert_crawl_status(self,
+                            status: graph.CrawlStatus) -> graph.CrawlStatus:
+        parameters = (_uuid_bytes(status.link_id),
+                      status.status_code,
+                      status.failures,
+                      status.fetches,
+                      status.changes,
+                      status.content_hash,
+                      status.interval // _MICROSECOND,
+                      graph.to_timestamp(status.checked_at),
+                      graph.to_timestamp(status.next_due_at))
+        with self._lock:
+            self._begin()
+            try:
+                self._connection.execute(_UPSERT_CRAWL_STATUS, parameters)
+            except sqlite3.IntegrityError as error:
+                raise KeyError('Crawl status link not in stored links') \
+                    from error
+            self._written(1)
+            return self.find_crawl_status(status.link_id)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path,
+                                     isolation_level=None,
+                                     check_same_thread=False,
+                                     cached_statements=64)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute('PRAGMA foreign_keys=ON')
+        return connection
+
+    def _begin(self):
+        if not self._connection.in_transaction:
+            self._connection.execute('BEGIN')
+
+    def _flush(self):
+        """ Commits implicit batches so reader connections see them """
+        with self._lock:
+            if self._pending >= 0:
+                self.commit()
+
+    def _written(self, count: int):
+        """ Commits once batch_size writes are pending outside batch() """
+        if self._pending < 0:
+            return
+        self._pending += count
+        if self._pending >= self.batch_size:
+            self.commit()
+
+    def _upsert_link(self, link: graph.Link) -> tuple:
+        """ Draws another uuid on a link_id collision, at most
+            _LINK_ID_ATTEMPTS times; other constraint failures propagate
+        """
+        retrieved_at = graph.to_timestamp(link.retrieved_at)
+        for attempt in range(_LINK_ID_ATTEMPTS):
+            try:
+                return self._connection.execute(
+                    _UPSERT_LINK,
+                    (uuid.uuid4().bytes, link.url, retrieved_at)).fetchone()
+            except sqlite3.IntegrityError as error:
+                if error.sqlite_errorcode \
+                        != sqlite3.SQLITE_CONSTRAINT_PRIMARYKEY \
+                        or attempt == _LINK_ID_ATTEMPTS - 1:
+                    raise
+
+    def _stream(self, statement: str, parameters: tuple) -> Iterator[tuple]:
+        """ Yields rows from a fresh reader connection, fetchmany at a time """
+        connection = self._connect()
+        try:
+            cursor = connection.execute(statement, parameters)
+            rows = cursor.fetchmany(self.batch_size)
+            while rows:
+                yield from rows
+                rows = cursor.fetchmany(self.batch_size)
+        finally:
+            connection.close()
+
+
+def _uuid_bytes(link_id: uuid.UUID) -> bytes:
+    return link_id.bytes if isinstance(link_id, uuid.UUID) else b''
+
+
+def _link(row: tuple) -> graph.Link:
+    link_id, url, retrieved_at = row
+    return graph.Link(link_id=uuid.UUID(bytes=link_id),
+                      url=url,
+                      retrieved_at=graph.from_timestamp(retrieved_at))
+
+
+def _edge(row: tuple) -> graph.Edge:
+    edge_id, src, dst, updated_at = row
+    return graph.Edge(edge_id=uuid.UUID(bytes=edge_id),
+                      src=uuid.UUID(bytes=src),
+                      dst=uuid.UUID(bytes=dst),
+                      updated_at=graph.from_timestamp(updated_at))
+
+
+def _crawl_status(row: tuple) -> graph.CrawlStatus:
+    link_id, status_code, failures, fetches, changes, content_hash, \
+        interval, checked_at, next_due_at = row
+    return graph.CrawlStatus(link_id=uuid.UUID(bytes=link_id),
+                             status_code=status_code,
+                             failures=failures,
+                             fetches=fetches,
+                             changes=changes,
+                             content_hash=content_hash,
+                             interval=timedelta(microseconds=interval),
+                             checked_at=graph.from_timestamp(checked_at),
+                             next_due_at=graph.from_timestamp(next_due_at))
@@ -0,0 +1,149 @@
+"""GraphSQLiteTestCase"""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+import uuid
+from unittest import mock
+from datetime import datetime, timedelta
+import graph
+import graph_sqlite
+
+
+class GraphSQLiteTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'graph.db')
+        self.g = graph_sqlite.GraphSQLite(self.path, batch_size=10)
+
+    def tearDown(self):
+        self.g.close()
+        self.directory.cleanup()
+
+    def test_upsert_link(self):
+        link_inserted = self.g.upsert_link(graph.Link(
+            url='https://example.com',
+            retrieved_at=datetime.utcnow() - timedelta(seconds=1)))
+        self.assertNotEqual(link_inserted.link_id, uuid.UUID(int=0))
+
+        # Same url keeps the id and the latest retrieved_at
+        accessed_at = datetime.utcnow()
+        link_updated = self.g.upsert_link(graph.Link(
+            url='https://example.com', retrieved_at=accessed_at))
+        self.assertEqual(link_updated.link_id, link_inserted.link_id)
+        self.assertEqual(link_updated.retrieved_at, accessed_at)
+
+        link_older = self.g.upsert_link(graph.Link(
+            url='https://example.com', retrieved_at=datetime.min))
+        self.assertEqual(link_older.retrieved_at, accessed_at)
+
+    def test_find_link(self):
+        link_inserted = self.g.upsert_link(graph.Link(url='foo'))
+        self.assertEqual(self.g.find_link(link_inserted.link_id),
+                         link_inserted)
+        self.assertRaises(KeyError, self.g.find_link, uuid.uuid4())
+
+    def test_upsert_edge(self):
+        src = self.g.upsert_link(graph.Link(url='src'))
+        dst = self.g.upsert_link(graph.Link(url='dst'))
+        edge_inserted = self.g.upsert_edge(
+            graph.Edge(src=src.link_id, dst=dst.link_id))
+        edge_updated = self.g.upsert_edge(
+            graph.Edge(src=src.link_id, dst=dst.link_id))
+        self.assertEqual(edge_updated.edge_id, edge_inserted.edge_id)
+        self.assertGreaterEqual(edge_updated.updated_at,
+                                edge_inserted.updated_at)
+        self.assertRaises(KeyError, self.g.upsert_edge,
+                          graph.Edge(src=src.link_id, dst=uuid.uuid4()))
+
+    def test_links_iter(self):
+        links = self.g.upsert_links(
+            [graph.Link(url=str(i)) for i in range(100)])
+        ids = sorted(link.link_id for link in links)
+        linksiter = self.g.links_iter(
+            from_id=ids[10], to_id=ids[90], retrieved_before=datetime.max)
+        self.assertEqual([link.link_id for link in linksiter], ids[10:90])
+
+    def test_edges_iter(self):
+        src_ids = []
+        for i in range(20):
+            src = self.g.upsert_link(graph.Link(url=str(-i - 1)))
+            dst = self.g.upsert_link(graph.Link(url=str(i)))
+            self.g.upsert_edge(graph.Edge(src=src.link_id, dst=dst.link_id))
+            src_ids.append(src.link_id)
+        src_ids.sort()
+        edgesiter = self.g.edges_iter(
+            from_id=src_ids[5], to_id=src_ids[15],
+            updated_before=datetime.max)
+        self.assertEqual([edge.src for edge in edgesiter], src_ids[5:15])
+
+    def test_remove_stale_edges(self):
+        src = self.g.upsert_link(graph.Link(url='src'))
+        for i in range(3):
+            dst = self.g.upsert_link(graph.Link(url=str(i)))
+            self.g.upsert_edge(graph.Edge(src=src.link_id, dst=dst.link_id))
+        self.g.remove_stale_edges(
+            from_id=src.link_id, deletion_treshold=datetime.max)
+        edgesiter = self.g.edges_iter(
+            from_id=uuid.UUID(int=0),
+            to_id=uuid.UUID('{FFFFFFFF-FFFF-FFFF-FFFF-FFFFFFFFFFFF}'),
+            updated_before=datetime.max)
+        self.assertEqual(list(edgesiter), [])
+
+    def test_upsert_link_retries_only_link_id_collisions(self):
+        taken = self.g.upsert_link(graph.Link(url='taken')).link_id
+        fresh = uuid.uuid4()
+        with mock.patch('uuid.uuid4', side_effect=[taken, taken, fresh]):
+            self.assertEqual(
+                self.g.upsert_link(graph.Link(url='new')).link_id, fresh)
+        with mock.patch('uuid.uuid4', return_value=taken):
+            self.assertRaises(sqlite3.IntegrityError, self.g.upsert_link,
+                              graph.Link(url='newer'))
+        self.assertRaises(sqlite3.IntegrityError, self.g.upsert_link,
+                          graph.Link(url=None))
+
+    def test_batch_rolls_back_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with self.g.batch():
+                self.g.upsert_link(graph.Link(url='rolled back'))
+                raise RuntimeError()
+        self.assertEqual(self._count_links(), 0)
+
+    def test_crawl_status(self):
+        link = self.g.upsert_link(graph.Link(url='https://example.com'))
+        self.assertRaises(KeyError, self.g.find_crawl_status, link.link_id)
+        checked_at = datetime.utcnow()
+        status = graph.CrawlStatus(link_id=link.link_id,
+                                   status_code=404,
+                                   failures=2,
+                                   content_hash=-42,
+                                   interval=timedelta(days=1),
+                                   checked_at=checked_at,
+                                   next_due_at=checked_at + timedelta(hours=2))
+        self.assertEqual(self.g.upsert_crawl_status(status), status)
+        stale = graph.CrawlStatus(link_id=link.link_id, status_code=200,
+                                  checked_at=checked_at - timedelta(1))
+        self.assertEqual(self.g.upsert_crawl_status(stale), status)
+        self.assertRaises(KeyError, self.g.upsert_crawl_status,
+                          graph.CrawlStatus(link_id=uuid.uuid4()))
+        self.g.upsert_link(graph.Link(url='without status'))
+        self.assertEqual(list(self.g.crawl_statuses_iter(
+            uuid.UUID(int=0), uuid.UUID(int=(1 << 128) - 1))), [status])
+
+    def test_survives_reopen(self):
+        link_inserted = self.g.upsert_link(graph.Link(url='persisted'))
+        self.g.close()
+        self.g = graph_sqlite.GraphSQLite(self.path)
+        self.assertEqual(self.g.find_link(link_inserted.link_id),
+                         link_inserted)
+
+    def _count_links(self) -> int:
+        return len(list(self.g.links_iter(
+            from_id=uuid.UUID(int=0),
+            to_id=uuid.UUID('{FFFFFFFF-FFFF-FFFF-FFFF-FFFFFFFFFFFF}'),
+            retrieved_before=datetime.max)))
+
+
+if __name__ == '__main__':
+    unittest.main()
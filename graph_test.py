@@ -1,7 +1,9 @@
 """GraphTestCase"""
 
 import unittest
+from array import array
 import graph
+import threading
 import uuid
 from datetime import datetime, timedelta
 
@@ -162,9 +164,159 @@ class GraphTestCase(unittest.TestCase):
             from_id=from_id, deletion_treshold=datetime.utcnow())
         self.assertNotEqual(edge_ids_before, self.g.link_edge_map[from_id])
 
+    def test_upsert_edge_after_removal(self):
+        src = self.g.upsert_link(link=graph.Link(url='src'))
+        dst = self.g.upsert_link(link=graph.Link(url='dst'))
+        edge = graph.Edge(src=src.link_id, dst=dst.link_id)
+        edge_inserted = self.g.upsert_edge(edge)
+        self.assertEqual(self.g.upsert_edge(edge).edge_id,
+                         edge_inserted.edge_id)
+
+        self.g.remove_stale_edges(
+            from_id=src.link_id, deletion_treshold=datetime.max)
+        edge_reinserted = self.g.upsert_edge(edge)
+        self.assertNotEqual(edge_reinserted.edge_id, edge_inserted.edge_id)
+        self.assertEqual(self.g.link_edge_map[src.link_id],
+                         [edge_reinserted.edge_id])
+
+    def test_links_iter_range_is_ordered(self):
+        for i in range(200):
+            self.g.upsert_link(graph.Link(url=str(i)))
+        ids = sorted(self.g.links)
+        from_id, to_id = ids[50], ids[150]
+        linksiter = self.g.links_iter(
+            from_id=from_id, to_id=to_id, retrieved_before=datetime.max)
+        self.assertEqual([link.link_id for link in linksiter], ids[50:150])
+
+    def test_links_iter_skips_links_inserted_during_iteration(self):
+        graph._SortedKeys.chunk_size = 4
+        self.addCleanup(setattr, graph._SortedKeys, 'chunk_size', 1024)
+        before = {self.g.upsert_link(graph.Link(url=str(i))).link_id
+                  for i in range(20)}
+        seen = set()
+        for number, link in enumerate(self.g.links_iter(
+                uuid.UUID(int=0), uuid.UUID(int=(1 << 128) - 1),
+                datetime.max)):
+            seen.add(link.link_id)
+            self.g.upsert_link(graph.Link(url=f'new {number}'))
+        self.assertEqual(seen, before)
+        self.assertEqual(len(self.g.links), 40)
+
+    def test_sorted_keys_irange(self):
+        keys = graph._SortedKeys()
+        keys.chunk_size = 4
+        values = [(i * 7919) % 1000 for i in range(1000)]
+        for value in values:
+            keys.add(value)
+        self.assertEqual(len(keys), 1000)
+        self.assertEqual(list(keys.irange(0, 1000)), sorted(values))
+        self.assertEqual(list(keys.irange(123, 456)), list(range(123, 456)))
+        self.assertEqual(list(keys.irange(500, 500)), [])
+        self.assertEqual(list(keys.irange(2000, 3000)), [])
+
+    def test_edge_index(self):
+        src, dst = array('i'), array('i')
+        index = graph._EdgeIndex(src, dst)
+        for number in range(1000):
+            src.append(number % 10)
+            dst.append(number // 10)
+            index.add(number)
+        self.assertEqual(index.get(7, 42), 427)
+        for number in range(0, 1000, 2):
+            index.remove(src[number], dst[number])
+        self.assertEqual(index.get(4, 12), graph._NONE)
+        self.assertEqual(index.get(5, 12), 125)
+        index.add(124)
+        self.assertEqual([index.get(src[number], dst[number])
+                          for number in range(120, 126)],
+                         [graph._NONE, 121, graph._NONE, 123, 124, 125])
+        self.assertLessEqual(len(index._slots), 3 * 1000)
+
+    def test_instances_do_not_share_state(self):
+        self.g.upsert_link(graph.Link(url='https://example.com'))
+        other = graph.GraphInMemory()
+        self.assertEqual(len(other.links), 0)
+
+    def test_removed_edge_slots_are_reused(self):
+        src = self.g.upsert_link(link=graph.Link(url='src'))
+        dsts = [self.g.upsert_link(link=graph.Link(url=str(i)))
+                for i in range(3)]
+        for dst in dsts:
+            self.g.upsert_edge(graph.Edge(src=src.link_id, dst=dst.link_id))
+        self.g.remove_stale_edges(
+            from_id=src.link_id, deletion_treshold=datetime.max)
+        self.assertEqual(self.g.link_edge_map[src.link_id], [])
+        self.assertEqual(len(self.g.edges), 0)
+
+        edge = self.g.upsert_edge(
+            graph.Edge(src=src.link_id, dst=dsts[0].link_id))
+        self.assertEqual(self.g.link_edge_map[src.link_id], [edge.edge_id])
+        self.assertEqual(self.g.edges[edge.edge_id], edge)
+        self.assertEqual(len(self.g._edge_src), 3)
+
+    def test_timestamp_roundtrip(self):
+        for dt in (datetime.min, datetime.max, datetime.utcnow()):
+            self.assertEqual(graph.from_timestamp(graph.to_timestamp(dt)), dt)
+
+    def test_crawl_status(self):
+        link = self.g.upsert_link(graph.Link(url='https://example.com'))
+        self.assertRaises(KeyError, self.g.find_crawl_status, link.link_id)
+        checked_at = datetime.utcnow()
+        status = graph.CrawlStatus(link_id=link.link_id,
+                                   status_code=200,
+                                   fetches=1,
+                                   content_hash=-42,
+                                   interval=timedelta(days=1),
+                                   checked_at=checked_at,
+                                   next_due_at=checked_at + timedelta(days=1))
+        self.assertEqual(self.g.upsert_crawl_status(status), status)
+        self.assertEqual(self.g.find_crawl_status(link.link_id), status)
+
+        # An older outcome does not roll the status back
+        stale = graph.CrawlStatus(link_id=link.link_id, status_code=500,
+                                  checked_at=self._second_before(checked_at))
+        self.assertEqual(self.g.upsert_crawl_status(stale), status)
+        self.assertRaises(KeyError, self.g.upsert_crawl_status,
+                          graph.CrawlStatus(link_id=uuid.uuid4()))
+
+        self.g.upsert_link(graph.Link(url='without status'))
+        self.assertEqual(list(self.g.crawl_statuses_iter(
+            uuid.UUID(int=0), uuid.UUID(int=(1 << 128) - 1))), [status])
+
     def _second_before(self, dt: datetime = datetime.utcnow()):
         return dt - timedelta(seconds=1)
 
 
+class GraphConcurrencyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.g = graph.GraphInMemory(lock_stripes=8)
+
+    def test_concurrent_upserts(self):
+        hub = self.g.upsert_link(graph.Link(url='hub'))
+
+        def crawl():
+            for i in range(500):
+                dst = self.g.upsert_link(graph.Link(url=str(i)))
+                self.g.upsert_edge(
+                    graph.Edge(src=hub.link_id, dst=dst.link_id))
+                if i % 100 == 0:
+                    self.g.remove_stale_edges(
+                        from_id=hub.link_id, deletion_treshold=datetime.min)
+
+        threads = [threading.Thread(target=crawl) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.g.links), 501)
+        edges = list(self.g.edges_iter(
+            from_id=uuid.UUID(int=0),
+            to_id=uuid.UUID('{FFFFFFFF-FFFF-FFFF-FFFF-FFFFFFFFFFFF}'),
+            updated_before=datetime.max))
+        self.assertEqual(len(edges), 500)
+        self.assertEqual(len({edge.dst for edge in edges}), 500)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,313 @@
+"""GraphInMemory with a write-ahead log and snapshots."""
+
+import os
+import re
+import struct
+import threading
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from typing import BinaryIO, Iterator
+import graph
+
+# Every record is a payload length and crc32 followed by the payload, whose
+# first byte is the record type. Snapshots are streams of the same records.
+_RECORD = struct.Struct('<II')
+_LINK = struct.Struct('<B16sq')           # type, link_id, retrieved_at, url
+_EDGE = struct.Struct('<B16s16s16sq')     # type, edge_id, src, dst, updated
+_REMOVE = struct.Struct('<B16sq')         # type, src, deletion_treshold
+_STATUS = struct.Struct('<B16s4i4q')      # type, link_id, CrawlStatus fields
+_LINK_RECORD, _EDGE_RECORD, _REMOVE_RECORD, _STATUS_RECORD = 1, 2, 3, 4
+_MICROSECOND = timedelta(microseconds=1)
+
+_FILE_NAME = re.compile(r'^(wal|snapshot)-(\d{12})\.log$')
+
+
+class GraphWAL(graph.Graph):
+    """ GraphInMemory made durable by a write-ahead log and snapshots
+
+    Every mutation is applied to the in-memory graph and its result is
+    appended to the current log segment. A background thread fsyncs the
+    segment every sync_interval seconds, so a crash loses at most that much.
+    Once a segment outgrows snapshot_bytes a background snapshot starts: the
+    log rotates to a new segment, the graph is dumped, and older segments
+    and snapshots are deleted. Recovery loads the latest snapshot and
+    replays the segments written since. Records hold results, such as
+    assigned ids and timestamps, and replay with restore_link / restore_edge
+    is idempotent, so replaying a segment over a snapshot that already
+    includes some of its writes is safe.
+
+    Attributes:
+        directory: holds wal-N.log segments and snapshot-N.log snapshots,
+            snapshot N covers everything logged before segment N
+        graph: the recovered GraphInMemory serving all reads
+    """
+
+    def __init__(self,
+                 directory: str,
+                 lock_stripes: int = 0,
+                 sync_interval: float = 0.05,
+                 snapshot_bytes: int = 1 << 26):
+        self.directory = directory
+        self.sync_interval = sync_interval
+        self.snapshot_bytes = snapshot_bytes
+        self.graph = graph.GraphInMemory(lock_stripes=lock_stripes)
+        self._log_lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self._closed = threading.Event()
+
+        os.makedirs(directory, exist_ok=True)
+        self._segment_number = self._recover()
+        self._segment = self._open_segment(self._segment_number)
+        self._segment_bytes = 0
+        self._syncer = threading.Thread(target=self._sync_loop, daemon=True)
+        self._syncer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._closed.set()
+        self._syncer.join()
+        with self._snapshot_lock, self._log_lock:
+            self._sync()
+            self._segment.close()
+
+    def sync(self):
+        """ Flushes and fsyncs the log segment """
+        with self._log_lock:
+            self._sync()
+
+    def snapshot(self):
+        """ Rotates the log, dumps the graph and drops what it supersedes """
+        with self._snapshot_lock:
+            self._snapshot()
+
+    def export_csr(self, path: str):
+        self.graph.export_csr(path)
+
+    def find_link(self, link_id: uuid.UUID) -> graph.Link:
+        return self.graph.find_link(link_id)
+
+    def upsert_link(self, link: graph.Link) -> graph.Link:
+        link_stored = self.graph.upsert_link(link)
+        self._append(_encode_link(link_stored))
+        return link_stored
+
+    def links_iter(self,
+                   from_id: uuid.UUID,
+                   to_id: uuid.UUID,
+                   retrieved_before: datetime) -> Iterator[graph.Link]:
+        return self.graph.links_iter(from_id, to_id, retrieved_before)
+
+    def upsert_edge(self, edge: graph.Edge) -> graph.Edge:
+        edge_stored = self.graph.upsert_edge(edge)
+        self._append(_encode_edge(edge_stored))
+        return edge_stored
+
+    def edges_iter(self,
+                   from_id: uuid.UUID,
+                   to_id: uuid.UUID,
+                   updated_before: datetime) -> Iterator[graph.Edge]:
+        return self.graph.edges_iter(from_id, to_id, updated_before)
+
+    def remove_stale_edges(self,
+                           from_id: uuid.UUID,
+                           deletion_treshold: datetime):
+        self.graph.remove_stale_edges(from_id, deletion_treshold)
+        self._append(_REMOVE.pack(_REMOVE_RECORD,
+                                  from_id.bytes,
+                                  graph.to_timestamp(deletion_treshold)))
+
+    def find_crawl_status(self, link_id: uuid.UUID) -> graph.CrawlStatus:
+        return self.graph.find_crawl_status(link_id)
+
+    def crawl_statuses_iter(self,
+                            from_id: uuid.UUID,
+                            to_id: uuid.UUID) -> Iterator[graph.CrawlStatus]:
+        return self.graph.crawl_statuses_iter(from_id, to_id)
+
+    def upsert_crawl_status(self,
+                            status: graph.CrawlStatus) -> graph.CrawlStatus:
+        status_stored = self.graph.upsert_crawl_status(status)
+        self._append(_encode_status(status_stored))
+        return status_stored
+
+    def _recover(self) -> int:
+        """ Loads the latest snapshot, replays newer segments
+
+        Returns the number for a fresh segment; existing segments are never
+        appended to, as their tail may be torn.
+        """
+        files = {'wal': [], 'snapshot': []}
+        for name in os.listdir(self.directory):
+            match = _FILE_NAME.match(name)
+            if match:
+                files[match.group(1)].append(int(match.group(2)))
+        start = max(files['snapshot'], default=0)
+        if files['snapshot']:
+            self._replay(self._path('snapshot', start))
+        for number in sorted(files['wal']):
+            if number >= start:
+                self._replay(self._path('wal', number))
+        return max(files['wal'] + files['snapshot'], default=0) + 1
+
+    def _replay(self, path: str):
+        with open(path, 'rb') as file:
+            for payload in _read_records(file):
+                _apply(self.graph, payload)
+
+    def _append(self, payload: bytes):
+        record = _frame(payload)
+        with self._log_lock:
+            self._segment.write(record)
+            self._segment_bytes += len(record)
+            full = self._segment_bytes >= self.snapshot_bytes
+        if full and self._snapshot_lock.acquire(blocking=False):
+            threading.Thread(target=self._background_snapshot,
+                             daemon=True).start()
+
+    def _background_snapshot(self):
+        try:
+            self._snapshot()
+        finally:
+            self._snapshot_lock.release()
+
+    def _snapshot(self):
+        """ Caller holds _snapshot_lock """
+        with self._log_lock:
+            self._sync()
+            self._segment.close()
+            self._segment_number += 1
+            number = self._segment_number
+            self._segment = self._open_segment(number)
+            self._segment_bytes = 0
+
+        path = self._path('snapshot', number)
+        with open(f'{path}.tmp', 'wb') as file:
+            # Links first, so restore_edge finds both endpoints; edges to
+            # links added during the dump are in segment number as well
+            for link, status in self.graph.dump_links_iter():
+                file.write(_frame(_encode_link(link)))
+                if status is not None:
+                    file.write(_frame(_encode_status(status)))
+            for edge in self.graph.dump_edges_iter():
+                file.write(_frame(_encode_edge(edge)))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(f'{path}.tmp', path)
+        self._sync_directory()
+
+        for name in os.listdir(self.directory):
+            match = _FILE_NAME.match(name)
+            if match and int(match.group(2)) < number:
+                os.remove(os.path.join(self.directory, name))
+
+    def _sync_loop(self):
+        while not self._closed.wait(self.sync_interval):
+            self.sync()
+
+    def _sync(self):
+        """ Caller holds _log_lock """
+        self._segment.flush()
+        os.fsync(self._segment.fileno())
+
+    def _open_segment(self, number: int) -> BinaryIO:
+        segment = open(self._path('wal', number), 'ab')
+        self._sync_directory()
+        return segment
+
+    def _sync_directory(self):
+        descriptor = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+
+    def _path(self, kind: str, number: int) -> str:
+        return os.path.join(self.directory, f'{kind}-{number:012d}.log')
+
+
+def _encode_link(link: graph.Link) -> bytes:
+    return _LINK.pack(_LINK_RECORD,
+                      link.link_id.bytes,
+                      graph.to_timestamp(link.retrieved_at)) \
+        + link.url.encode()
+
+
+def _encode_edge(edge: graph.Edge) -> bytes:
+    return _EDGE.pack(_EDGE_RECORD,
+                      edge.edge_id.bytes,
+                      edge.src.bytes,
+                      edge.dst.bytes,
+                      graph.to_timestamp(edge.updated_at))
+
+
+def _encode_status(status: graph.CrawlStatus) -> bytes:
+    return _STATUS.pack(_STATUS_RECORD,
+                        status.link_id.bytes,
+                        status.status_code,
+                        status.failures,
+                        status.fetches,
+                        status.changes,
+                        status.content_hash,
+                        status.interval // _MICROSECOND,
+                        graph.to_timestamp(status.checked_at),
+                        graph.to_timestamp(status.next_due_at))
+
+
+def _frame(payload: bytes) -> bytes:
+    return _RECORD.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _read_records(file: BinaryIO) -> Iterator[bytes]:
+    """ Yields payloads up to the end or the first torn or corrupt record """
+    while True:
+        header = file.read(_RECORD.size)
+        if len(header) < _RECORD.size:
+            return
+        length, checksum = _RECORD.unpack(header)
+        payload = file.read(length)
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            return
+        yield payload
+
+
+def _apply(graph_in_memory: graph.GraphInMemory, payload: bytes):
+    kind = payload[0]
+    if kind == _LINK_RECORD:
+        _, link_id, retrieved_at = _LINK.unpack_from(payload)
+        graph_in_memory.restore_link(graph.Link(
+            link_id=uuid.UUID(bytes=link_id),
+            url=payload[_LINK.size:].decode(),
+            retrieved_at=graph.from_timestamp(retrieved_at)))
+    elif kind == _EDGE_RECORD:
+        _, edge_id, src, dst, updated_at = _EDGE.unpack(payload)
+        try:
+            graph_in_memory.restore_edge(graph.Edge(
+                edge_id=uuid.UUID(bytes=edge_id),
+                src=uuid.UUID(bytes=src),
+                dst=uuid.UUID(bytes=dst),
+                updated_at=graph.from_timestamp(updated_at)))
+        except KeyError:
+            pass    # endpoint added mid-snapshot, the edge is in the log
+    elif kind == _REMOVE_RECORD:
+        _, src, deletion_treshold = _REMOVE.unpack(payload)
+        graph_in_memory.remove_stale_edges(
+            uuid.UUID(bytes=src), graph.from_timestamp(deletion_treshold))
+    elif kind == _STATUS_RECORD:
+        _, link_id, status_code, failures, fetches, changes, content_hash, \
+            interval, checked_at, next_due_at = _STATUS.unpack(payload)
+        graph_in_memory.upsert_crawl_status(graph.CrawlStatus(
+            link_id=uuid.UUID(bytes=link_id),
+            status_code=status_code,
+            failures=failures,
+            fetches=fetches,
+            changes=changes,
+            content_hash=content_hash,
+            interval=timedelta(microseconds=interval),
+            checked_at=graph.from_timestamp(checked_at),
+            next_due_at=graph.from_timestamp(next_due_at)))
@@ -0,0 +1,120 @@
+"""GraphWALTestCase"""
+
+import os
+import tempfile
+import unittest
+import uuid
+from datetime import datetime, timedelta
+import graph
+import graph_wal
+
+MIN_ID = uuid.UUID(int=0)
+MAX_ID = uuid.UUID('{FFFFFFFF-FFFF-FFFF-FFFF-FFFFFFFFFFFF}')
+
+
+class GraphWALTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.g = graph_wal.GraphWAL(self.directory.name)
+
+    def tearDown(self):
+        self.g.close()
+        self.directory.cleanup()
+
+    def test_recovers_from_log(self):
+        links, edges = self._populate()
+        self._reopen()
+        self.assertEqual(self._links(), links)
+        self.assertEqual(self._edges(), edges)
+
+    def test_recovers_from_snapshot_and_log_tail(self):
+        self._populate()
+        self.g.snapshot()
+        src = self.g.upsert_link(graph.Link(url='after snapshot'))
+        dst = self.g.upsert_link(graph.Link(url='0'))
+        self.g.upsert_edge(graph.Edge(src=src.link_id, dst=dst.link_id))
+        links, edges = self._links(), self._edges()
+        self._reopen()
+        self.assertEqual(self._links(), links)
+        self.assertEqual(self._edges(), edges)
+        self.assertEqual(sorted(os.listdir(self.directory.name)),
+                         ['snapshot-000000000002.log',
+                          'wal-000000000002.log',
+                          'wal-000000000003.log'])
+
+    def test_recovery_stops_at_torn_tail(self):
+        links, edges = self._populate()
+        self.g.close()
+        segment = os.path.join(self.directory.name, 'wal-000000000001.log')
+        with open(segment, 'ab') as file:
+            file.write(b'\x10\x00\x00\x00torn')
+        self.g = graph_wal.GraphWAL(self.directory.name)
+        self.assertEqual(self._links(), links)
+        self.assertEqual(self._edges(), edges)
+
+    def test_background_snapshot(self):
+        self.g.close()
+        self.g = graph_wal.GraphWAL(self.directory.name, snapshot_bytes=256)
+        links, edges = self._populate()
+        with self.g._snapshot_lock:
+            pass
+        self._reopen()
+        self.assertEqual(self._links(), links)
+        self.assertEqual(self._edges(), edges)
+
+    def test_recovers_crawl_status(self):
+        links, _ = self._populate()
+        statuses = [self.g.upsert_crawl_status(graph.CrawlStatus(
+            link_id=link.link_id, status_code=200 + i, fetches=i,
+            content_hash=-i, interval=timedelta(hours=i),
+            checked_at=datetime.utcnow())) for i, link in enumerate(links)]
+        self.g.snapshot()
+        statuses[0] = self.g.upsert_crawl_status(graph.CrawlStatus(
+            link_id=links[0].link_id, status_code=0, failures=1,
+            checked_at=datetime.utcnow()))
+        self._reopen()
+        self.assertEqual([self.g.find_crawl_status(link.link_id)
+                          for link in links], statuses)
+
+    def test_snapshot_keeps_unbounded_links(self):
+        # Beyond links_iter's exclusive bounds, restored outside the log
+        last = self.g.graph.restore_link(graph.Link(
+            link_id=MAX_ID, url='last', retrieved_at=datetime.max))
+        first = self.g.upsert_link(graph.Link(url='first'))
+        edge = self.g.upsert_edge(graph.Edge(src=last.link_id,
+                                             dst=first.link_id))
+        status = self.g.upsert_crawl_status(graph.CrawlStatus(
+            link_id=last.link_id, status_code=200,
+            checked_at=datetime.utcnow()))
+        self.g.snapshot()
+        self._reopen()
+        self.assertEqual(self.g.find_link(MAX_ID), last)
+        self.assertEqual(self.g.find_crawl_status(MAX_ID), status)
+        self.assertEqual(list(self.g.graph.dump_edges_iter()), [edge])
+
+    def _populate(self):
+        links = [self.g.upsert_link(graph.Link(url=str(i)))
+                 for i in range(10)]
+        for src in links:
+            for dst in links[:3]:
+                self.g.upsert_edge(
+                    graph.Edge(src=src.link_id, dst=dst.link_id))
+        self.g.remove_stale_edges(
+            from_id=links[0].link_id, deletion_treshold=datetime.max)
+        return self._links(), self._edges()
+
+    def _reopen(self):
+        self.g.close()
+        self.g = graph_wal.GraphWAL(self.directory.name)
+
+    def _links(self):
+        return sorted(self.g.links_iter(MIN_ID, MAX_ID, datetime.max),
+                      key=lambda link: link.link_id)
+
+    def _edges(self):
+        return sorted(self.g.edges_iter(MIN_ID, MAX_ID, datetime.max),
+                      key=lambda edge: edge.edge_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,7 +5,7 @@ from enum import Enum
 from datetime import datetime
 from copy import deepcopy
 from collections import defaultdict
-from typing import Iterator
+from typing import Iterable, Iterator
 import uuid
 
 
@@ -76,6 +76,12 @@ class Indexer(metaclass=ABCMeta):
                               pagerank_score: float):
         """ Update doc score for link_id, if not exists, placeholder score """
 
+    def update_pagerank_scores(self,
+                               scores: Iterable[tuple[uuid.UUID, float]]):
+        """ Updates scores in bulk, backends override to batch the writes """
+        for link_id, pagerank_score in scores:
+            self.update_pagerank_score(link_id, pagerank_score)
+
 
 class IndexerInMemory(Indexer):
     """ Implements Indexer behavior in memory """
@@ -107,16 +113,18 @@ class IndexerInMemory(Indexer):
     def search_documents(self, query: Query) -> Iterator[Document]:
         """ Search index by query and return iterator of docs
 
+            Matches are ordered by pagerank, the first query.offset skipped
+
             TODO
             - Incorporate Swoosh or Lucene or Lupyne
-            - Incorporate Query objects and pagination
             - Allow both AND and OR searches
-            - Sort by rank
         """
         result = [self.index.get(token, set())
                   for token in self._tokenize(query.expression)]
-        documents = [self.documents[link_id] for link_id in set.union(*result)]
-        return iter(documents)
+        documents = sorted(
+            (self.documents[link_id] for link_id in set().union(*result)),
+            key=lambda document: document.pagerank, reverse=True)
+        return iter(documents[query.offset:])
 
     def update_pagerank_score(self,
                               link_id: uuid.UUID,
@@ -126,6 +134,13 @@ class IndexerInMemory(Indexer):
         document.pagerank = pagerank_score
         self._reindex(document)
 
+    def update_pagerank_scores(self,
+                               scores: Iterable[tuple[uuid.UUID, float]]):
+        """ Sets scores in place, pagerank is not part of the token index """
+        for link_id, pagerank_score in scores:
+            self.documents.setdefault(
+                link_id, Document(link_id=link_id)).pagerank = pagerank_score
+
     def _update_index(self, document: Document):
         for token in self._tokenize_document(document):
             self.index[token].add(document.link_id)
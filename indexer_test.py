@@ -77,6 +77,22 @@ class IndexerTestCase(unittest.TestCase):
         document_found = self.indexer.find_document_by_link_id('bullshit')
         self.assertEqual(document_found.pagerank, 4.0)
 
+    def test_update_pagerank_scores(self):
+        doc_original = indexer.Document(
+            link_id=uuid.uuid4(),
+            title='Illustrious examples')
+        self.indexer.upsert_document_index(doc_original)
+        placeholder_id = uuid.uuid4()
+        self.indexer.update_pagerank_scores(
+            [(doc_original.link_id, 0.25), (placeholder_id, 0.75)])
+        self.assertEqual(self.indexer.find_document_by_link_id(
+            doc_original.link_id).pagerank, 0.25)
+        self.assertEqual(self.indexer.find_document_by_link_id(
+            placeholder_id).pagerank, 0.75)
+        document_iter = self.indexer.search_documents(
+            indexer.Query(expression='examples'))
+        self.assertEqual(list(document_iter)[0].pagerank, 0.25)
+
     def test_search_documents(self):
         doc_original = indexer.Document(
             link_id='bullshit',
@@ -96,6 +112,20 @@ class IndexerTestCase(unittest.TestCase):
         )
         self.assertTrue(not list(document_iter))
 
+    def test_search_documents_ranked_with_offset(self):
+        for _ in range(3):
+            self.indexer.upsert_document_index(indexer.Document(
+                link_id=uuid.uuid4(), title='examples'))
+        self.indexer.update_pagerank_scores(
+            (link_id, pagerank) for link_id, pagerank
+            in zip(self.indexer.documents, (0.1, 0.3, 0.2)))
+        document_iter = self.indexer.search_documents(
+            indexer.Query(expression='examples', offset=1))
+        self.assertEqual([document.pagerank for document in document_iter],
+                         [0.2, 0.1])
+        self.assertEqual(list(self.indexer.search_documents(
+            indexer.Query(expression=''))), [])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,287 @@
+"""Indexer on Whoosh."""
+
+import os
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterable, Iterator
+from whoosh import fields, query, scoring
+from whoosh.filedb.filestore import FileStorage
+import indexer
+
+_SCHEMA = fields.Schema(
+    link_id=fields.ID(stored=True, unique=True, sortable=True),
+    url=fields.STORED,
+    title=fields.TEXT(stored=True, field_boost=2.0),
+    content=fields.TEXT(stored=True),
+    indexed_at=fields.STORED)
+
+_SEARCH_FIELDS = 'title', 'content'
+_FIRST_PAGE = 64
+
+_PAGERANK_FILE = 'pagerank.sqlite'
+_PAGERANK_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS pagerank (
+    link_id BLOB PRIMARY KEY,
+    score REAL NOT NULL
+) WITHOUT ROWID'''
+_UPSERT_PAGERANK = '''
+INSERT INTO pagerank (link_id, score) VALUES (?, ?)
+ON CONFLICT (link_id) DO UPDATE SET score = excluded.score'''
+_SELECT_PAGERANKS = 'SELECT link_id, score FROM pagerank'
+_CREATE_LOCK = 'CREATE_LOCK'
+
+
+class IndexerWhoosh(indexer.Indexer):
+    """ Implements indexer interface on a Whoosh index directory
+
+    Upserts are buffered and written by one Whoosh writer per batch of up
+    to batch_size documents, committed when the batch fills, when the index
+    is read, or on commit() / close(). The writer lock is only held while a
+    batch is written and the index is created under a file lock, so several
+    processes can share the directory.
+
+    Pagerank scores are kept out of the Whoosh documents, in a sqlite table
+    next to the index, so the pagerank job never rewrites document text.
+    The table is cached as a dict, dropped by update_pagerank_scores and
+    reloaded when sqlite's data_version shows another process wrote it, so
+    searches look scores up in memory. Matches are ranked by their BM25F
+    relevance multiplied by 1 + pagerank_weight * pagerank.
+
+    Attributes:
+        directory: index directory, created if missing
+        batch_size: upserts per Whoosh writer commit
+        pagerank_weight: how strongly pagerank scales relevance
+        lock_timeout: seconds to wait for another process' writer
+    """
+
+    def __init__(self,
+                 directory: str,
+                 batch_size: int = 1000,
+                 pagerank_weight: float = 1000.0,
+                 lock_timeout: float = 30.0):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.pagerank_weight = pagerank_weight
+        self.lock_timeout = lock_timeout
+        self._lock = threading.RLock()
+        self._pending: dict[str, dict] = {}
+        self._batching = False
+        self._pagerank_cache: dict[str, float] = None
+        self._pagerank_version = None
+        os.makedirs(directory, exist_ok=True)
+        storage = FileStorage(directory)
+        creation = storage.lock(_CREATE_LOCK)
+        creation.acquire(blocking=True)
+        try:
+            if storage.index_exists():
+                self._index = storage.open_index()
+            else:
+                self._index = storage.create_index(_SCHEMA)
+        finally:
+            creation.release()
+        self._connection = sqlite3.connect(
+            os.path.join(directory, _PAGERANK_FILE),
+            isolation_level=None, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(_PAGERANK_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self.commit()
+            self._connection.close()
+            self._index.close()
+
+    def commit(self):
+        """ Writes the buffered upserts, if any """
+        with self._lock:
+            if not self._pending:
+                return
+            writer = self._index.writer(timeout=self.lock_timeout)
+            try:
+                for fields_ in self._pending.values():
+                    writer.update_document(**fields_)
+            except BaseException:
+                writer.cancel()
+                raise
+            writer.commit()
+            self._pending.clear()
+
+    @contextmanager
+    def batch(self):
+        """ Writes all upserts in the with block in one commit """
+        with self._lock:
+            if self._batching:      # nested, the outer batch commits
+                yield self
+                return
+            self._batching = True
+            try:
+                yield self
+            finally:
+                self._batching = False
+            self.commit()
+
+    def upsert_document_index(self,
+                              document: indexer.Document) -> indexer.Document:
+        """ Indexes a new document or updates existing, keeping its score """
+        if not document.link_id:
+            raise ValueError(f'link_id param missing for doc \n{document}')
+        key = str(document.link_id)
+        indexed_at = datetime.utcnow()
+        with self._lock:
+            self._pending[key] = {
+                'link_id': key,
+                'url': document.url,
+                'title': document.title,
+                'content': document.content,
+                'indexed_at': indexed_at,
+            }
+            if not self._batching and len(self._pending) >= self.batch_size:
+                self.commit()
+        pagerank = self._pageranks().get(key, 0.0)
+        return indexer.Document(
+            link_id=document.link_id, url=document.url, title=document.title,
+            content=document.content, indexed_at=indexed_at,
+            pagerank=pagerank)
+
+    def find_document_by_link_id(self,
+                                 link_id: uuid.UUID) -> indexer.Document:
+        """ Find document by related link object's link_id, else KeyError """
+        key = str(link_id)
+        self._flush()
+        with self._index.searcher() as searcher:
+            stored = searcher.document(link_id=key)
+        pageranks = self._pageranks()
+        if stored is not None:
+            return self._document(stored, pageranks)
+        if key in pageranks:     # scored before it was indexed
+            return indexer.Document(link_id=link_id, pagerank=pageranks[key])
+        raise KeyError(f'link_id {link_id} missing indexer.docs')
+
+    def search_documents(self,
+                         query_: indexer.Query) -> Iterator[indexer.Document]:
+        """ Search index by query and return iterator of docs
+
+            Matches are ordered by relevance scaled by pagerank, the first
+            query.offset skipped. Pages of results are fetched lazily, each
+            twice as large as the previous one.
+        """
+        self._flush()
+        whoosh_query = self._parse(query_)
+        if whoosh_query is None:
+            return iter(())
+        return self._search(whoosh_query, query_.offset)
+
+    def update_pagerank_score(self,
+                              link_id: uuid.UUID,
+                              pagerank_score: float):
+        self.update_pagerank_scores([(link_id, pagerank_score)])
+
+    def update_pagerank_scores(self,
+                               scores: Iterable[tuple[uuid.UUID, float]]):
+        """ Updates scores in one transaction, documents are not touched """
+        scores = [(link_id, float(score)) for link_id, score in scores]
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                self._connection.executemany(
+                    _UPSERT_PAGERANK,
+                    ((link_id.bytes, score) for link_id, score in scores))
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+            self._connection.execute('COMMIT')
+            self._pagerank_cache = None
+
+    def _search(self, whoosh_query: query.Query,
+                offset: int) -> Iterator[indexer.Document]:
+        pageranks = self._pageranks()
+        weighting = _PagerankWeighting(self.pagerank_weight, pageranks)
+        with self._index.searcher(weighting=weighting) as searcher:
+            weighting.link_ids = searcher.reader().column_reader('link_id')
+            limit = offset + _FIRST_PAGE
+            while True:
+                results = searcher.search(whoosh_query, limit=limit)
+                scored = results.scored_length()
+                for position in range(offset, scored):
+                    try:
+                        document = self._document(results[position],
+                                                  pageranks)
+                    except ValueError:
+                        continue    # link_id written by others, not a UUID
+                    yield document
+                if scored < limit:
+                    return
+                offset, limit = limit, limit * 2
+
+    def _parse(self, query_: indexer.Query) -> query.Query:
+        """ Returns a Whoosh query, None when the expression has no terms """
+        clauses = []
+        for name in _SEARCH_FIELDS:
+            analyzer = _SCHEMA[name].analyzer
+            terms = [token.text for token in analyzer(query_.expression)]
+            if not terms:
+                continue
+            if query_.query_type == indexer.QueryType.PHRASE:
+                clauses.append(query.Phrase(name, terms))
+            else:
+                clauses.extend(query.Term(name, term) for term in terms)
+        return query.Or(clauses) if clauses else None
+
+    def _flush(self):
+        with self._lock:
+            if not self._batching:
+                self.commit()
+
+    def _pageranks(self) -> dict[str, float]:
+        """ Scores by link ID string, the cache reloaded if it is stale
+
+        data_version only changes for other connections' commits, ours drop
+        the cache in update_pagerank_scores. Rows whose link_id is not a
+        16-byte UUID are skipped.
+        """
+        with self._lock:
+            version = self._connection.execute(
+                'PRAGMA data_version').fetchone()[0]
+            if self._pagerank_cache is None \
+                    or version != self._pagerank_version:
+                self._pagerank_cache = {
+                    str(uuid.UUID(bytes=link_id)): score
+                    for link_id, score
+                    in self._connection.execute(_SELECT_PAGERANKS)
+                    if isinstance(link_id, bytes) and len(link_id) == 16}
+                self._pagerank_version = version
+            return self._pagerank_cache
+
+    def _document(self, stored,
+                  pageranks: dict[str, float]) -> indexer.Document:
+        return indexer.Document(
+            link_id=uuid.UUID(stored['link_id']),
+            url=stored.get('url', ''),
+            title=stored.get('title', ''),
+            content=stored.get('content', ''),
+            indexed_at=stored.get('indexed_at', datetime.min),
+            pagerank=pageranks.get(stored['link_id'], 0.0))
+
+
+class _PagerankWeighting(scoring.BM25F):
+    """ BM25F whose final score is scaled by the document's pagerank """
+    use_final = True
+
+    def __init__(self, pagerank_weight: float, pageranks: dict[str, float]):
+        super().__init__()
+        self.pageranks = pageranks
+        self.pagerank_weight = pagerank_weight
+        self.link_ids = None
+
+    def final(self, searcher, docnum: int, score: float) -> float:
+        pagerank = self.pageranks.get(self.link_ids[docnum], 0.0)
+        return score * (1.0 + self.pagerank_weight * pagerank)
@@ -0,0 +1,148 @@
+"""IndexerWhooshTestCase"""
+
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import unittest
+import uuid
+import indexer
+import indexer_whoosh
+
+
+def _open_and_close(directory: str):
+    indexer_whoosh.IndexerWhoosh(directory).close()
+
+
+class IndexerWhooshTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.indexer = indexer_whoosh.IndexerWhoosh(self.directory,
+                                                    batch_size=2)
+        self.addCleanup(lambda: self.indexer.close())
+
+    def test_upsert_and_find(self):
+        link_id = uuid.uuid4()
+        self.indexer.update_pagerank_score(link_id, 0.5)
+        self.assertEqual(
+            self.indexer.find_document_by_link_id(link_id).pagerank, 0.5)
+        inserted = self.indexer.upsert_document_index(indexer.Document(
+            link_id=link_id, url='http://example.com', title='Examples',
+            content='Lorem ipsum dolor'))
+        self.assertEqual(inserted.pagerank, 0.5)
+        found = self.indexer.find_document_by_link_id(link_id)
+        self.assertEqual((found.url, found.title, found.content,
+                          found.indexed_at, found.pagerank),
+                         ('http://example.com', 'Examples',
+                          'Lorem ipsum dolor', inserted.indexed_at, 0.5))
+        self.assertRaises(KeyError, self.indexer.find_document_by_link_id,
+                          uuid.uuid4())
+        self.assertRaises(ValueError, self.indexer.upsert_document_index,
+                          indexer.Document(link_id=None))
+
+    def test_search_ranks_by_relevance_and_pagerank(self):
+        relevant, popular, other = self._index([
+            ('crawler crawler', 'a crawler for the web'),
+            ('index', 'the crawler feeds the index'),
+            ('unrelated', 'nothing to see')])
+        self.assertEqual(self._search('Crawler'), [relevant, popular])
+        self.indexer.update_pagerank_scores([(popular, 0.1)])
+        self.assertEqual(self._search('crawler'), [popular, relevant])
+        self.assertEqual(self._search('crawler', offset=1), [relevant])
+        self.assertEqual(self._search('crawler nothing'),
+                         [popular, relevant, other])
+        self.assertEqual(self._search(''), [])
+
+    def test_pageranks_are_cached_and_foreign_keys_skipped(self):
+        link_id, = self._index([('crawler', 'crawler')])
+        writer = self.indexer._index.writer()
+        writer.add_document(link_id='not-a-uuid', title='crawler')
+        writer.commit()
+        other = sqlite3.connect(
+            os.path.join(self.directory, indexer_whoosh._PAGERANK_FILE))
+        with other:
+            other.execute('INSERT INTO pagerank VALUES (?, ?)',
+                          (b'short', 1.0))
+        other.close()
+        self.assertEqual(self._search('crawler'), [link_id])
+        pageranks = self.indexer._pageranks()
+        self._search('crawler')
+        self.assertIs(self.indexer._pageranks(), pageranks)
+        self.indexer.update_pagerank_score(link_id, 0.5)
+        self.assertEqual(self.indexer._pageranks(), {str(link_id): 0.5})
+
+    def test_phrase_search(self):
+        forward, backward = self._index([
+            ('', 'search engine results'),
+            ('', 'engine search results')])
+        phrase = indexer.QueryType.PHRASE
+        self.assertEqual(self._search('search engine', phrase), [forward])
+        self.assertEqual(self._search('engine search', phrase), [backward])
+
+    def test_paging_beyond_first_page(self):
+        link_ids = self._index([('page', f'number {number}')
+                                for number in range(150)])
+        results = self._search('page')
+        self.assertEqual(sorted(results), sorted(link_ids))
+        self.assertEqual(self._search('page', offset=100), results[100:])
+
+    def test_update_keeps_pagerank_and_persists(self):
+        link_id, = self._index([('old title', 'old')])
+        self.indexer.update_pagerank_score(link_id, 0.25)
+        with self.indexer.batch():
+            self.indexer.upsert_document_index(indexer.Document(
+                link_id=link_id, title='new title', content='new'))
+        self.assertEqual(self._search('old'), [])
+        self.indexer.close()
+
+        self.indexer = indexer_whoosh.IndexerWhoosh(self.directory)
+        self.assertEqual(self._search('new'), [link_id])
+        found = self.indexer.find_document_by_link_id(link_id)
+        self.assertEqual((found.title, found.pagerank), ('new title', 0.25))
+
+    def test_processes_share_directory(self):
+        directory = os.path.join(self.directory, 'shared')
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=_open_and_close,
+                                     args=(directory,))
+                     for _ in range(8)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertEqual([process.exitcode for process in processes],
+                         [0] * 8)
+
+        first = indexer_whoosh.IndexerWhoosh(directory)
+        self.addCleanup(first.close)
+        second = indexer_whoosh.IndexerWhoosh(directory)
+        self.addCleanup(second.close)
+        link_id = uuid.uuid4()
+        first.upsert_document_index(indexer.Document(
+            link_id=link_id, title='shared', content='shared'))
+        first.commit()
+        second.update_pagerank_score(link_id, 0.5)
+        documents = first.search_documents(indexer.Query(expression='shared'))
+        self.assertEqual([document.pagerank for document in documents],
+                         [0.5])
+
+    def _index(self, pages: list[tuple[str, str]]) -> list[uuid.UUID]:
+        link_ids = []
+        for title, content in pages:
+            link_ids.append(uuid.uuid4())
+            self.indexer.upsert_document_index(indexer.Document(
+                link_id=link_ids[-1], title=title, content=content))
+        return link_ids
+
+    def _search(self, expression: str,
+                query_type: indexer.QueryType = indexer.QueryType.MATCH,
+                offset: int = 0) -> list[uuid.UUID]:
+        documents = self.indexer.search_documents(indexer.Query(
+            query_type=query_type, expression=expression, offset=offset))
+        return [document.link_id for document in documents]
+
+
+if __name__ == '__main__':
+    unittest.main()
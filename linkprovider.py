@@ -0,0 +1,232 @@
+"""LinkProvider."""
+
+import hashlib
+import heapq
+import math
+import uuid
+from copy import copy
+from datetime import datetime, timedelta
+from typing import Callable, Iterator, Optional, Union
+import graph
+
+
+def content_hash(content: Union[bytes, str]) -> int:
+    """ 64-bit signed fingerprint of a fetched body, for CrawlStatus
+
+    Text is hashed UTF-8 encoded, so a UTF-8 body hashes the same either way.
+    """
+    if isinstance(content, str):
+        content = content.encode()
+    digest = hashlib.blake2b(content, digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+class RecrawlPolicy:
+    """ Adapts each link's recrawl interval to its crawl outcomes
+
+    A fetch that finds the content changed halves the link's interval, one
+    that finds it unchanged grows it by growth, within [min_interval,
+    max_interval]. A failed fetch, no response or a status of 400 and up,
+    leaves the interval alone and backs off exponentially instead:
+    failure_backoff * 2 ** (failures - 1), capped at max_interval. Dead and
+    static pages thus drift to max_interval while busy pages are revisited
+    at min_interval.
+    """
+
+    def __init__(self,
+                 initial_interval: timedelta = timedelta(days=1),
+                 min_interval: timedelta = timedelta(hours=1),
+                 max_interval: timedelta = timedelta(days=30),
+                 growth: float = 1.5,
+                 failure_backoff: timedelta = timedelta(hours=1)):
+        self.initial_interval = initial_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.growth = growth
+        self.failure_backoff = failure_backoff
+
+    def record(self,
+               previous: Optional[graph.CrawlStatus],
+               link_id: uuid.UUID,
+               status_code: int,
+               fingerprint: int,
+               now: datetime) -> graph.CrawlStatus:
+        """ Returns the status after a fetch, previous is left unchanged """
+        if previous is None:
+            status = graph.CrawlStatus(link_id=link_id,
+                                       interval=self.initial_interval)
+        else:
+            status = copy(previous)
+        status.status_code = status_code
+        status.checked_at = now
+
+        if status_code == 0 or status_code >= 400:
+            status.failures += 1
+            backoff = self.failure_backoff * 2 ** min(status.failures - 1, 30)
+            status.next_due_at = now + min(backoff, self.max_interval)
+            return status
+
+        if status.fetches:
+            if fingerprint != status.content_hash:
+                status.changes += 1
+                status.interval = max(status.interval / 2, self.min_interval)
+            else:
+                status.interval = min(status.interval * self.growth,
+                                      self.max_interval)
+        status.failures = 0
+        status.fetches += 1
+        status.content_hash = fingerprint
+        status.next_due_at = now + status.interval
+        return status
+
+    def hint(self,
+             previous: Optional[graph.CrawlStatus],
+             modified_at: datetime,
+             now: datetime) -> Optional[graph.CrawlStatus]:
+        """ Reschedules a fetched link from a sitemap or feed lastmod
+
+        A modification after the last check makes the link due now, none
+        since defers it at least interval past now, so LinkProvider skips
+        pages whose lastmod has not advanced. Returns None when the link
+        was never fetched or its schedule stays the same.
+        """
+        if previous is None or not previous.fetches:
+            return None
+        if modified_at > previous.checked_at:
+            next_due_at = min(previous.next_due_at, now)
+        else:
+            next_due_at = max(previous.next_due_at, now + previous.interval)
+        if next_due_at == previous.next_due_at:
+            return None
+        status = copy(previous)
+        status.next_due_at = next_due_at
+        return status
+
+
+class CandidateScorer:
+    """ Scores a link by the expected value of crawling it now
+
+    A link never crawled scores never_crawled. A crawled one scores the
+    probability it changed since retrieved_at, 1 - exp(-rate * age days),
+    for the change rate estimate. The score is then boosted by PageRank and
+    halved per consecutive failure.
+    Without change_rate / failures callables, both come from the link's
+    CrawlStatus when it has one: one change per recrawl interval and its
+    consecutive failures.
+
+    Attributes:
+        change_rate: link -> estimated changes per day
+        pagerank: link_id -> pagerank score
+        failures: link -> consecutive failed fetches
+        default_change_rate: changes per day of links without a status
+        never_crawled: score of links without retrieved_at
+        pagerank_weight: multiplier for pagerank in the boost factor
+    """
+
+    def __init__(self,
+                 change_rate: Callable[[graph.Link], float] = None,
+                 pagerank: Callable[[uuid.UUID], float] = None,
+                 failures: Callable[[graph.Link], int] = None,
+                 never_crawled: float = 2.0,
+                 pagerank_weight: float = 1000.0,
+                 default_change_rate: float = 0.1):
+        self.change_rate = change_rate
+        self.pagerank = pagerank or (lambda link_id: 0.0)
+        self.failures = failures
+        self.never_crawled = never_crawled
+        self.pagerank_weight = pagerank_weight
+        self.default_change_rate = default_change_rate
+
+    def score(self,
+              link: graph.Link,
+              now: datetime,
+              status: graph.CrawlStatus = None) -> float:
+        if link.retrieved_at == datetime.min:
+            score = self.never_crawled
+        else:
+            age = (now - link.retrieved_at) / timedelta(days=1)
+            rate = self._change_rate(link, status)
+            score = 1.0 - math.exp(-rate * max(age, 0.0))
+        score *= 1.0 + self.pagerank_weight * self.pagerank(link.link_id)
+        return score * 0.5 ** self._failures(link, status)
+
+    def _change_rate(self, link: graph.Link, status: graph.CrawlStatus):
+        if self.change_rate is not None:
+            return self.change_rate(link)
+        if status is None or not status.interval:
+            return self.default_change_rate
+        return timedelta(days=1) / status.interval
+
+    def _failures(self, link: graph.Link, status: graph.CrawlStatus):
+        if self.failures is not None:
+            return self.failures(link)
+        return 0 if status is None else status.failures
+
+
+class LinkProvider:
+    """ Streams crawl candidates from the graph, best first per partition
+
+    Partitions of the UUID space are scanned one at a time with links_iter,
+    merged in link_id order with the partition's crawl_statuses_iter so
+    statuses are read in bulk, skipping links retrieved within min_age and
+    links whose CrawlStatus is not due yet. Each candidate is scored and
+    kept in a min-heap of at most frontier_size entries, so memory stays
+    bounded however large the graph is. Once a partition is scanned, its
+    frontier is yielded best first before the next partition is read.
+    Candidates pushed out of a full frontier wait for the next pass.
+
+    Attributes:
+        graph: link graph to scan
+        scorer: CandidateScorer
+        partitions: UUID ranges per pass, more means smaller scans between
+            yields
+        frontier_size: candidates kept per partition
+        min_age: links retrieved more recently are not candidates
+    """
+
+    def __init__(self,
+                 g: graph.Graph,
+                 scorer: CandidateScorer = None,
+                 partitions: int = 16,
+                 frontier_size: int = 10000,
+                 min_age: timedelta = timedelta(hours=1)):
+        self.graph = g
+        self.scorer = scorer or CandidateScorer()
+        self.partitions = partitions
+        self.frontier_size = frontier_size
+        self.min_age = min_age
+
+    def links(self, now: datetime = None) -> Iterator[graph.Link]:
+        """ Lazily yields one pass of candidates """
+        now = now or datetime.utcnow()
+        for from_id, to_id in graph.partition_ranges(self.partitions):
+            yield from self.partition(from_id, to_id, now)
+
+    def partition(self,
+                  from_id: uuid.UUID,
+                  to_id: uuid.UUID,
+                  now: datetime) -> list[graph.Link]:
+        """ Returns the partition's best candidates, best first """
+        frontier: list[tuple[float, int, graph.Link]] = []
+        links_iter = self.graph.links_iter(
+            from_id, to_id, retrieved_before=now - self.min_age)
+        statuses = self.graph.crawl_statuses_iter(from_id, to_id)
+        following = next(statuses, None)
+        for sequence, link in enumerate(links_iter):
+            while following is not None \
+                    and following.link_id < link.link_id:
+                following = next(statuses, None)
+            status = None
+            if following is not None and following.link_id == link.link_id:
+                status = following
+            if status is not None and status.next_due_at > now:
+                continue
+            score = self.scorer.score(link, now, status)
+            if score <= 0.0:
+                continue
+            entry = (score, sequence, link)
+            if len(frontier) < self.frontier_size:
+                heapq.heappush(frontier, entry)
+            elif entry > frontier[0]:
+                heapq.heapreplace(frontier, entry)
+        return [link for _, _, link in sorted(frontier, reverse=True)]
@@ -0,0 +1,136 @@
+"""LinkProviderTestCase"""
+
+import unittest
+import uuid
+from unittest import mock
+from datetime import datetime, timedelta
+import graph
+import linkprovider
+
+
+class LinkProviderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.g = graph.GraphInMemory()
+        self.now = datetime.utcnow()
+
+    def test_never_crawled_first_and_fresh_skipped(self):
+        old = self.g.upsert_link(graph.Link(
+            url='old', retrieved_at=self.now - timedelta(days=30)))
+        new = self.g.upsert_link(graph.Link(url='new'))
+        self.g.upsert_link(graph.Link(
+            url='fresh', retrieved_at=self.now - timedelta(minutes=1)))
+        provider = linkprovider.LinkProvider(self.g, partitions=1)
+        self.assertEqual([link.link_id for link in provider.links(self.now)],
+                         [new.link_id, old.link_id])
+
+    def test_scorer_orders_by_change_rate_and_pagerank(self):
+        retrieved_at = self.now - timedelta(days=1)
+        slow, fast, ranked = self.g.upsert_links([
+            graph.Link(url=url, retrieved_at=retrieved_at)
+            for url in ('slow', 'fast', 'ranked')])
+        scorer = linkprovider.CandidateScorer(
+            change_rate=lambda link: 2.0 if link.url == 'fast' else 0.1,
+            pagerank=lambda link_id: 0.01 if link_id == ranked.link_id else 0)
+        provider = linkprovider.LinkProvider(self.g, scorer, partitions=1)
+        self.assertEqual([link.url for link in provider.links(self.now)],
+                         ['ranked', 'fast', 'slow'])
+
+    def test_failures_back_off(self):
+        self.g.upsert_links([graph.Link(url='ok'), graph.Link(url='failing')])
+        scorer = linkprovider.CandidateScorer(
+            failures=lambda link: 3 if link.url == 'failing' else 0)
+        provider = linkprovider.LinkProvider(self.g, scorer, partitions=1)
+        self.assertEqual([link.url for link in provider.links(self.now)],
+                         ['ok', 'failing'])
+
+    def test_frontier_is_bounded_per_partition(self):
+        self.g.upsert_links([graph.Link(url=str(i)) for i in range(200)])
+        self.g.upsert_links([graph.Link(
+            url=f'old{i}', retrieved_at=self.now - timedelta(days=1))
+            for i in range(200)])
+        provider = linkprovider.LinkProvider(
+            self.g, partitions=1, frontier_size=50)
+        links = list(provider.links(self.now))
+        self.assertEqual(len(links), 50)
+        self.assertTrue(all(link.retrieved_at == datetime.min
+                            for link in links))
+
+        provider.partitions = 4
+        self.assertLessEqual(len(list(provider.links(self.now))), 200)
+
+    def test_skips_links_not_due(self):
+        due, waiting = self.g.upsert_links(
+            [graph.Link(url='due'), graph.Link(url='waiting')])
+        for link, next_due_at in ((due, self.now),
+                                  (waiting, self.now + timedelta(hours=1))):
+            self.g.upsert_crawl_status(graph.CrawlStatus(
+                link_id=link.link_id, status_code=0, failures=1,
+                checked_at=self.now, next_due_at=next_due_at))
+        provider = linkprovider.LinkProvider(self.g, partitions=2)
+        with mock.patch.object(self.g, 'find_crawl_status',
+                               side_effect=AssertionError('per link')):
+            self.assertEqual([link.url for link in provider.links(self.now)],
+                             ['due'])
+
+    def test_links_are_lazy(self):
+        self.g.upsert_links([graph.Link(url=str(i)) for i in range(100)])
+        provider = linkprovider.LinkProvider(self.g, partitions=8)
+        links = provider.links(self.now)
+        next(links)
+        self.g.upsert_link(graph.Link(url='late'))
+        self.assertGreaterEqual(len(list(links)), 99)
+
+
+class RecrawlPolicyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.policy = linkprovider.RecrawlPolicy(
+            initial_interval=timedelta(days=1),
+            min_interval=timedelta(hours=6),
+            max_interval=timedelta(days=4),
+            failure_backoff=timedelta(hours=1))
+        self.link_id = uuid.uuid4()
+        self.now = datetime.utcnow()
+
+    def test_interval_adapts_to_changes(self):
+        status = self._record(None, 200, 1)
+        self.assertEqual(status.next_due_at, self.now + timedelta(days=1))
+        status = self._record(status, 200, 1)
+        self.assertEqual(status.interval, timedelta(days=1.5))
+        for _ in range(5):
+            status = self._record(status, 200, 1)
+        self.assertEqual(status.interval, timedelta(days=4))
+
+        status = self._record(status, 200, 2)
+        self.assertEqual((status.interval, status.changes, status.fetches),
+                         (timedelta(days=2), 1, 8))
+        for content in range(3, 10):
+            status = self._record(status, 200, content)
+        self.assertEqual(status.interval, timedelta(hours=6))
+
+    def test_failures_back_off_exponentially(self):
+        status = self._record(None, 200, 1)
+        for failures, backoff in ((1, 1), (2, 2), (3, 4), (4, 8)):
+            status = self._record(status, 503, 0)
+            self.assertEqual(status.failures, failures)
+            self.assertEqual(status.next_due_at,
+                             self.now + timedelta(hours=backoff))
+        for _ in range(20):
+            status = self._record(status, 0, 0)
+        self.assertEqual(status.next_due_at, self.now + timedelta(days=4))
+
+        status = self._record(status, 200, 1)
+        self.assertEqual((status.failures, status.interval),
+                         (0, timedelta(days=1.5)))
+
+    def test_record_leaves_previous_unchanged(self):
+        previous = self._record(None, 200, 1)
+        self._record(previous, 200, 2)
+        self.assertEqual(previous.content_hash, 1)
+
+    def _record(self, previous, status_code, fingerprint):
+        return self.policy.record(
+            previous, self.link_id, status_code, fingerprint, self.now)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,396 @@
+"""Metrics."""
+
+import cProfile
+import io
+import pstats
+import random
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Iterable, Iterator
+import graph
+import indexer as idx
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = tuple[str, ...]
+
+
+class Metric:
+    """ Base for metrics, one value per combination of label values
+
+    Attributes:
+        name: metric name as exposed
+        help: one line description
+        label_names: names of the labels every sample carries
+    """
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, label_names: Iterable[str]):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values: dict[LabelValues, object] = {}
+
+    def samples(self) -> Iterator[tuple[str, LabelValues, float]]:
+        """ Yields (suffix, label values, value) """
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in sorted(values):
+            yield '', label_values, value
+
+    def _key(self, labels: dict[str, str]) -> LabelValues:
+        if labels.keys() != set(self.label_names):
+            raise ValueError(f'{self.name} takes labels {self.label_names}')
+        return tuple(str(labels[name]) for name in self.label_names)
+
+
+class Counter(Metric):
+    """ Monotonically increasing total """
+    kind = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+
+class Gauge(Metric):
+    """ Value that goes up and down """
+    kind = 'gauge'
+
+    def set(self, value: float, **labels: str):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+
+class Histogram(Metric):
+    """ Observations counted in cumulative buckets, with their sum
+
+    Attributes:
+        buckets: ascending upper bounds, +Inf is implied
+    """
+    kind = 'histogram'
+
+    def __init__(self,
+                 name: str,
+                 help: str,
+                 label_names: Iterable[str],
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket counts, +Inf last, then the sum
+                state = self._values[key] = [0] * (len(self.buckets) + 1) \
+                    + [0.0]
+            state[bisect_left(self.buckets, value)] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, **labels: str):
+        """ Observes the duration of the with block, also when it raises """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        state = self._values.get(self._key(labels))
+        return sum(state[:-1]) if state else 0
+
+    def samples(self) -> Iterator[tuple[str, LabelValues, float]]:
+        with self._lock:
+            values = [(key, list(state))
+                      for key, state in self._values.items()]
+        for label_values, state in sorted(values):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state):
+                cumulative += count
+                yield '_bucket', label_values + (_number(bound),), cumulative
+            yield '_sum', label_values, state[-1]
+            yield '_count', label_values, cumulative
+
+
+class Registry:
+    """ Named metrics, exposed together in Prometheus text format """
+
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str,
+                labels: Iterable[str] = ()) -> Counter:
+        return self._register(Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str,
+              labels: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge, name, help, labels)
+
+    def histogram(self, name: str, help: str, labels: Iterable[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help, labels, buckets)
+
+    def exposition(self) -> str:
+        """ Text exposition format 0.0.4, as served on /metrics """
+        lines = []
+        with self._lock:
+            metrics = sorted(self._metrics.values(),
+                             key=lambda metric: metric.name)
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {_escape_help(metric.help)}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            names = metric.label_names
+            for suffix, label_values, value in metric.samples():
+                label_names = names + ('le',) if suffix == '_bucket' \
+                    else names
+                lines.append(f'{metric.name}{suffix}'
+                             f'{_labels(label_names, label_values)} '
+                             f'{_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, kind: type, name: str, help: str,
+                  labels: Iterable[str], *args) -> Metric:
+        """ Returns the metric already registered under name, if any """
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = kind(name, help, labels, *args)
+            elif type(metric) is not kind \
+                    or metric.label_names != tuple(labels):
+                raise ValueError(f'{name} registered as another metric')
+            return metric
+
+
+REGISTRY = Registry()
+
+
+class StageProfiler:
+    """ Opt-in sampling profiler for pipeline stages
+
+    Profiles one in every 1 / sample_rate calls per stage with cProfile
+    and accumulates the results per stage, so the overhead on a long crawl
+    stays proportional to sample_rate.
+
+    Attributes:
+        sample_rate: fraction of calls profiled
+    """
+
+    def __init__(self, sample_rate: float = 0.01):
+        self.sample_rate = sample_rate
+        self._stats: dict[str, pstats.Stats] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def sample(self, stage: str):
+        if random.random() >= self.sample_rate:
+            yield
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # another profiler is active on this thread
+            yield
+            return
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self._lock:
+                if stage in self._stats:
+                    self._stats[stage].add(profile)
+                else:
+                    self._stats[stage] = pstats.Stats(profile)
+
+    def stages(self) -> list[str]:
+        with self._lock:
+            return sorted(self._stats)
+
+    def report(self, stage: str, limit: int = 20) -> str:
+        """ Top functions by cumulative time, KeyError if never sampled """
+        with self._lock:
+            stats = self._stats[stage]
+            stream = io.StringIO()
+            stats.stream = stream
+            stats.sort_stats('cumulative').print_stats(limit)
+        return stream.getvalue()
+
+
+class InstrumentedGraph(graph.Graph):
+    """ Times every call to the wrapped graph in graph_operation_seconds
+
+    Iterators are timed from creation until exhausted or closed.
+    export_csr is only present when the wrapped graph has it, so
+    pagerank.export_snapshot keeps using the native export.
+    """
+
+    def __init__(self, g: graph.Graph, registry: Registry = REGISTRY):
+        self.graph = g
+        self.seconds = registry.histogram(
+            'graph_operation_seconds', 'Graph call latency', ('operation',))
+
+    @property
+    def export_csr(self) -> Callable[[str], None]:
+        export_csr = self.graph.export_csr   # AttributeError if unsupported
+
+        def timed_export_csr(path: str):
+            with self.seconds.time(operation='export_csr'):
+                export_csr(path)
+        return timed_export_csr
+
+    def upsert_link(self, link: graph.Link) -> graph.Link:
+        with self.seconds.time(operation='upsert_link'):
+            return self.graph.upsert_link(link)
+
+    def upsert_links(self, links: list[graph.Link]) -> list[graph.Link]:
+        with self.seconds.time(operation='upsert_links'):
+            return self.graph.upsert_links(links)
+
+    def find_link(self, link_id: uuid.UUID) -> graph.Link:
+        with self.seconds.time(operation='find_link'):
+            return self.graph.find_link(link_id)
+
+    def links_iter(self,
+                   from_id: uuid.UUID,
+                   to_id: uuid.UUID,
+                   retrieved_before: datetime) -> Iterator[graph.Link]:
+        return _timed_iter(self.seconds, 'links_iter', self.graph.links_iter,
+                           from_id, to_id, retrieved_before)
+
+    def upsert_edge(self, edge: graph.Edge) -> graph.Edge:
+        with self.seconds.time(operation='upsert_edge'):
+            return self.graph.upsert_edge(edge)
+
+    def edges_iter(self,
+                   from_id: uuid.UUID,
+                   to_id: uuid.UUID,
+                   updated_before: datetime) -> Iterator[graph.Edge]:
+        return _timed_iter(self.seconds, 'edges_iter', self.graph.edges_iter,
+                           from_id, to_id, updated_before)
+
+    def remove_stale_edges(self,
+                           from_id: uuid.UUID,
+                           deletion_treshold: datetime):
+        with self.seconds.time(operation='remove_stale_edges'):
+            self.graph.remove_stale_edges(from_id, deletion_treshold)
+
+    def find_crawl_status(self, link_id: uuid.UUID) -> graph.CrawlStatus:
+        with self.seconds.time(operation='find_crawl_status'):
+            return self.graph.find_crawl_status(link_id)
+
+    def crawl_statuses_iter(self,
+                            from_id: uuid.UUID,
+                            to_id: uuid.UUID) -> Iterator[graph.CrawlStatus]:
+        return _timed_iter(self.seconds, 'crawl_statuses_iter',
+                           self.graph.crawl_statuses_iter, from_id, to_id)
+
+    def upsert_crawl_status(self,
+                            status: graph.CrawlStatus) -> graph.CrawlStatus:
+        with self.seconds.time(operation='upsert_crawl_status'):
+            return self.graph.upsert_crawl_status(status)
+
+
+class InstrumentedIndexer(idx.Indexer):
+    """ Times every call to the wrapped indexer in
+        indexer_operation_seconds, search_documents until exhausted
+    """
+
+    def __init__(self, indexer: idx.Indexer, registry: Registry = REGISTRY):
+        self.indexer = indexer
+        self.seconds = registry.histogram(
+            'indexer_operation_seconds', 'Indexer call latency',
+            ('operation',))
+
+    def upsert_document_index(self, document: idx.Document) -> idx.Document:
+        with self.seconds.time(operation='upsert_document_index'):
+            return self.indexer.upsert_document_index(document)
+
+    def find_document_by_link_id(self, link_id: uuid.UUID) -> idx.Document:
+        with self.seconds.time(operation='find_document_by_link_id'):
+            return self.indexer.find_document_by_link_id(link_id)
+
+    def search_documents(self, query: idx.Query) -> Iterator[idx.Document]:
+        return _timed_iter(self.seconds, 'search_documents',
+                           self.indexer.search_documents, query)
+
+    def update_pagerank_score(self,
+                              link_id: uuid.UUID,
+                              pagerank_score: float):
+        with self.seconds.time(operation='update_pagerank_score'):
+            self.indexer.update_pagerank_score(link_id, pagerank_score)
+
+    def update_pagerank_scores(self,
+                               scores: Iterable[tuple[uuid.UUID, float]]):
+        with self.seconds.time(operation='update_pagerank_scores'):
+            self.indexer.update_pagerank_scores(scores)
+
+
+def _timed_iter(seconds: Histogram, operation: str, function,
+                *args) -> Iterator:
+    """ Calls function(*args) now, so its iterator is created at call time,
+        and times it until the iterator is exhausted or closed
+    """
+    start = time.perf_counter()
+    try:
+        iterator = function(*args)
+    except BaseException:
+        seconds.observe(time.perf_counter() - start, operation=operation)
+        raise
+    return _timed(seconds, operation, start, iterator)
+
+
+def _timed(seconds: Histogram, operation: str, start: float,
+           iterator: Iterator) -> Iterator:
+    try:
+        yield from iterator
+    finally:
+        seconds.observe(time.perf_counter() - start, operation=operation)
+
+
+def _labels(names: LabelValues, values: LabelValues) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape_label(value)}"'
+                     for name, value in zip(names, values))
+    return f'{{{pairs}}}'
+
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"') \
+        .replace('\n', r'\n')
+
+
+def _escape_help(value: str) -> str:
+    return value.replace('\\', r'\\').replace('\n', r'\n')
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if value == float('-inf'):
+        return '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
@@ -0,0 +1,108 @@
+"""MetricsTestCase"""
+
+import os
+import tempfile
+import time
+import unittest
+import uuid
+from datetime import datetime
+import graph
+import graph_sqlite
+import indexer
+import metrics
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_exposition(self):
+        counter = self.registry.counter('requests_total', 'Requests',
+                                        ('code',))
+        counter.inc(code='200')
+        counter.inc(2, code='5"0\n0')
+        gauge = self.registry.gauge('in_flight', 'In flight')
+        gauge.inc(3)
+        gauge.dec()
+        histogram = self.registry.histogram('latency_seconds', 'Latency',
+                                            buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+        self.assertEqual(self.registry.exposition(), '\n'.join([
+            '# HELP in_flight In flight',
+            '# TYPE in_flight gauge',
+            'in_flight 2.0',
+            '# HELP latency_seconds Latency',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{le="0.1"} 2',
+            'latency_seconds_bucket{le="1.0"} 3',
+            'latency_seconds_bucket{le="+Inf"} 4',
+            'latency_seconds_sum 2.65',
+            'latency_seconds_count 4',
+            '# HELP requests_total Requests',
+            '# TYPE requests_total counter',
+            'requests_total{code="200"} 1.0',
+            'requests_total{code="5\\"0\\n0"} 2.0',
+        ]) + '\n')
+
+    def test_registration(self):
+        counter = self.registry.counter('total', 'Total', ('stage',))
+        self.assertIs(self.registry.counter('total', 'Total', ('stage',)),
+                      counter)
+        self.assertRaises(ValueError, self.registry.gauge, 'total', 'Total',
+                          ('stage',))
+        self.assertRaises(ValueError, counter.inc, outcome='x')
+
+    def test_histogram_time(self):
+        histogram = self.registry.histogram('seconds', 'Seconds', ('op',))
+        with self.assertRaises(RuntimeError):
+            with histogram.time(op='fail'):
+                raise RuntimeError()
+        self.assertEqual(histogram.count(op='fail'), 1)
+
+    def test_stage_profiler(self):
+        profiler = metrics.StageProfiler(sample_rate=1.0)
+        with profiler.sample('Sleeper'):
+            time.sleep(0.001)
+        self.assertEqual(profiler.stages(), ['Sleeper'])
+        self.assertIn('sleep', profiler.report('Sleeper'))
+        self.assertRaises(KeyError, profiler.report, 'Other')
+
+    def test_instrumented_graph_and_indexer(self):
+        g = metrics.InstrumentedGraph(graph.GraphInMemory(), self.registry)
+        link = g.upsert_link(graph.Link(url='http://a.com'))
+        list(g.links_iter(uuid.UUID(int=0), uuid.UUID(int=(1 << 128) - 1),
+                          datetime.max))
+        self.assertEqual(g.seconds.count(operation='upsert_link'), 1)
+        self.assertEqual(g.seconds.count(operation='links_iter'), 1)
+
+        # The wrapped iterator is created at call time, so links upserted
+        # before the first next() are outside its snapshot
+        links = g.links_iter(uuid.UUID(int=0), uuid.UUID(int=(1 << 128) - 1),
+                             datetime.max)
+        g.upsert_link(graph.Link(url='http://b.com'))
+        self.assertEqual(list(links), [link])
+
+        with tempfile.TemporaryDirectory() as directory:
+            g.export_csr(os.path.join(directory, 'graph.csr'))
+        self.assertEqual(g.seconds.count(operation='export_csr'), 1)
+        with tempfile.TemporaryDirectory() as directory:
+            sqlite = graph_sqlite.GraphSQLite(
+                os.path.join(directory, 'graph.db'))
+            self.assertFalse(hasattr(
+                metrics.InstrumentedGraph(sqlite, self.registry),
+                'export_csr'))
+            sqlite.close()
+
+        index = metrics.InstrumentedIndexer(indexer.IndexerInMemory(),
+                                            self.registry)
+        index.upsert_document_index(indexer.Document(
+            link_id=link.link_id, title='example'))
+        self.assertEqual(len(list(index.search_documents(
+            indexer.Query(expression='example')))), 1)
+        self.assertEqual(
+            index.seconds.count(operation='search_documents'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
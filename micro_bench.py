@@ -0,0 +1,231 @@
+"""Micro-benchmarks for the GraphInMemory and IndexerInMemory hot paths.
+
+    python micro_bench.py --scales 10000,100000 --json run.json
+    python micro_bench.py --scales 10000,100000 --compare run.json
+"""
+
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+from itertools import islice
+from typing import Callable
+import graph
+import indexer
+
+_MIN_ID = uuid.UUID(int=0)
+_MAX_ID = uuid.UUID(int=(1 << 128) - 1)
+_STALE_EDGES = 8       # edges remove_stale_edges drops per sample
+
+
+def measure(operation: Callable[[int], None], samples: int,
+            setup: Callable[[int], None] = None) -> dict:
+    """ Times operation(i) for i in range(samples) one call at a time
+
+    setup(i), when given, runs untimed before each operation(i).
+    """
+    latencies = []
+    for i in range(samples):
+        if setup is not None:
+            setup(i)
+        begin = time.perf_counter_ns()
+        operation(i)
+        latencies.append(time.perf_counter_ns() - begin)
+    elapsed = sum(latencies) / 1e9
+    latencies.sort()
+    return {
+        'ops': samples,
+        'ops_per_second': round(samples / elapsed, 1),
+        'p50_us': _percentile(latencies, 0.50),
+        'p90_us': _percentile(latencies, 0.90),
+        'p99_us': _percentile(latencies, 0.99),
+    }
+
+
+def populate(build: Callable[[], object], trace_memory: bool) -> tuple:
+    """ Returns build()'s result and the bytes it allocated, 0 untraced """
+    if not trace_memory:
+        return build(), 0
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        built = build()
+        return built, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+def bench_graph(scale: int, samples: int, seed: int,
+                trace_memory: bool) -> tuple[dict, list[dict]]:
+    rng = random.Random(seed)
+
+    def build():
+        g = graph.GraphInMemory()
+        links = [g.upsert_link(graph.Link(url=f'http://{i}.example'))
+                 for i in range(scale)]
+        for link in links:
+            dst = links[rng.randrange(scale)]
+            g.upsert_edge(graph.Edge(src=link.link_id, dst=dst.link_id))
+        return g, [link.link_id for link in links]
+
+    (g, link_ids), allocated = populate(build, trace_memory)
+    per_item = allocated / (2 * scale)      # a link and an edge per item
+    sources = [rng.choice(link_ids) for _ in range(samples)]
+    targets = [rng.choice(link_ids) for _ in range(samples)]
+    starts = [uuid.UUID(int=rng.getrandbits(128)) for _ in range(samples)]
+    fanout = [[rng.choice(link_ids) for _ in range(_STALE_EDGES)]
+              for _ in range(samples)]
+
+    def add_stale_edges(i: int):
+        for dst in fanout[i]:
+            g.upsert_edge(graph.Edge(src=sources[i], dst=dst))
+
+    results = {
+        'upsert_link': measure(lambda i: g.upsert_link(
+            graph.Link(url=f'http://new{i}.example')), samples),
+        'upsert_edge': measure(lambda i: g.upsert_edge(
+            graph.Edge(src=sources[i], dst=targets[i])), samples),
+        'links_iter_1000': measure(lambda i: sum(1 for _ in islice(
+            g.links_iter(starts[i], _MAX_ID, datetime.max), 1000)),
+            max(1, samples // 10)),
+        # every sample removes the edges its untimed setup just added
+        'remove_stale_edges': measure(lambda i: g.remove_stale_edges(
+            sources[i], datetime.max), samples, add_stale_edges),
+    }
+    return (_memory('graph', scale, per_item),
+            [_record('graph', operation, scale, result)
+             for operation, result in results.items()])
+
+
+def bench_indexer(scale: int, samples: int, seed: int,
+                  trace_memory: bool) -> tuple[dict, list[dict]]:
+    rng = random.Random(seed)
+    vocabulary = [f'w{i}' for i in range(max(1000, scale // 10))]
+    # Zipf-like term frequencies, as in natural text
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+
+    def document(link_id: uuid.UUID) -> indexer.Document:
+        words = rng.choices(vocabulary, weights, k=50)
+        return indexer.Document(link_id=link_id, url=f'http://{link_id}',
+                                title=' '.join(words[:5]),
+                                content=' '.join(words[5:]))
+
+    def build():
+        index = indexer.IndexerInMemory()
+        link_ids = [uuid.UUID(int=rng.getrandbits(128)) for _ in range(scale)]
+        for link_id in link_ids:
+            index.upsert_document_index(document(link_id))
+        return index, link_ids
+
+    (index, link_ids), allocated = populate(build, trace_memory)
+    per_item = allocated / scale
+    new_documents = [document(uuid.uuid4()) for _ in range(samples)]
+    updated = [document(rng.choice(link_ids)) for _ in range(samples)]
+    queries = [indexer.Query(expression=rng.choice(vocabulary[:100]))
+               for _ in range(samples)]
+    scored = [rng.choice(link_ids) for _ in range(samples)]
+    # Updates walk the whole token index today, keep them few
+    slow_samples = max(1, samples // 10)
+    results = {
+        'upsert_document_index_new': measure(
+            lambda i: index.upsert_document_index(new_documents[i]),
+            samples),
+        'upsert_document_index_update': measure(
+            lambda i: index.upsert_document_index(updated[i]), slow_samples),
+        'search_documents_top10': measure(lambda i: list(islice(
+            index.search_documents(queries[i]), 10)), samples),
+        'update_pagerank_score': measure(
+            lambda i: index.update_pagerank_score(scored[i], rng.random()),
+            slow_samples),
+    }
+    return (_memory('indexer', scale, per_item),
+            [_record('indexer', operation, scale, result)
+             for operation, result in results.items()])
+
+
+def compare(current: list[dict], baseline: list[dict],
+            tolerance: float) -> list[str]:
+    """ Operations whose ops/s fell more than tolerance below baseline """
+    previous = {(record['suite'], record['operation'], record['scale']):
+                record for record in baseline}
+    regressions = []
+    for record in current:
+        key = (record['suite'], record['operation'], record['scale'])
+        if key not in previous:
+            continue
+        ratio = record['ops_per_second'] / previous[key]['ops_per_second']
+        if ratio < 1 - tolerance:
+            regressions.append(f'{key[0]}.{key[1]}@{key[2]}: '
+                               f'{ratio:.2f}x baseline ops/s')
+    return regressions
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', default='10000,100000',
+                        help='comma separated item counts, up to 10000000')
+    parser.add_argument('--samples', type=int, default=1000,
+                        help='timed operations per benchmark')
+    parser.add_argument('--suites', default='graph,indexer')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip tracemalloc, which slows population')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', help='results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    suites = {'graph': bench_graph, 'indexer': bench_indexer}
+    records, memory = [], []
+    for scale in (int(scale) for scale in args.scales.split(',')):
+        for name in args.suites.split(','):
+            populated, results = suites[name](scale, args.samples, args.seed,
+                                              not args.no_memory)
+            memory.append(populated)
+            print(f'{name:8} {"populate":30} {scale:>9} '
+                  f'{populated["bytes_per_item"]:>8.1f} B/item')
+            for record in results:
+                records.append(record)
+                print(f'{name:8} {record["operation"]:30} '
+                      f'{scale:>9} {record["ops_per_second"]:>12.1f} ops/s '
+                      f'p99 {record["p99_us"]:>10.1f} us')
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'python': platform.python_version(),
+                       'seed': args.seed,
+                       'samples': args.samples,
+                       'memory': memory,
+                       'results': records}, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(records, json.load(file)['results'],
+                                  args.tolerance)
+        for regression in regressions:
+            print(f'regression: {regression}', file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+def _record(suite: str, operation: str, scale: int, result: dict) -> dict:
+    return {'suite': suite, 'operation': operation, 'scale': scale, **result}
+
+
+def _memory(suite: str, scale: int, per_item: float) -> dict:
+    """ Bytes allocated per item while populating a suite, 0 untraced """
+    return {'suite': suite, 'scale': scale,
+            'bytes_per_item': round(per_item, 1)}
+
+
+def _percentile(latencies: list[int], quantile: float) -> float:
+    index = min(len(latencies) - 1, int(quantile * len(latencies)))
+    return round(latencies[index] / 1000, 2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,433 @@
+"""PageRank."""
+
+import multiprocessing
+import os
+import tempfile
+import uuid
+from array import array
+from datetime import datetime
+from multiprocessing.shared_memory import SharedMemory
+from threading import BrokenBarrierError
+from typing import Iterator
+import numpy as np
+import graph
+import graph_csr
+import indexer as idx
+
+MIN_ID = uuid.UUID(int=0)
+MAX_ID = uuid.UUID(int=(1 << 128) - 1)
+
+
+def export_snapshot(g: graph.Graph, path: str):
+    """ Writes a graph_csr snapshot of g, natively when the backend can """
+    if hasattr(g, 'export_csr'):
+        g.export_csr(path)
+        return
+    link_ids = sorted(link.link_id
+                      for link in g.links_iter(MIN_ID, MAX_ID, datetime.max))
+    rows = {link_id: row for row, link_id in enumerate(link_ids)}
+    sources, targets = array('i'), array('i')
+    for edge in g.edges_iter(MIN_ID, MAX_ID, datetime.max):
+        if edge.src in rows and edge.dst in rows:
+            sources.append(rows[edge.src])
+            targets.append(rows[edge.dst])
+    order = np.argsort(np.frombuffer(sources, dtype=np.int32), kind='stable')
+    offsets = np.zeros(len(link_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(np.frombuffer(sources, dtype=np.int32),
+                          minlength=len(link_ids)), out=offsets[1:])
+    graph_csr.write_csr(
+        path,
+        b''.join(link_id.bytes for link_id in link_ids),
+        array('q', offsets.tobytes()),
+        array('i', np.frombuffer(targets, dtype=np.int32)[order].tobytes()))
+
+
+def csr_arrays(snapshot: graph_csr.CSRSnapshot) -> tuple:
+    """ Zero-copy numpy views of the snapshot's offsets and targets """
+    return (np.frombuffer(snapshot.offsets, dtype=np.int64),
+            np.frombuffer(snapshot.targets, dtype=np.int32))
+
+
+def power_iteration(offsets: np.ndarray,
+                    targets: np.ndarray,
+                    damping: float,
+                    tolerance: float,
+                    max_iterations: int,
+                    initial: np.ndarray = None) -> tuple[np.ndarray, int]:
+    """ Iterates x = d * (M x + dangling mass / n) + (1 - d) / n
+
+    Each step is one sparse matrix-vector product, done as a weighted
+    bincount over the edge targets. Dangling links spread their score
+    uniformly. Stops once the L1 change drops below tolerance.
+
+    Returns:
+        scores summing to 1 per row, iterations run
+    """
+    count = len(offsets) - 1
+    if count == 0:
+        return np.zeros(0), 0
+    out_degree = np.diff(offsets)
+    sources = np.repeat(np.arange(count, dtype=np.int32), out_degree)
+    dangling = out_degree == 0
+    inverse_degree = np.divide(1.0, out_degree,
+                               out=np.zeros(count), where=~dangling)
+    if initial is None:
+        scores = np.full(count, 1.0 / count)
+    else:
+        scores = initial / initial.sum()
+    teleport = (1.0 - damping) / count
+
+    for iteration in range(1, max_iterations + 1):
+        contributions = (scores * inverse_degree)[sources]
+        updated = damping * np.bincount(
+            targets, weights=contributions, minlength=count)
+        updated += teleport + damping * scores[dangling].sum() / count
+        delta = np.abs(updated - scores).sum()
+        scores = updated
+        if delta < tolerance:
+            break
+    return scores, iteration
+
+
+class PagerankCalculator:
+    """ Computes PageRank over graph_csr snapshots and updates the indexer
+
+    With partitions > 1 the UUID space is split into that many ranges, which
+    are contiguous snapshot rows, and each range runs in its own process in
+    bulk-synchronous supersteps (see _partition_worker).
+
+    Attributes:
+        damping: probability of following a link rather than teleporting
+        tolerance: L1 change between iterations that counts as converged
+        max_iterations: upper bound on power iterations
+        partitions: worker processes, 1 computes in this process
+        barrier_timeout: seconds a superstep may wait on a worker
+        iterations: iterations used by the last calculation
+    """
+
+    def __init__(self,
+                 damping: float = 0.85,
+                 tolerance: float = 1e-6,
+                 max_iterations: int = 100,
+                 partitions: int = 1,
+                 barrier_timeout: float = 600.0):
+        self.damping = damping
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+        self.partitions = partitions
+        self.barrier_timeout = barrier_timeout
+        self.iterations = 0
+
+    def calculate(self,
+                  snapshot: graph_csr.CSRSnapshot,
+                  initial: np.ndarray = None) -> np.ndarray:
+        """ Returns scores indexed by snapshot row, starting from initial """
+        if self.partitions > 1 and snapshot.link_count:
+            return self._calculate_partitioned(snapshot, initial)
+        offsets, targets = csr_arrays(snapshot)
+        scores, self.iterations = power_iteration(
+            offsets, targets,
+            self.damping, self.tolerance, self.max_iterations, initial)
+        return scores
+
+    def _calculate_partitioned(self,
+                               snapshot: graph_csr.CSRSnapshot,
+                               initial: np.ndarray = None) -> np.ndarray:
+        """ Coordinates supersteps and aggregates convergence at a barrier
+
+        Shared memory holds the control words, per-partition stats and two
+        score vectors; workers write their rows of one vector while reading
+        the other, which is how contributions cross partitions.
+        """
+        count, partitions = snapshot.link_count, self.partitions
+        rows = [snapshot.lower_bound(from_id)
+                for from_id, _ in graph.partition_ranges(partitions)]
+        rows.append(count)
+        offsets, _ = csr_arrays(snapshot)
+        dangling = np.diff(offsets) == 0
+        del offsets
+
+        memory = SharedMemory(create=True,
+                              size=8 * (_CONTROL + 2 * partitions + 2 * count))
+        context = multiprocessing.get_context()
+        barrier = context.Barrier(partitions + 1, timeout=self.barrier_timeout)
+        workers = [context.Process(
+            target=_partition_worker,
+            args=(snapshot.path, memory.name, partition, partitions,
+                  rows[partition], rows[partition + 1], self.damping, barrier),
+            daemon=True) for partition in range(partitions)]
+        control, stats, scores = _shared_arrays(memory, partitions, count)
+        try:
+            scores[0] = 1.0 / count if initial is None \
+                else initial / initial.sum()
+            control[_DANGLING] = scores[0][dangling].sum()
+            control[_STATE] = _RUNNING
+            for worker in workers:
+                worker.start()
+            current, iteration = 0, 0
+            while control[_STATE] == _RUNNING:
+                barrier.wait()      # workers wrote scores[1 - current]
+                current, iteration = 1 - current, iteration + 1
+                control[_DANGLING] = stats[:, _DANGLING].sum()
+                if stats[:, _DELTA].sum() < self.tolerance \
+                        or iteration == self.max_iterations:
+                    control[_STATE] = _DONE
+                barrier.wait()      # workers read control
+            self.iterations = iteration
+            for worker in workers:
+                worker.join()
+            return scores[current].copy()
+        except BrokenBarrierError as error:
+            raise RuntimeError('pagerank partition worker failed') from error
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+            del control, stats, scores
+            memory.close()
+            memory.unlink()
+
+    def run(self,
+            g: graph.Graph,
+            indexer: idx.Indexer,
+            directory: str = None) -> np.ndarray:
+        """ Snapshots g into directory, pushes all scores to indexer """
+        with tempfile.TemporaryDirectory(dir=directory) as workdir:
+            path = os.path.join(workdir, 'graph.csr')
+            export_snapshot(g, path)
+            with graph_csr.CSRSnapshot(path) as snapshot:
+                scores = self.calculate(snapshot)
+                indexer.update_pagerank_scores(
+                    zip(link_ids(snapshot), scores.tolist()))
+        return scores
+
+
+class IncrementalPagerankCalculator(PagerankCalculator):
+    """ Updates the previous run's scores after a crawl delta
+
+    The previous snapshot's ids, edges and scores are kept between runs.
+    The next snapshot is diffed against them by link id to find sources
+    whose outgoing edges changed, plus links that were added or removed.
+    Starting from the previous scores, the residual of the new system is
+    only nonzero next to those changes. It is pushed along out-edges in
+    vectorized rounds that touch only rows still holding residual above
+    tolerance / links. Residual that spreads uniformly, from teleport and
+    dangling links, only rescales the solution and is dropped before the
+    final normalization. Deltas touching more than full_fraction of the
+    links fall back to power iteration warm started from the old scores.
+
+    Attributes:
+        full_fraction: changed-link fraction above which to recompute
+        changed_links: links with changed out-edges in the last run
+    """
+
+    def __init__(self,
+                 damping: float = 0.85,
+                 tolerance: float = 1e-6,
+                 max_iterations: int = 100,
+                 partitions: int = 1,
+                 barrier_timeout: float = 600.0,
+                 full_fraction: float = 0.1):
+        super().__init__(damping, tolerance, max_iterations,
+                         partitions, barrier_timeout)
+        self.full_fraction = full_fraction
+        self.changed_links = 0
+        self._previous = None
+
+    def calculate(self,
+                  snapshot: graph_csr.CSRSnapshot,
+                  initial: np.ndarray = None) -> np.ndarray:
+        offsets, targets = csr_arrays(snapshot)
+        ids = np.frombuffer(snapshot.link_ids, dtype='S16')
+        if self._previous is None or initial is not None \
+                or not snapshot.link_count:
+            self.changed_links = snapshot.link_count
+            scores = super().calculate(snapshot, initial)
+        else:
+            scores = self._update(snapshot, ids, offsets, targets)
+        self._previous = (ids.copy(), offsets.copy(), targets.copy(), scores)
+        return scores
+
+    def _update(self,
+                snapshot: graph_csr.CSRSnapshot,
+                ids: np.ndarray,
+                offsets: np.ndarray,
+                targets: np.ndarray) -> np.ndarray:
+        old_ids, old_offsets, old_targets, old_scores = self._previous
+        count, old_count = len(ids), len(old_ids)
+        damping = self.damping
+        old_row = _match_rows(ids, old_ids)
+        new_row = _match_rows(old_ids, ids)
+        added = old_row < 0
+        scores = np.zeros(count)
+        scores[~added] = old_scores[old_row[~added]]
+
+        # Diff edge sets as src * count + dst keys in new row space
+        degree, old_degree = np.diff(offsets), np.diff(old_offsets)
+        keys = np.repeat(np.arange(count, dtype=np.int64), degree) * count \
+            + targets
+        old_src = new_row[np.repeat(np.arange(old_count), old_degree)]
+        old_dst = new_row[old_targets]
+        kept = (old_src >= 0) & (old_dst >= 0)
+        changed = np.zeros(count, dtype=bool)
+        changed[np.setxor1d(keys, old_src[kept] * count + old_dst[kept])
+                // count] = True
+        changed[old_src[~kept & (old_src >= 0)]] = True
+        changed |= added
+        self.changed_links = int(changed.sum())
+        if self.changed_links > self.full_fraction * count:
+            initial = scores.copy()
+            initial[added] = 1.0 / count
+            return super().calculate(snapshot, initial)
+
+        # Local residual: new minus old contributions of changed sources,
+        # plus the old per-link base score for links that are new
+        old_changed = np.flatnonzero((new_row < 0) | changed[new_row])
+        residual = damping * (
+            _spread(offsets, targets, np.flatnonzero(changed),
+                    scores, count)
+            - _spread(old_offsets, old_targets, old_changed,
+                      old_scores, count, new_row))
+        old_dangling = old_scores[old_degree == 0].sum()
+        residual[added] += ((1.0 - damping) + damping * old_dangling) \
+            / old_count
+
+        threshold = self.tolerance / count
+        self.iterations = 0
+        while self.iterations < self.max_iterations:
+            active = np.flatnonzero(np.abs(residual) > threshold)
+            if not len(active):
+                break
+            self.iterations += 1
+            pushed = residual[active]
+            residual[active] = 0.0
+            scores[active] += pushed
+            residual += damping * _spread(
+                offsets, targets, active, pushed, count, dense=False)
+        return scores / scores.sum()
+
+
+def _match_rows(ids: np.ndarray, other_ids: np.ndarray) -> np.ndarray:
+    """ Row in sorted other_ids of each of ids, -1 where missing """
+    if not len(other_ids):
+        return np.full(len(ids), -1)
+    rows = np.minimum(np.searchsorted(other_ids, ids), len(other_ids) - 1)
+    return np.where(other_ids[rows] == ids, rows, -1)
+
+
+def _spread(offsets: np.ndarray,
+            targets: np.ndarray,
+            rows: np.ndarray,
+            values: np.ndarray,
+            size: int,
+            mapping: np.ndarray = None,
+            dense: bool = True) -> np.ndarray:
+    """ Sums value / out-degree of each of rows onto its out-neighbours
+
+    values is indexed by row, or by position in rows when dense is False.
+    Targets are translated through mapping when given, dropping those that
+    map to -1. Returns an array of size sums.
+    """
+    starts = offsets[rows]
+    lengths = offsets[rows + 1] - starts
+    owner = np.repeat(np.arange(len(rows)), lengths)
+    positions = np.arange(lengths.sum()) \
+        - np.repeat(np.cumsum(lengths) - lengths, lengths) \
+        + np.repeat(starts, lengths)
+    shares = (values[rows] if dense else values) / np.maximum(lengths, 1)
+    destinations, weights = targets[positions], shares[owner]
+    if mapping is not None:
+        destinations = mapping[destinations]
+        weights = weights[destinations >= 0]
+        destinations = destinations[destinations >= 0]
+    return np.bincount(destinations, weights=weights, minlength=size)
+
+
+# Shared memory layout, as float64: control words, then stats per partition,
+# then two score vectors of link_count
+_CONTROL = 2
+_STATE, _DANGLING = 0, 1
+_DELTA = 0
+_RUNNING, _DONE = 0.0, 1.0
+
+
+def _shared_arrays(memory: SharedMemory,
+                   partitions: int,
+                   count: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    buffer = np.ndarray(_CONTROL + 2 * partitions + 2 * count,
+                        dtype=np.float64, buffer=memory.buf)
+    return (buffer[:_CONTROL],
+            buffer[_CONTROL:_CONTROL + 2 * partitions].reshape(partitions, 2),
+            buffer[_CONTROL + 2 * partitions:].reshape(2, count))
+
+
+def _partition_worker(path: str,
+                      memory_name: str,
+                      partition: int,
+                      partitions: int,
+                      lower: int,
+                      upper: int,
+                      damping: float,
+                      barrier):
+    """ Runs supersteps for snapshot rows lower <= row < upper
+
+    Each superstep pulls contributions from all in-edges of the partition's
+    rows out of the current score vector, writes the partition's rows of
+    the next one along with its L1 delta and dangling mass, then waits at
+    the barrier for the coordinator's verdict.
+    """
+    try:
+        _superstep_loop(path, memory_name, partition, partitions,
+                        lower, upper, damping, barrier)
+    except BaseException:
+        barrier.abort()
+        raise
+
+
+def _superstep_loop(path: str,
+                    memory_name: str,
+                    partition: int,
+                    partitions: int,
+                    lower: int,
+                    upper: int,
+                    damping: float,
+                    barrier):
+    memory = SharedMemory(name=memory_name)
+    with graph_csr.CSRSnapshot(path) as snapshot:
+        count = snapshot.link_count
+        offsets, targets = csr_arrays(snapshot)
+        out_degree = np.diff(offsets)
+        inverse_degree = np.divide(1.0, out_degree, out=np.zeros(count),
+                                   where=out_degree > 0)
+        dangling = out_degree[lower:upper] == 0
+        inbound = (targets >= lower) & (targets < upper)
+        sources = np.repeat(np.arange(count, dtype=np.int32),
+                            out_degree)[inbound]
+        local_targets = targets[inbound] - lower
+        del offsets, targets, out_degree, inbound
+    control, stats, scores = _shared_arrays(memory, partitions, count)
+    teleport = (1.0 - damping) / count
+    current = 0
+    try:
+        while True:
+            updated = damping * np.bincount(
+                local_targets,
+                weights=(scores[current] * inverse_degree)[sources],
+                minlength=upper - lower)
+            updated += teleport + damping * control[_DANGLING] / count
+            stats[partition, _DELTA] = np.abs(
+                updated - scores[current][lower:upper]).sum()
+            stats[partition, _DANGLING] = updated[dangling].sum()
+            scores[1 - current][lower:upper] = updated
+            current = 1 - current
+            barrier.wait()
+            barrier.wait()
+            if control[_STATE] == _DONE:
+                return
+    finally:
+        del control, stats, scores
+        memory.close()
+
+
+def link_ids(snapshot: graph_csr.CSRSnapshot) -> Iterator[uuid.UUID]:
+    return (snapshot.link_id(row) for row in range(snapshot.link_count))
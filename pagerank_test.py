@@ -0,0 +1,162 @@
+"""PagerankTestCase"""
+
+import os
+import random
+import tempfile
+import unittest
+from datetime import datetime
+import graph
+import graph_csr
+import graph_sqlite
+import indexer
+import pagerank
+
+
+def reference_pagerank(adjacency: dict, damping: float = 0.85):
+    """ Plain per-edge power iteration, the vectorized one must match """
+    nodes = sorted(adjacency)
+    scores = {node: 1 / len(nodes) for node in nodes}
+    for _ in range(200):
+        dangling = sum(scores[node] for node in nodes if not adjacency[node])
+        updated = {node: (1 - damping) / len(nodes)
+                   + damping * dangling / len(nodes) for node in nodes}
+        for node in nodes:
+            for dst in adjacency[node]:
+                updated[dst] += damping * scores[node] / len(adjacency[node])
+        scores = updated
+    return scores
+
+
+class PagerankTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'graph.csr')
+        self.g = graph.GraphInMemory()
+        self.sut = pagerank.PagerankCalculator(tolerance=1e-10)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_cycle_is_uniform(self):
+        links = self._links(4)
+        for i, src in enumerate(links):
+            self._edge(src, links[(i + 1) % 4])
+        scores = self._calculate()
+        self.assertTrue(all(abs(score - 0.25) < 1e-9
+                            for score in scores.values()))
+
+    def test_matches_reference_with_dangling_links(self):
+        rng = random.Random(7)
+        links = self._links(30)
+        adjacency = {link.link_id: set() for link in links}
+        for src in links[:25]:
+            for dst in rng.sample(links, 4):
+                self._edge(src, dst)
+                adjacency[src.link_id].add(dst.link_id)
+        expected = reference_pagerank(adjacency)
+        scores = self._calculate()
+        self.assertAlmostEqual(sum(scores.values()), 1.0)
+        for link_id, score in expected.items():
+            self.assertAlmostEqual(scores[link_id], score, places=8)
+
+    def test_partitioned_matches_single_process(self):
+        rng = random.Random(11)
+        links = self._links(200)
+        for src in links[:180]:
+            for dst in rng.sample(links, 5):
+                self._edge(src, dst)
+        expected = self._calculate()
+        self.sut = pagerank.PagerankCalculator(tolerance=1e-10, partitions=3)
+        scores = self._calculate()
+        self.assertGreater(self.sut.iterations, 1)
+        for link_id, score in expected.items():
+            self.assertAlmostEqual(scores[link_id], score, places=9)
+
+    def test_incremental_matches_full_recompute(self):
+        rng = random.Random(5)
+        links = self._links(300)
+        for src in links[:280]:
+            for dst in rng.sample(links, 4):
+                self._edge(src, dst)
+        self.sut = pagerank.IncrementalPagerankCalculator(
+            tolerance=1e-12, max_iterations=500)
+        self._calculate()
+
+        # Recrawl a few pages: drop their edges, link to a new page
+        added = self.g.upsert_link(graph.Link(url='added'))
+        for src in links[:5]:
+            self.g.remove_stale_edges(src.link_id, datetime.max)
+            self._edge(src, added)
+            self._edge(src, rng.choice(links))
+        self._edge(added, links[-1])
+        scores = self._calculate()
+        self.assertLessEqual(self.sut.changed_links, 6)
+
+        expected = pagerank.PagerankCalculator(
+            tolerance=1e-12, max_iterations=500)
+        pagerank.export_snapshot(self.g, self.path)
+        with graph_csr.CSRSnapshot(self.path) as snapshot:
+            expected_scores = dict(zip(pagerank.link_ids(snapshot),
+                                       expected.calculate(snapshot).tolist()))
+        for link_id, score in expected_scores.items():
+            self.assertAlmostEqual(scores[link_id], score, places=9)
+
+    def test_incremental_falls_back_to_warm_start(self):
+        links = self._links(10)
+        self.sut = pagerank.IncrementalPagerankCalculator(tolerance=1e-10)
+        self._calculate()
+        for i, src in enumerate(links):
+            self._edge(src, links[(i + 1) % 10])
+        scores = self._calculate()
+        self.assertEqual(self.sut.changed_links, 10)
+        self.assertTrue(all(abs(score - 0.1) < 1e-9
+                            for score in scores.values()))
+
+    def test_run_updates_indexer(self):
+        links = self._links(3)
+        self._edge(links[0], links[1])
+        self._edge(links[2], links[1])
+        documents = indexer.IndexerInMemory()
+        self.sut.run(self.g, documents, directory=self.directory.name)
+        ranks = {link.link_id: documents.find_document_by_link_id(
+            link.link_id).pagerank for link in links}
+        self.assertGreater(ranks[links[1].link_id], ranks[links[0].link_id])
+        self.assertAlmostEqual(sum(ranks.values()), 1.0)
+
+    def test_export_snapshot_from_iterators(self):
+        sqlite = graph_sqlite.GraphSQLite(
+            os.path.join(self.directory.name, 'graph.db'))
+        links = [sqlite.upsert_link(graph.Link(url=str(i)))
+                 for i in range(5)]
+        for src, dst in [(0, 1), (0, 2), (3, 0), (4, 4)]:
+            sqlite.upsert_edge(graph.Edge(src=links[src].link_id,
+                                          dst=links[dst].link_id))
+        pagerank.export_snapshot(sqlite, self.path)
+        sqlite.close()
+        with graph_csr.CSRSnapshot(self.path) as snapshot:
+            exported = {(snapshot.link_id(row), snapshot.link_id(target))
+                        for row in range(snapshot.link_count)
+                        for target in snapshot.out_rows(row)}
+        self.assertEqual(exported, {(links[src].link_id, links[dst].link_id)
+                                    for src, dst in
+                                    [(0, 1), (0, 2), (3, 0), (4, 4)]})
+
+    def test_empty_graph(self):
+        self.assertEqual(self._calculate(), {})
+
+    def _links(self, count: int):
+        return [self.g.upsert_link(graph.Link(url=str(i)))
+                for i in range(count)]
+
+    def _edge(self, src: graph.Link, dst: graph.Link):
+        self.g.upsert_edge(graph.Edge(src=src.link_id, dst=dst.link_id))
+
+    def _calculate(self) -> dict:
+        pagerank.export_snapshot(self.g, self.path)
+        with graph_csr.CSRSnapshot(self.path) as snapshot:
+            scores = self.sut.calculate(snapshot)
+            return dict(zip(pagerank.link_ids(snapshot), scores.tolist()))
+
+
+if __name__ == '__main__':
+    unittest.main()